@@ -0,0 +1,150 @@
+#
+# This file is part of Python-REST. Python-REST is free software that is
+# made available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-REST is copyright (c) 2010 by the Python-REST authors. See the file
+# "AUTHORS" for a complete overview.
+
+"""Compare the regular expression based parser for parameterized HTTP
+headers in rest.http against the original character based state machine,
+on Accept headers as sent by browsers and HTTP libraries. Also time content
+negotiation with and without the negotiation cache.
+Run as: python bench/bench_http.py"""
+
+import sys
+import os.path
+import timeit
+import itertools
+from collections import namedtuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+from rest import http
+from rest.http import _parse_parameterized_list
+
+
+HEADERS = [
+    ('firefox', 'text/html,application/xhtml+xml,application/xml;q=0.9,'
+                'image/avif,image/webp,*/*;q=0.8'),
+    ('chrome', 'text/html,application/xhtml+xml,application/xml;q=0.9,'
+               'image/avif,image/webp,image/apng,*/*;q=0.8,'
+               'application/signed-exchange;v=b3;q=0.7'),
+    ('curl', '*/*'),
+    ('requests', 'application/json'),
+    ('sdk', 'application/json; charset="utf-8", text/x-yaml; q=0.5, '
+            'text/xml; q=0.1'),
+    ('charset', 'ISO-8859-1,utf-8;q=0.7,*;q=0.7'),
+]
+
+
+def state_machine_parse(header):
+    """The original parser: a character based state machine."""
+    (s_sync_header, s_read_header, s_sync_parameter, s_read_parameter,
+     s_sync_value, s_read_value, s_read_quoted_value,
+     s_read_quoted_value_escape, s_sync_header_or_parameter) = range(9)
+    state = namedtuple('state', ('state', 'header', 'parameter', 'value', 'options'))
+    state.state = s_sync_header
+    result = []
+    for ch in itertools.chain(' ', header, ','):
+        if state.state == s_sync_header:
+            if ch != ' ':
+                state.state = s_read_header
+                state.header = ch
+                state.options = []
+        elif state.state == s_read_header:
+            if ch == ',':
+                result.append((state.header, state.options))
+                state.state = s_sync_header
+            elif ch == ';':
+                state.state = s_sync_parameter
+            else:
+                state.header += ch
+        elif state.state == s_sync_parameter:
+            if ch != ' ':
+                state.state = s_read_parameter
+                state.parameter = ch
+        elif state.state == s_read_parameter:
+            if ch == '=':
+                state.state = s_sync_value
+            else:
+                state.parameter += ch
+        elif state.state == s_sync_value:
+            if ch == '"':
+                state.state = s_read_quoted_value
+                state.value = ''
+            elif ch != ' ':
+                state.state = s_read_value
+                state.value = ch
+        elif state.state == s_read_value:
+            if ch == ',':
+                state.options.append((state.parameter, state.value))
+                result.append((state.header, state.options))
+                state.state = s_sync_header
+            elif ch == ';':
+                state.options.append((state.parameter, state.value))
+                state.state = s_sync_parameter
+            else:
+                state.value += ch
+        elif state.state == s_read_quoted_value:
+            if ch == '\\':
+                state.state = s_read_quoted_value_escape
+            elif ch == '"':
+                state.options.append((state.parameter, state.value))
+                state.state = s_sync_header_or_parameter
+            else:
+                state.value += ch
+        elif state.state == s_read_quoted_value_escape:
+            state.value += ch
+            state.state = s_read_quoted_value
+        elif state.state == s_sync_header_or_parameter:
+            if ch == ',':
+                result.append((state.header, state.options))
+                state.state = s_sync_header
+            elif ch == ';':
+                state.state = s_sync_parameter
+            else:
+                raise ValueError, 'Could not parse HTTP header.'
+    if state.state != s_sync_header:
+        raise ValueError, 'Could not parse HTTP header.'
+    return result
+
+
+
+def bench(number=20000):
+    for name, header in HEADERS:
+        assert _parse_parameterized_list(header) == \
+                state_machine_parse(header)
+        regex = timeit.timeit(lambda: _parse_parameterized_list(header),
+                              number=number)
+        machine = timeit.timeit(lambda: state_machine_parse(header),
+                                number=number)
+        print '%-10s  regex %8.2f us  state machine %8.2f us  (%.1fx)' % \
+                (name, 1e6 * regex / number, 1e6 * machine / number,
+                 machine / regex)
+
+
+def bench_negotiation(number=20000):
+    ctypes = ('text/xml', 'text/x-yaml', 'application/json')
+    parsed = map(http.parse_content_type, ctypes)
+    for name, header in HEADERS:
+        if name == 'charset':
+            continue
+        uncached = timeit.timeit(lambda:
+                http._select_content_type(ctypes, parsed, header),
+                number=number)
+        cached = timeit.timeit(lambda:
+                http.select_content_type(ctypes, header, parsed),
+                number=number)
+        print '%-10s  cached %7.2f us  uncached %8.2f us  (%.1fx)' % \
+                (name, 1e6 * cached / number, 1e6 * uncached / number,
+                 uncached / cached)
+
+
+def main():
+    bench()
+    bench_negotiation()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#
+# This file is part of Python-REST. Python-REST is free software that is
+# made available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-REST is copyright (c) 2010 by the Python-REST authors. See the file
+# "AUTHORS" for a complete overview.
+
+"""Measure requests/sec over loopback with a new connection per request
+and with one persistent connection, for the threaded built-in server and
+the event loop server. Run as: python bench/bench_keepalive.py"""
+
+import sys
+import time
+import os.path
+import logging
+from threading import Thread
+from httplib import HTTPConnection
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+from rest import Application, Collection, Resource
+from rest.server import make_server
+from rest.eventserver import make_server as make_event_server
+
+
+class BookCollection(Collection):
+
+    name = 'books'
+    contains = 'book'
+
+    entity_transform = """
+        $!type <=> $!type
+        $id <=> $id
+        $title <=> $title
+        """
+
+    def show(self, id):
+        return Resource('book', { 'id': id, 'title': 'Book %s' % id })
+
+
+class BookApplication(Application):
+
+    def setup_collections(self):
+        self.add_collection(BookCollection())
+
+
+def run_requests(address, number, reuse):
+    client = HTTPConnection(*address)
+    start = time.time()
+    for i in range(number):
+        if not reuse:
+            client = HTTPConnection(*address)
+            client.request('GET', '/api/books/1',
+                           headers={ 'Connection': 'close' })
+        else:
+            client.request('GET', '/api/books/1')
+        response = client.getresponse()
+        response.read()
+        if not reuse:
+            client.close()
+    client.close()
+    return number / (time.time() - start)
+
+
+def bench(name, server, number=2000):
+    thread = Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        address = server.socket.getsockname()
+        run_requests(address, 100, True)  # warm up
+        close = run_requests(address, number, False)
+        reuse = run_requests(address, number, True)
+        print '%-12s  new connection %8.0f req/s  reused %8.0f req/s  ' \
+              '(%.1fx)' % (name, close, reuse, reuse / close)
+    finally:
+        server.shutdown()
+        thread.join()
+
+
+def main():
+    logging.getLogger('rest').setLevel(logging.WARNING)
+    bench('threaded', make_server('localhost', 0, BookApplication(),
+                                  threads=4))
+    bench('event loop', make_event_server('localhost', 0, BookApplication(),
+                                          threads=4))
+
+
+if __name__ == '__main__':
+    main()
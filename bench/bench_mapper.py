@@ -0,0 +1,94 @@
+#
+# This file is part of Python-REST. Python-REST is free software that is
+# made available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-REST is copyright (c) 2010 by the Python-REST authors. See the file
+# "AUTHORS" for a complete overview.
+
+"""Compare the route tree and the reverse routing index in rest.mapper
+against a linear scan over all routes. Run as: python bench/bench_mapper.py"""
+
+import sys
+import os.path
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+from rest.mapper import Mapper
+
+
+def linear_match(mapper, url, method=None):
+    """The original matcher: try every route in order."""
+    for route in mapper.routes:
+        match = route._match(url, method)
+        if match:
+            return match
+
+
+def linear_url_for(mapper, **kwargs):
+    """The original reverse matcher: try every route in order."""
+    for route in mapper.routes:
+        url = route._url_for(**kwargs)
+        if url:
+            return url
+
+
+def make_mapper(nroutes):
+    """Create a mapper with `nroutes' routes, shaped like the routes that
+    rest.protocol connects for a number of collections."""
+    mapper = Mapper()
+    ncollections = max(1, nroutes // 5)
+    for i in range(ncollections):
+        base = '/api/collection%d' % i
+        mapper.connect(base, method='GET', action='list', collection=i)
+        mapper.connect(base, method='POST', action='create', collection=i)
+        mapper.connect(base + '/:id', method='GET', action='show',
+                       collection=i)
+        mapper.connect(base + '/:id', method='PUT', action='update',
+                       collection=i)
+        mapper.connect(base + '/:id', method='DELETE', action='delete',
+                       collection=i)
+    return mapper
+
+
+def bench(nroutes, number=2000):
+    mapper = make_mapper(nroutes)
+    last = nroutes // 5 - 1
+    urls = [ ('first', '/api/collection0', 'GET'),
+             ('last', '/api/collection%d/10' % last, 'DELETE'),
+             ('miss', '/api/nonexistent/10', 'GET') ]
+    for name, url, method in urls:
+        assert mapper.match(url, method) == \
+                linear_match(mapper, url, method)
+        tree = timeit.timeit(lambda: mapper.match(url, method),
+                             number=number)
+        linear = timeit.timeit(lambda: linear_match(mapper, url, method),
+                               number=number)
+        print '%5d routes  %-6s  tree %8.2f us  linear %8.2f us  (%.1fx)' % \
+                (nroutes, name, 1e6 * tree / number, 1e6 * linear / number,
+                 linear / tree)
+
+
+def bench_url_for(nroutes, number=2000):
+    mapper = make_mapper(nroutes)
+    last = nroutes // 5 - 1
+    kwargs = { 'collection': last, 'action': 'show', 'id': 10 }
+    assert mapper.url_for(**kwargs) == linear_url_for(mapper, **kwargs)
+    index = timeit.timeit(lambda: mapper.url_for(**kwargs), number=number)
+    linear = timeit.timeit(lambda: linear_url_for(mapper, **kwargs),
+                           number=number)
+    print '%5d routes  url_for index %8.2f us  linear %8.2f us  (%.1fx)' % \
+            (nroutes, 1e6 * index / number, 1e6 * linear / number,
+             linear / index)
+
+
+def main():
+    for nroutes in (10, 100, 1000):
+        bench(nroutes)
+    for nroutes in (10, 100, 1000):
+        bench_url_for(nroutes)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,7 +8,7 @@
 
 from rest._version import *
 from rest.application import Application
-from rest.collection import Collection
+from rest.collection import Collection, Page
 from rest.resource import Resource
 from rest.request import Request
 from rest.response import Response
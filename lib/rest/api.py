@@ -6,10 +6,10 @@
 # Python-REST is copyright (c) 2010 by the Python-REST authors. See the file
 # "AUTHORS" for a complete overview.
 
-from rest.proxy import ObjectProxy
+from rest.proxy import ContextProxy
 
-application = ObjectProxy()
-collection = ObjectProxy()
-request = ObjectProxy()
-response = ObjectProxy()
-mapper = ObjectProxy()
+application = ContextProxy('application')
+collection = ContextProxy('collection')
+request = ContextProxy('request')
+response = ContextProxy('response')
+mapper = ContextProxy('mapper')
@@ -8,6 +8,7 @@
 
 import sys
 import logging
+import threading
 import traceback
 
 import rest
@@ -17,33 +18,368 @@ from rest.request import Request
 from rest.response import Response
 from rest.error import Error
 from rest.mapper import Mapper
+from rest.context import RequestContext, activate_context
+from rest.proxy import ContextProxy
+from rest.util import is_iterator
 from rest import http
 
 
+class Flight(object):
+    """A request that is being handled, and that identical requests can
+    wait for."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+
+
+class Coalescer(object):
+    """Coalesce identical concurrent requests.
+
+    The first request for a key becomes the leader, and is handled as
+    usual. Requests that arrive while the leader is running wait for its
+    result instead. The number of requests that were served this way is
+    kept in `coalesced'. Requests that waited in vain, because the leader
+    failed or streamed its response, are counted in `fallbacks'.
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+
+    def join(self, key):
+        """Join the flight for `key'. Return a tuple (flight, leader)."""
+        with self._lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self.flights[key] = Flight()
+            self.leaders += 1
+            return flight, True
+
+    def finish(self, key, flight, result):
+        """Finish the flight for `key' of a leader, and wake up the
+        followers. `result' is None if it cannot be shared."""
+        with self._lock:
+            del self.flights[key]
+        flight.result = result
+        flight.event.set()
+
+    def wait(self, flight, timeout):
+        """Wait for the result of `flight' as a follower. Return None if
+        there is no result to share."""
+        flight.event.wait(timeout)
+        result = flight.result
+        with self._lock:
+            if result is None:
+                self.fallbacks += 1
+            else:
+                self.coalesced += 1
+        return result
+
+    def stats(self):
+        """Return a dictionary with the counters."""
+        with self._lock:
+            return { 'leaders': self.leaders, 'coalesced': self.coalesced,
+                     'fallbacks': self.fallbacks }
+
+
+class Dispatcher(object):
+    """Dispatch a single request.
+
+    A dispatcher is created by the application for every request. It is the
+    iterable that is returned to the WSGI server, and it contains all the
+    per-request state. It should be cheap to create.
+    """
+
+    def __init__(self, application, environ, start_response):
+        """Constructor."""
+        self.application = application
+        self.environ = environ
+        self.start_response = start_response
+        self.logger = application.logger
+        self.streamed = None
+        self.streaming = None
+        self.previous_context = None
+
+    def simple_response(self, status, headers=None, body=None):
+        """Send a simple text/plain response to the client."""
+        statusline = '%s %s' % (status, http.reasons[status])
+        headers = http.Headers(headers)
+        bodyless = status in (http.NO_CONTENT, http.NOT_MODIFIED)
+        if bodyless:
+            body = ''
+            headers.remove('Content-Length')
+        elif body is None:
+            body = '%s\n' % http.reasons[status]
+            headers.add('Content-Type', 'text/plain')
+        for name,value in self.application.Response.default_headers:
+            if name not in headers:
+                headers.add(name, value)
+        if 'Date' not in headers:
+            headers.add('Date', http.current_date())
+        if not bodyless and 'Content-Length' not in headers:
+            headers.add('Content-Length', str(len(body)))
+        self.start_response(statusline, headers.list)
+        return body
+
+    def register_globals(self, collection, request, response):
+        """Register global objects."""
+        context = RequestContext(self.application, collection, request,
+                                 response)
+        self.previous_context = activate_context(context)
+
+    def release_globals(self):
+        """Release globals."""
+        activate_context(self.previous_context)
+        self.previous_context = None
+
+    def __iter__(self):
+        """Create the response. The response is either one chunk of data,
+        or the chunks produced by a streaming action."""
+        try:
+            result = self.respond()
+        except Error, e:
+            self.logger.debug('Error response: %s' % e.status)
+            self.logger.debug('Reason: %s' % e.reason)
+            yield self.simple_response(e.status, e.headers, e.body)
+        except Exception, e:
+            self.logger.debug('Unknown exception: %s' % type(e))
+            tb = getattr(e, 'traceback', traceback.format_exc())
+            self.logger.debug('Traceback: %s' % tb)
+            yield self.simple_response(http.INTERNAL_SERVER_ERROR)
+        else:
+            if not is_iterator(result):
+                yield result
+                return
+            for chunk in result:
+                yield chunk
+
+    def stream(self, output):
+        """Produce the chunks of a streamed response. The globals stay
+        registered and the collection is not torn down until the output
+        is exhausted or the request is closed."""
+        try:
+            for chunk in output:
+                yield chunk
+        except Exception, e:
+            # The status and headers have already been sent. All we can do
+            # is log the error and let the server abort the response.
+            self.logger.debug('Exception while streaming: %s' % type(e))
+            tb = getattr(e, 'traceback', traceback.format_exc())
+            self.logger.debug('Traceback: %s' % tb)
+            raise
+        finally:
+            self._finish_stream()
+
+    def _finish_stream(self):
+        """INTERNAL: clean up after a streamed response."""
+        collection = self.streaming
+        if collection is None:
+            return
+        self.streaming = None
+        collection._teardown()
+        self.release_globals()
+
+    def _coalesce_key(self):
+        """INTERNAL: return the key under which this request can be
+        coalesced with identical requests, or None."""
+        app = self.application
+        env = self.environ
+        if not app.coalesce_requests or \
+                env['REQUEST_METHOD'] not in ('GET', 'HEAD') or \
+                env.get('CONTENT_LENGTH') not in (None, '', '0') or \
+                'HTTP_TRANSFER_ENCODING' in env:
+            return
+        return app.coalesce_key(env)
+
+    def respond(self):
+        """Respond to a request.
+
+        If enabled, identical concurrent requests with a safe method are
+        coalesced: only one of them is handled, and the others share its
+        response. Streamed responses and responses to requests that raised
+        an exception are not shared. In that case the waiting requests are
+        handled one at a time, each of them sharing its response again.
+        """
+        key = self._coalesce_key()
+        if key is None:
+            status, headers, output = self._respond()
+            self.start_response(status, headers)
+            return output
+        coalescer = self.application.coalescer
+        while True:
+            flight, leader = coalescer.join(key)
+            if leader:
+                break
+            result = coalescer.wait(flight, self.application.coalesce_timeout)
+            if result is not None:
+                self.logger.debug('Coalesced with an identical request')
+                status, headers, output = result
+                self.start_response(status, list(headers))
+                return output
+            if not flight.event.isSet():
+                # The leader takes too long, stop waiting for it.
+                status, headers, output = self._respond()
+                self.start_response(status, headers)
+                return output
+            # The leader had no response to share. Join again, so that only
+            # one of the waiting requests is handled next.
+        result = None
+        try:
+            status, headers, output = self._respond()
+            if not is_iterator(output):
+                result = (status, list(headers), output)
+        finally:
+            coalescer.finish(key, flight, result)
+        self.start_response(status, headers)
+        return output
+
+    def _respond(self):
+        """INTERNAL: handle the request. Return a tuple (status, headers,
+        output)."""
+        app = self.application
+        request = app.Request(self.environ)
+        response = app.Response(self.environ)
+        self.logger.debug('New request: %s %s' % (request.method, request.uri))
+        m, allowed = app.mapper.lookup(request.path, request.method)
+        if not m and allowed:
+            allow = ', '.join(allowed)
+            headers = [('Allow', allow), ('Allowed', allow)]
+            raise Error(http.METHOD_NOT_ALLOWED, headers,
+                        reason='Method not allowed')
+        elif not m:
+            raise Error(http.NOT_FOUND, reason='URL is not mapped')
+        self.logger.debug('URL mapped to %s:%s' % (m['collection'], m['action']))
+        request.match = m
+        request.allowed = allowed
+        collection = app.collections.get(m['collection'])
+        if not collection or not hasattr(collection, m['action']):
+            raise Error(http.NOT_FOUND, reason='Collection/action not found')
+        method = getattr(collection, m['action'])
+        request.limit(collection.max_input_size)
+        spooled = None
+        if collection.stream_input:
+            input = request.body
+            self.logger.debug('Streaming input')
+        elif collection.spool_input:
+            input = spooled = request.spool(collection.spool_threshold)
+            self.logger.debug('Spooled %d bytes of input' % request.bytes_read)
+        else:
+            input = request.read()
+            self.logger.debug('Read %d bytes of input' % len(input))
+        self.register_globals(collection, request, response)
+        collection._setup()
+        streaming = False
+        try:
+            self.logger.debug('Running input filters')
+            input = app.filter_input(m['collection'], m['action'], input)
+            # Input filters may change the arguments in request.args.
+            kwargs = request.args.copy()
+            for key in m:
+                if key not in ('collection', 'action'):
+                    kwargs[key] = m[key]
+            if input:
+                kwargs['input'] = input
+            output = method(**kwargs)
+            self.logger.debug('Running output filters')
+            output = app.filter_output(m['collection'], m['action'], output)
+            streaming = is_iterator(output)
+        except Exception, exception:
+            self.logger.debug('Exception occurred, running handlers.')
+            exception = app.handle_exception(m['collection'], m['action'],
+                                             exception)
+            if exception:
+                raise exception
+        finally:
+            if spooled:
+                spooled.close()
+            if not streaming:
+                collection._teardown()
+                self.release_globals()
+        if streaming:
+            self.logger.debug('Response: %s (%s; streamed)' %
+                        (response.status, response.header('Content-Type')))
+            self.streaming = collection
+            output = self.streamed = self.stream(output)
+        else:
+            self.logger.debug('Response: %s (%s; %d bytes)' %
+                        (response.status, response.header('Content-Type'),
+                         len(output)))
+            if response.status not in (http.NO_CONTENT, http.NOT_MODIFIED) \
+                    and response.header('Content-Length') is None:
+                response.set_header('Content-Length', str(len(output)))
+        status = '%s %s' % (response.status, http.reasons[response.status])
+        return status, response.headers.list, output
+
+    def close(self):
+        """Close the request. Called after every request by the WSGI
+        framework."""
+        if self.streamed is not None:
+            self.streamed.close()
+            self.streamed = None
+        self._finish_stream()
+
+
 class Application(object):
-    """A mini framework for creating RESTful APIs."""
+    """A mini framework for creating RESTful APIs.
+
+    An application is created once per process. The constructor loads all
+    modules and sets up the collections, routes and filters. After that,
+    the application is the WSGI callable: it creates a lightweight
+    Dispatcher for each request that it receives. The application is shared
+    between all requests and should not be modified once it is serving
+    requests.
+    """
     
     Request = Request
     Response = Response
     Mapper = Mapper
+    Dispatcher = Dispatcher
+
+    # If enabled, identical concurrent GET and HEAD requests are coalesced,
+    # see Dispatcher.respond() and coalesce_key().
+    coalesce_requests = False
+    coalesce_timeout = 30
+    coalesce_environ = ('REQUEST_METHOD', 'SCRIPT_NAME', 'PATH_INFO',
+                        'QUERY_STRING', 'HTTPS', 'wsgi.url_scheme',
+                        'AUTH_TYPE', 'REMOTE_USER')
 
-    def __init__(self, environ, start_response):
+    def __init__(self):
         """Constructor."""
-        self.environ = environ
-        self.start_response = start_response
         self.collections = {}
         self.mapper = self.Mapper()
         self.input_filters = {}
         self.output_filters = {}
         self.exception_handlers = {}
+        self._pipelines = {}
         self.modules = {}
+        self.globals = {}
         self.serial = 0
+        self.coalescer = Coalescer()
         self.logger = logging.getLogger('rest')
         self.load_modules()
         self.setup_collections()
         self.setup_routes()
         self.setup_filters()
 
+    def coalesce_key(self, environ):
+        """Return the key under which the request with WSGI environment
+        `environ' is coalesced with identical requests, or None if it must
+        not be coalesced. Requests are identical if all their HTTP headers
+        and the variables in `coalesce_environ' are equal.
+
+        An application that identifies users or sessions by anything else,
+        for example a value that a middleware puts in the environment, must
+        override this method."""
+        key = [ environ.get(name) for name in self.coalesce_environ ]
+        key += sorted([ (name, value) for name,value in environ.iteritems()
+                        if name.startswith('HTTP_') ])
+        return tuple(key)
+
     def _serial(self):
         """INTERNAL: return a monotonically increasing counter."""
         serial = self.serial
@@ -70,6 +406,7 @@ class Application(object):
         if key not in self.input_filters:
             self.input_filters[key] = []
         self.input_filters[key].append((priority, self._serial(), filter))
+        self._pipelines.clear()
 
     def add_output_filter(self, filter, collection=None, action=None, priority=50):
         """Add an output filter."""
@@ -77,6 +414,7 @@ class Application(object):
         if key not in self.output_filters:
             self.output_filters[key] = []
         self.output_filters[key].append((priority, self._serial(), filter))
+        self._pipelines.clear()
 
     def add_exception_handler(self, handler, collection=None, action=None, priority=50):
         """Add an exception handler."""
@@ -84,10 +422,18 @@ class Application(object):
         if key not in self.exception_handlers:
             self.exception_handlers[key] = []
         self.exception_handlers[key].append((priority, self._serial(), handler))
+        self._pipelines.clear()
 
     def setup_filters(self):
         """Implement this method in a subclass to add filters."""
 
+    def add_global(self, name, object):
+        """Add a global object. The object is made available as
+        `rest.api.<name>' during every request."""
+        self.globals[name] = object
+        if not hasattr(rest.api, name):
+            setattr(rest.api, name, ContextProxy(name))
+
     def load_module(self, modname):
         """Load all collections, routes, input filters, output filters and
         exception handlers from a module."""
@@ -118,146 +464,50 @@ class Application(object):
         for mod in self.modules:
             self.unload_module(mod)
 
+    def _pipeline(self, registry, collection, action):
+        """INTERNAL: return the ordered chain of filters or handlers from
+        `registry' that apply to `collection' and `action'. Chains are
+        computed once and cached until a filter or handler is added."""
+        key = (registry, collection, action)
+        try:
+            return self._pipelines[key]
+        except KeyError:
+            pass
+        filters = getattr(self, registry)
+        entries = []
+        keys = set([(collection, action), (None, action),
+                    (collection, None), (None, None)])
+        for fkey in keys:
+            entries += filters.get(fkey, [])
+        entries.sort(key=lambda x: x[0:2])
+        pipeline = tuple((entry[2] for entry in entries))
+        self._pipelines[key] = pipeline
+        return pipeline
+
     def filter_input(self, collection, action, input):
         """Filter input."""
-        filters = self.input_filters.get((collection, action), [])
-        filters += self.input_filters.get((None, action), [])
-        filters += self.input_filters.get((collection, None), [])
-        filters += self.input_filters.get((None, None), [])
-        filters.sort(lambda x,y: cmp(x[0:2], y[0:2]))
-        for prio, serial, filter in filters:
+        for filter in self._pipeline('input_filters', collection, action):
             input = filter.filter(input)
         return input
 
     def filter_output(self, collection, action, output):
-        """Filter input."""
-        filters = self.output_filters.get((collection, action), [])
-        filters += self.output_filters.get((None, action), [])
-        filters += self.output_filters.get((collection, None), [])
-        filters += self.output_filters.get((None, None), [])
-        filters.sort(lambda x,y: cmp(x[0:2], y[0:2]))
-        for prio, serial, filter in filters:
+        """Filter output."""
+        for filter in self._pipeline('output_filters', collection, action):
             output = filter.filter(output)
         return output
 
     def handle_exception(self, collection, action, exception):
         """Handle an exception."""
-        handlers = self.exception_handlers.get((collection, action), [])
-        handlers += self.exception_handlers.get((None, action), [])
-        handlers += self.exception_handlers.get((collection, None), [])
-        handlers += self.exception_handlers.get((None, None), [])
-        handlers.sort(lambda x,y: cmp(x[0:2], y[0:2]))
-        for prio, serial, handler in handlers:
+        for handler in self._pipeline('exception_handlers', collection,
+                                      action):
             exception = handler.handle(exception)
         return exception
 
-    def simple_response(self, status, headers=None, body=None):
-        """Send a simple text/plain response to the client."""
-        statusline = '%s %s' % (status, http.reasons[status])
-        if headers is None:
-            headers = []
-        if body is None:
-            body = '%s\n' % http.reasons[status]
-            headers.append(('Content-Type', 'text/plain'))
-        def has_header(name, headers):
-            for key,value in headers:
-                if key.lower() == name.lower():
-                    return True
-            return False
-        if not has_header('Date', headers):
-            headers.append(('Date', http.format_date()))
-        if not has_header('Server', headers):
-            version = '.'.join(map(str, rest.version))
-            headers.append(('Server', 'python-rest/%s' % version))
-        if not has_header('Content-Length', headers):
-            headers.append(('Content-Length', str(len(body))))
-        self.start_response(statusline, headers)
-        return body
-
-    def register_globals(self, collection, request, response):
-        """Register global objects."""
-        rest.api.request._register(request)
-        rest.api.response._register(response)
-        rest.api.collection._register(collection)
-        rest.api.mapper._register(self.mapper)
-        rest.api.application._register(self)
+    def __call__(self, environ, start_response):
+        """WSGI entry point. Return a new dispatcher for the request."""
+        return self.Dispatcher(self, environ, start_response)
 
-    def release_globals(self):
-        """Release globals."""
-        rest.api.request._release()
-        rest.api.response._release()
-        rest.api.collection._release()
-        rest.api.mapper._release()
-        rest.api.application._release()
-
-    def __iter__(self):
-        """Create the response. We always return just one chunk of data."""
-        try:
-            result = self.respond()
-        except Error, e:
-            self.logger.debug('Error response: %s' % e.status)
-            self.logger.debug('Reason: %s' % e.reason)
-            yield self.simple_response(e.status, e.headers, e.body)
-        except Exception, e:
-            self.logger.debug('Unknown exception: %s' % type(e))
-            tb = getattr(e, 'traceback', traceback.format_exc())
-            self.logger.debug('Traceback: %s' % tb)
-            yield self.simple_response(http.INTERNAL_SERVER_ERROR)
-        else:
-            yield result
-
-    def respond(self):
-        """Respond to a request."""
-        request = self.Request(self.environ)
-        response = self.Response(self.environ)
-        self.logger.debug('New request: %s %s' % (request.method, request.uri))
-        m = self.mapper.match(request.path, request.method)
-        if not m:
-            raise Error(http.NOT_FOUND, reason='URL is not mapped')
-        self.logger.debug('URL mapped to %s:%s' % (m['collection'], m['action']))
-        request.match = m
-        collection = self.collections.get(m['collection'])
-        if not collection or not hasattr(collection, m['action']):
-            raise Error(http.NOT_FOUND, reason='Collection/action not found')
-        method = getattr(collection, m['action'])
-        kwargs = request.args.copy()
-        for key in m:
-            if key not in ('collection', 'action'):
-                kwargs[key] = m[key]
-        input = request.read()
-        self.logger.debug('Read %d bytes of input' % len(input))
-        self.register_globals(collection, request, response)
-        collection._setup()
-        try:
-            self.logger.debug('Running input filters')
-            input = self.filter_input(m['collection'], m['action'], input)
-            if input:
-                kwargs['input'] = input
-            output = method(**kwargs)
-            self.logger.debug('Running output filters')
-            output = self.filter_output(m['collection'], m['action'], output)
-        except Exception, exception:
-            self.logger.debug('Exception occurred, running handlers.')
-            exception = self.handle_exception(m['collection'], m['action'],
-                                              exception)
-            if exception:
-                raise exception
-        finally:
-            collection._teardown()
-            self.release_globals()
-        self.logger.debug('Response: %s (%s; %d bytes)' %
-                     (response.status, response.header('Content-Type'),
-                      len(output)))
-        status = '%s %s' % (response.status, http.reasons[response.status])
-        self.start_response(status, response.headers)
-        return output
-
-    def close(self):
-        """Close the connection. Called after every request by the WSGI
-        framework."""
-        self.unload_modules()
-
-    @classmethod
-    def shutdown(cls):
+    def shutdown(self):
         """Shut down the application. Called once in the life time of a
         process. This is a python-rest specific extension to WSGI."""
+        self.unload_modules()
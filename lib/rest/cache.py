@@ -0,0 +1,269 @@
+#
+# This file is part of Python-REST. Python-REST is free software that is
+# made available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-REST is copyright (c) 2010 by the Python-REST authors. See the file
+# "AUTHORS" for a complete overview.
+
+import os
+import time
+import marshal
+import sqlite3
+import threading
+
+from rest.util import LRUCache
+
+
+class ResponseCache(object):
+    """Base class for caches of formatted responses.
+
+    A cache maps a key to the headers and body of a response. The first
+    element of a key is always the name of the collection that produced
+    the response, so that all responses of a collection can be invalidated
+    at once when it is modified.
+
+    Every collection has a generation number that is incremented when it
+    is invalidated. A response that was created while the collection was
+    being modified has an old generation number, and is not stored.
+    """
+
+    def get(self, key):
+        """Return a tuple (headers, body) for `key', or None."""
+        raise NotImplementedError
+
+    def put(self, key, headers, body, generation=None):
+        """Store a response under `key'. The headers are a list of (name,
+        value) tuples. If `generation' is given and the collection has
+        been invalidated since, the response is not stored."""
+        raise NotImplementedError
+
+    def generation(self, collection):
+        """Return the generation number of `collection'."""
+        raise NotImplementedError
+
+    def invalidate(self, collection):
+        """Remove all responses of the collection `collection' and
+        increment its generation number."""
+        raise NotImplementedError
+
+    def stats(self):
+        """Return a dictionary with statistics about the cache."""
+        raise NotImplementedError
+
+
+class MemoryCache(ResponseCache):
+    """An in-process response cache.
+
+    Responses expire `ttl' seconds after they are stored. At most `size'
+    responses are kept; when the cache is full the least recently used
+    response is discarded.
+    """
+
+    def __init__(self, size=1024, ttl=60):
+        self.ttl = ttl
+        self.entries = LRUCache(size)
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidations = 0
+        self.generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return
+            expires, headers, body = entry
+            if expires < time.time():
+                self.entries.remove(key)
+                self.expired += 1
+                self.misses += 1
+                return
+            self.hits += 1
+        return headers, body
+
+    def put(self, key, headers, body, generation=None):
+        with self._lock:
+            if generation is not None and \
+                    generation != self.generations.get(key[0], 0):
+                return
+            self.entries.put(key, (time.time() + self.ttl, headers, body))
+
+    def generation(self, collection):
+        return self.generations.get(collection, 0)
+
+    def invalidate(self, collection):
+        with self._lock:
+            self.generations[collection] = \
+                    self.generations.get(collection, 0) + 1
+            self.invalidations += 1
+            for key in self.entries.keys():
+                if key[0] == collection:
+                    self.entries.remove(key)
+
+    def stats(self):
+        """Return a dictionary with the number of hits and misses, the hit
+        ratio, the number of expired responses and invalidations, and the
+        number of responses and their total size in bytes."""
+        size = 0
+        for key,(expires, headers, body) in self.entries.items():
+            size += len(body)
+            size += sum((len(name) + len(value) for name,value in headers))
+        with self._lock:
+            stats = { 'hits': self.hits, 'misses': self.misses,
+                      'expired': self.expired,
+                      'invalidations': self.invalidations }
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = float(stats['hits']) / lookups if lookups else 0.0
+        stats['entries'] = len(self.entries)
+        stats['size'] = size
+        return stats
+
+
+class SQLiteCache(ResponseCache):
+    """A response cache in an SQLite database, that is shared by all
+    processes on a host that use the same database file.
+
+    Invalidating a collection in one process removes its responses for
+    all processes. Responses expire `ttl' seconds after they are stored.
+    When there are more than `size' responses, the ones that expire first
+    are removed. The hit and miss counters in stats() are per process.
+    """
+
+    timeout = 5
+
+    def __init__(self, filename, size=10000, ttl=60):
+        self.filename = filename
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidations = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._create()
+
+    def _connection(self):
+        """INTERNAL: return the database connection of the current thread.
+        Connections are not shared with threads or forked processes."""
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.connection = sqlite3.connect(self.filename,
+                                               timeout=self.timeout,
+                                               isolation_level=None)
+            local.connection.execute('PRAGMA journal_mode=WAL')
+            local.connection.execute('PRAGMA synchronous=NORMAL')
+            local.pid = os.getpid()
+        return local.connection
+
+    def _create(self):
+        """INTERNAL: create the tables if they do not exist."""
+        connection = self._connection()
+        connection.execute('CREATE TABLE IF NOT EXISTS responses ('
+                           'key TEXT PRIMARY KEY, collection TEXT, '
+                           'expires REAL, headers BLOB, body BLOB)')
+        connection.execute('CREATE INDEX IF NOT EXISTS responses_collection '
+                           'ON responses (collection)')
+        connection.execute('CREATE TABLE IF NOT EXISTS generations ('
+                           'collection TEXT PRIMARY KEY, generation INTEGER)')
+
+    def _count(self, name):
+        """INTERNAL: increment the counter `name'."""
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get(self, key):
+        cursor = self._connection().execute(
+                'SELECT expires, headers, body FROM responses WHERE key = ?',
+                (repr(key),))
+        row = cursor.fetchone()
+        if row is None:
+            self._count('misses')
+            return
+        expires, headers, body = row
+        if expires < time.time():
+            self._count('expired')
+            self._count('misses')
+            return
+        self._count('hits')
+        return marshal.loads(str(headers)), str(body)
+
+    def put(self, key, headers, body, generation=None):
+        connection = self._connection()
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            if generation is None or \
+                    generation == self._generation(connection, key[0]):
+                connection.execute('INSERT OR REPLACE INTO responses '
+                                   'VALUES (?, ?, ?, ?, ?)',
+                                   (repr(key), key[0], now + self.ttl,
+                                    sqlite3.Binary(marshal.dumps(headers)),
+                                    sqlite3.Binary(body)))
+                self._prune(connection, now)
+        except:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def _prune(self, connection, now):
+        """INTERNAL: remove responses if there are more than `size'."""
+        count, = connection.execute('SELECT count(*) FROM responses') \
+                .fetchone()
+        if count <= self.size:
+            return
+        connection.execute('DELETE FROM responses WHERE expires < ?', (now,))
+        connection.execute('DELETE FROM responses WHERE key IN '
+                           '(SELECT key FROM responses ORDER BY expires '
+                           'LIMIT max(0, (SELECT count(*) FROM responses) '
+                           '- ?))', (self.size,))
+
+    def _generation(self, connection, collection):
+        """INTERNAL: return the generation number of `collection'."""
+        row = connection.execute('SELECT generation FROM generations '
+                                 'WHERE collection = ?',
+                                 (collection,)).fetchone()
+        return row[0] if row else 0
+
+    def generation(self, collection):
+        return self._generation(self._connection(), collection)
+
+    def invalidate(self, collection):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute('INSERT OR IGNORE INTO generations '
+                               'VALUES (?, 0)', (collection,))
+            connection.execute('UPDATE generations '
+                               'SET generation = generation + 1 '
+                               'WHERE collection = ?', (collection,))
+            connection.execute('DELETE FROM responses WHERE collection = ?',
+                               (collection,))
+        except:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        self._count('invalidations')
+
+    def stats(self):
+        """Return a dictionary with the number of hits and misses, the hit
+        ratio, the number of expired responses and invalidations of this
+        process, and the number of responses and their total size in bytes
+        in the database."""
+        connection = self._connection()
+        entries, size = connection.execute(
+                'SELECT count(*), sum(length(headers) + length(body)) '
+                'FROM responses').fetchone()
+        with self._lock:
+            stats = { 'hits': self.hits, 'misses': self.misses,
+                      'expired': self.expired,
+                      'invalidations': self.invalidations }
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = float(stats['hits']) / lookups if lookups else 0.0
+        stats['entries'] = entries
+        stats['size'] = size or 0
+        return stats
@@ -7,6 +7,20 @@
 # "AUTHORS" for a complete overview.
 
 
+class Page(object):
+    """One page of resources that is returned by the "list" action of a
+    paginated collection.
+
+    The opaque cursors `next' and `previous' identify the pages that
+    follow and precede this page. They are None if there is no such page.
+    """
+
+    def __init__(self, resources, next=None, previous=None):
+        self.resources = resources
+        self.next = next
+        self.previous = previous
+
+
 class Collection(object):
     """A RESTful collection.
 
@@ -16,6 +30,44 @@ class Collection(object):
 
     name = None
 
+    # If set, input filters and parsers get a file-like object from which
+    # the request entity is read incrementally, instead of a string.
+    stream_input = False
+
+    # If set, the request entity is read into a temporary file that is
+    # kept in memory up to `spool_threshold' bytes, and on disk beyond
+    # that. Input filters and parsers get the file instead of a string.
+    spool_input = False
+    spool_threshold = 1024 * 1024
+
+    # The maximum size in bytes of a request entity, or None for no limit.
+    max_input_size = None
+
+    # The "list" action returns pages of `page_size' resources, unless the
+    # client asks for another number with the "limit" argument. The client
+    # cannot ask for more than `max_page_size' resources.
+    page_size = 100
+    max_page_size = 1000
+
+    # If set, the "list" action receives the `limit', `offset' and `cursor'
+    # arguments of the requested page, and returns that page only, either
+    # as a list or as a Page. Otherwise it returns all resources, and the
+    # page is taken from those.
+    paginate = False
+
+    # If set, the "show" and "list" actions receive the fields that the
+    # client selected with the "fields" argument, as a list of paths like
+    # "author.name", so that they can load only those. The resources are
+    # pruned to the selected fields in any case.
+    fields_hint = False
+
+    def _get_etag(self, id=None):
+        """Return a version of the resource `id', or of the collection as a
+        whole if `id' is None, that changes whenever the resource changes.
+        It is used to create an entity tag before the action is run. Return
+        None if the version is not known, in which case the entity tag is
+        a hash of the formatted entity."""
+
     def _setup(self):
         """Called just before a request method is called."""
 
@@ -0,0 +1,55 @@
+#
+# This file is part of Python-REST. Python-REST is free software that is
+# made available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-REST is copyright (c) 2010 by the Python-REST authors. See the file
+# "AUTHORS" for a complete overview.
+
+import threading
+
+
+class RequestContext(object):
+    """The objects that are global during a single request.
+
+    Besides the fixed attributes below, the global objects that were added
+    to the application with Application.add_global() are available as
+    attributes.
+    """
+
+    def __init__(self, application, collection, request, response):
+        self.application = application
+        self.mapper = application.mapper
+        self.globals = application.globals
+        self.collection = collection
+        self.request = request
+        self.response = response
+
+    def __getattr__(self, name):
+        # Only called for names that are not a regular attribute.
+        try:
+            return self.__dict__['globals'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class _ContextLocal(threading.local):
+    """INTERNAL: holds the active request context of a thread."""
+
+    context = None
+
+
+_local = _ContextLocal()
+
+
+def current_context():
+    """Return the active request context, or None."""
+    return _local.context
+
+
+def activate_context(context):
+    """Make `context' the active request context. Return the context that
+    was active before, to be restored with activate_context() later."""
+    previous = _local.context
+    _local.context = context
+    return previous
@@ -9,6 +9,7 @@
 from rest import http
 from rest.api import request, response
 from rest.error import HTTPReturn
+from rest.util import is_iterator
 
 
 class Formatter(object):
@@ -16,22 +17,73 @@ class Formatter(object):
 
     def format(self, object, encoding=None):
         raise NotImplementedError
-        
+
+    def format_iter(self, objects, encoding=None):
+        """Format the resources from the iterator `objects' as a list.
+        Return an iterator that yields the formatted output in chunks.
+
+        This default implementation collects all resources first.
+        Formatters that support incremental output should override it.
+        """
+        yield self.format(list(objects), encoding)
+
 
 class FormatterManager(object):
+    """Format entities in the content type that the client prefers.
+
+    If the client accepts several content types equally well, the one that
+    comes first in `preference' is used. Other content types come after
+    those, in the order in which they were added.
+    """
 
     formatters = {}
+    content_types = ()
+    parsed_content_types = ()
+    preference = ('text/xml', 'application/json', 'text/x-yaml')
+    chunk_size = 16384
 
     @classmethod
     def add_formatter(self, content_type, formatter):
+        if content_type not in self.formatters:
+            preference = self.preference
+            def key(ctype):
+                if ctype in preference:
+                    return preference.index(ctype)
+                return len(preference)
+            ctypes = sorted(self.content_types + (content_type,), key=key)
+            self.content_types = tuple(ctypes)
+            self.parsed_content_types = tuple(map(http.parse_content_type,
+                                                  ctypes))
         self.formatters[content_type] = formatter
 
+    def _coalesce(self, chunks):
+        """Join small chunks into chunks of at least `chunk_size' bytes."""
+        buffer = []
+        buffered = 0
+        for chunk in chunks:
+            buffer.append(chunk)
+            buffered += len(chunk)
+            if buffered >= self.chunk_size:
+                yield ''.join(buffer)
+                buffer = []
+                buffered = 0
+        if buffer:
+            yield ''.join(buffer)
+
     def format(self, object):
-        """Format an entity."""
-        if not isinstance(object, dict) and not isinstance(object, list):
+        """Format an entity.
+
+        If `object' is an iterator, it is formatted as a list and an
+        iterator is returned that produces the output incrementally. In
+        this case no Content-Length header is set.
+        """
+        streaming = is_iterator(object)
+        if not isinstance(object, dict) and not isinstance(object, list) \
+                and not streaming:
             return object
         accept = request.header('Accept', '*/*')
-        ctype = http.select_content_type(self.formatters.keys(), accept)
+        ctype = http.select_content_type(self.content_types, accept,
+                                         self.parsed_content_types)
         if not ctype:
             raise HTTPReturn(http.NOT_ACCEPTABLE,
                     reason='No acceptable content-type in: %s' % accept)
@@ -41,7 +93,9 @@ class FormatterManager(object):
             raise HTTPReturn(http.NOT_ACCEPTABLE,
                     reason='No acceptable charset in: %s' % accept)
         formatter = self.formatters[ctype]
-        output = formatter.format(object, charset)
         response.set_header('Content-Type', '%s; charset=%s' % (ctype, charset))
+        if streaming:
+            return self._coalesce(formatter.format_iter(object, charset))
+        output = formatter.format(object, charset)
         response.set_header('Content-Length', str(len(output)))
         return output
@@ -22,6 +22,9 @@ class JSONParser(Parser):
 
     def parse(self, input, encoding):
         """Parse a JSON entity."""
+        # The json module cannot parse incrementally.
+        if hasattr(input, 'read'):
+            input = input.read()
         try:
             parsed = json.loads(input, encoding)
         except ValueError, err:
@@ -47,3 +50,12 @@ class JSONFormatter(Formatter):
         encoder = ResourceEncoder()
         output = json.dumps(object, encoding=encoding, cls=ResourceEncoder)
         return output
+
+    def format_iter(self, objects, encoding=None):
+        """Format resources as a JSON list, one resource at a time."""
+        yield '['
+        for ix,object in enumerate(objects):
+            if ix:
+                yield ', '
+            yield json.dumps(object, encoding=encoding, cls=ResourceEncoder)
+        yield ']'
@@ -29,7 +29,8 @@ class ParserManager(object):
         self.parsers[content_type] = parser
 
     def parse(self, input):
-        """Parse an entity."""
+        """Parse an entity. The entity is either a string, or a file-like
+        object that the parser reads incrementally."""
         ctype = request.header('Content-Type')
         if not ctype:
             raise HTTPReturn(http.BAD_REQUEST,
@@ -41,7 +42,7 @@ class ParserManager(object):
                     reason='Illegal Content-Type header [%s]' % ctype)
         ctype = '%s/%s' % (type, subtype)
         encoding = options.get('charset')
-        if not len(input):
+        if not input:
             raise HTTPReturn(http.BAD_REQUEST,
                     reason='No request entity provided')
         if ctype not in self.parsers:
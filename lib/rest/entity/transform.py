@@ -7,12 +7,45 @@
 # "AUTHORS" for a complete overview.
 
 import inspect
+from copy import copy
 
 from argproc import ArgumentProcessor
+from argproc.parser import RuleParser, Field
 from rest import http
 from rest.api import application, collection, request
 from rest.error import HTTPReturn
 from rest.entity.hint import Hints
+from rest.util import is_iterator
+
+
+def parse_fields(value):
+    """Parse a list of field paths like "id,title,author.name" into a tree
+    of field names, e.g. {'id': None, 'title': None, 'author': {'name':
+    None}}. None selects a whole field."""
+    tree = {}
+    for path in value.split(','):
+        names = path.strip().split('.')
+        if not all(names):
+            raise ValueError, 'Illegal field path: %s' % path
+        node = tree
+        for name in names[:-1]:
+            if name in node and node[name] is None:
+                break
+            node = node.setdefault(name, {})
+        else:
+            node[names[-1]] = None
+    return tree
+
+
+def format_fields(tree, prefix=''):
+    """Return the field paths in a tree of field names, as a list."""
+    paths = []
+    for name,subtree in sorted(tree.items()):
+        if subtree is None:
+            paths.append(prefix + name)
+        else:
+            paths += format_fields(subtree, '%s%s.' % (prefix, name))
+    return paths
 
 
 class Transformer(object):
@@ -20,6 +53,8 @@ class Transformer(object):
 
     def __init__(self):
         self._cache = {}
+        self._collections = {}
+        self._field_maps = {}
 
     def _get_namespace(self, collection):
         """Return the namespace for a collection."""
@@ -38,37 +73,116 @@ class Transformer(object):
             tags = collection._get_tags(tags, resource)
         return tags
 
+    def _find_collection(self, type, reverse):
+        """Return the collection that contains resources of type `type'."""
+        if reverse:
+            for col in application.collections.values():
+                proc = ArgumentProcessor(ignore_missing=True)
+                proc.rules(col.entity_transform)
+                result = proc.process({'!type': col.contains})
+                if result.get('!type') == type:
+                    return col
+        else:
+            for col in application.collections.values():
+                if col.contains == type:
+                    return col
+
+    def _get_collection(self, type, reverse):
+        """Return the collection that contains resources of type `type',
+        using a cache."""
+        key = (type, reverse)
+        if key not in self._collections:
+            self._collections[key] = self._find_collection(type, reverse)
+        return self._collections[key]
+
+    def _get_field_map(self, type):
+        """Return a map of the fields of the external representation of
+        internal resources of type `type', to the internal fields that they
+        are created from, or None if the resources are not transformed.
+
+        The values in the map are tuples (fields, field). `field' is the
+        internal field that is copied to the external one, or None if the
+        external field is computed. The key None holds the internal fields
+        that are required by the transformation.
+        """
+        if type in self._field_maps:
+            return self._field_maps[type]
+        col = self._get_collection(type, True)
+        if not col or not getattr(col, 'entity_transform', None):
+            field_map = None
+        else:
+            field_map = { None: ([], None) }
+            for rule in RuleParser().parse(col.entity_transform):
+                if rule.direction == '=>':
+                    continue
+                internal = rule.right.referenced_fields()
+                external = rule.left.assigned_fields()
+                direct = None
+                if isinstance(rule.right, Field) and len(external) == 1:
+                    direct = internal[0]
+                for name in external:
+                    fields = field_map.get(name, ([], None))[0]
+                    field_map[name] = (fields + internal, direct)
+                if rule.mandatory:
+                    field_map[None][0].extend(internal)
+        self._field_maps[type] = field_map
+        return field_map
+
+    def _prune(self, resource, fields, internal):
+        """Return a copy of `resource' that has only the fields in the tree
+        of field names `fields'. If `internal' is set, the resource is in
+        internal form, and the fields that are needed for the requested
+        external fields are kept."""
+        if isinstance(resource, list):
+            return [ self._prune(elem, fields, internal)
+                     for elem in resource ]
+        elif not isinstance(resource, dict) or fields is None:
+            return resource
+        field_map = None
+        if internal and '!type' in resource:
+            field_map = self._get_field_map(resource['!type'])
+        if field_map is not None:
+            keep = {}
+            for name in field_map[None][0]:
+                keep[name] = None
+            for name,subtree in fields.items():
+                names, direct = field_map.get(name, ((), None))
+                if direct is not None:
+                    # Keep the whole field if it is needed more than once.
+                    keep[direct] = subtree if direct not in keep else None
+                    continue
+                for field in names:
+                    keep[field] = None
+            fields = keep
+        pruned = resource.__class__.__new__(resource.__class__)
+        if '!type' in resource:
+            pruned['!type'] = resource['!type']
+        for name,subtree in fields.items():
+            if name in resource:
+                pruned[name] = self._prune(resource[name], subtree, internal)
+        return pruned
+
     def _get_transform(self, resource, reverse):
+        # The transformer lives as long as the application, so the cache
+        # is keyed on everything that goes into the argument processor.
         type = resource['!type']
-        if type not in self._cache:
-            if reverse:
-                for col in application.collections.values():
-                    proc = ArgumentProcessor(ignore_missing=True)
-                    proc.rules(col.entity_transform)
-                    result = proc.process({'!type': col.contains})
-                    if result.get('!type') == type:
-                        break
-                else:
-                    col = None
-            else:
-                for col in application.collections.values():
-                    if col.contains == type:
-                        break
-                else:
-                    col = None
-            if col and getattr(col, 'entity_transform', None):
-                proc = ArgumentProcessor()
-                proc.namespace = self._get_namespace(col)
-                proc.tags = self._get_tags(col, resource)
-                proc.rules(col.entity_transform)
-            else:
-                proc = None
-            self._cache[type] = proc
-        proc = self._cache[type]
-        return proc
+        col = self._get_collection(type, reverse)
+        if not col or not getattr(col, 'entity_transform', None):
+            return
+        tags = self._get_tags(col, resource)
+        key = (type, reverse, col.name, tuple(tags))
+        if key not in self._cache:
+            proc = ArgumentProcessor()
+            proc.namespace = self._get_namespace(col)
+            proc.tags = tags
+            proc.rules(col.entity_transform)
+            self._cache[key] = proc
+        return self._cache[key]
 
-    def _transform(self, resource, reverse, path=[]):
+    def _transform(self, resource, reverse, hints, path=[]):
+        # Never modify the resource in place: the caller may hold on to it.
         if isinstance(resource, dict):
+            resource = copy(resource)
             if '!type' not in resource:
                 if reverse:
                     raise HTTPReturn(http.INTERNAL_SERVER_ERROR,
@@ -76,7 +190,7 @@ class Transformer(object):
                 elif len(path) == 0:
                     type = collection.contains
                 else:
-                    type = self.hints.get(path).get('type')
+                    type = hints.get(path).get('type')
                     if type is None:
                         raise HTTPReturn(http.BAD_REQUEST,
                                          reason='No type hint for resource.')
@@ -84,7 +198,7 @@ class Transformer(object):
             path.append(None)
             for key,value in resource.items():
                 path[-1] = key
-                resource[key] = self._transform(value, reverse, path)
+                resource[key] = self._transform(value, reverse, hints, path)
             del path[-1]
             proc = self._get_transform(resource, reverse)
             if proc:
@@ -93,16 +207,38 @@ class Transformer(object):
                 else:
                     resource = proc.process(resource)
         elif isinstance(resource, list):
-            for ix,elem in enumerate(resource):
-                resource[ix] = self._transform(resource[ix], reverse, path)
+            resource = [ self._transform(elem, reverse, hints, path)
+                         for elem in resource ]
         return resource
 
-    def transform(self, resource, reverse=False):
+    def _transform_fields(self, resource, reverse, hints, fields):
+        """Transform a resource, keeping only `fields'. The resource is
+        pruned before the transformation already, so that fields that are
+        not needed are not transformed."""
+        if fields is None:
+            return self._transform(resource, reverse, hints, [])
+        resource = self._prune(resource, fields, reverse)
+        resource = self._transform(resource, reverse, hints, [])
+        return self._prune(resource, fields, False)
+
+    def _transform_iter(self, resources, reverse, hints, fields):
+        for resource in resources:
+            yield self._transform_fields(resource, reverse, hints, fields)
+
+    def transform(self, resource, reverse=False, fields=None):
         """Transform a resource between internal and external
-        representation."""
-        if not isinstance(resource, dict) and not isinstance(resource, list):
+        representation. If `resource' is an iterator, an iterator is
+        returned that transforms the resources as they are produced.
+
+        If `fields' is a tree of field names as returned by parse_fields(),
+        only those fields of the external representation are kept.
+        """
+        streaming = is_iterator(resource)
+        if not isinstance(resource, dict) and not isinstance(resource, list) \
+                and not streaming:
             return resource
         hints = Hints()
         hints.add_hints(getattr(collection, 'parse_hints', ''))
-        self.hints = hints
-        return self._transform(resource, reverse)
+        if streaming:
+            return self._transform_iter(resource, reverse, hints, fields)
+        return self._transform_fields(resource, reverse, hints, fields)
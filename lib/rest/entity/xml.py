@@ -13,6 +13,7 @@ from xml.etree import ElementTree as etree
 from xml.etree.ElementTree import Element
 from xml.parsers.expat import ExpatError
 
+from rest import http
 from rest.api import collection
 from rest.error import HTTPReturn
 from rest.resource import Resource
@@ -24,33 +25,42 @@ from rest.entity.hint import Hints
 class XMLParser(Parser):
     """Parse an XML Entity."""
 
-    def _convert(self, node, path=[]):
+    def _convert(self, node, hints, path=[]):
         """Convert an XML node into its native representation (a string,
         a list, or a Resource)."""
         if len(node) == 0:
             return node.text
         has_duplicates = len(set((child.tag for child in node))) != len(node)
-        if has_duplicates or self.hints.get(path).get('sequence'):
+        if has_duplicates or hints.get(path).get('sequence'):
             result = []
             path.append(None)
             for ix,child in enumerate(node):
                 path[-1] = '[%d]' % ix
-                result.append(self._convert(child, path))
+                result.append(self._convert(child, hints, path))
             del path[-1]
         else:
             result = Resource(node.tag)
             path.append(None)
             for child in node:
                 path[-1] = child.tag
-                result[child.tag] = self._convert(child, path)
+                result[child.tag] = self._convert(child, hints, path)
             del path[-1]
         return result
 
     _re_preamble_start = re.compile(r'<\?xml', re.I)
     _re_preamble_end = re.compile(r'\?>')
 
+    chunk_size = 16384
+
     def parse(self, input, encoding=None):
-        """Parse XML from `input' according to `encoding'."""
+        """Parse XML from `input' according to `encoding'. The input is
+        either a string or a file-like object, which is read and parsed
+        incrementally."""
+        if hasattr(input, 'read'):
+            stream = input
+            input = stream.read(self.chunk_size)
+        else:
+            stream = None
         if encoding and self._re_preamble_start.match(input):
             # The encoding from the HTTP header takes precedence. The preamble
             # is the only way in which we can pass it on to ElementTree.
@@ -58,21 +68,25 @@ class XMLParser(Parser):
             mobj = self._re_preamble_end.search(input)
             if mobj == None:
                 raise HTTPReturn(http.BAD_REQUEST, reason='Illegal XML input')
-            input = input[mobj.end()+1:]
+            input = input[mobj.end():]
         elif not encoding and not self._re_preamble_start.match(input):
             # RFC2616 section 3.7.1
             preamble = '<?xml version="1.0" encoding="utf-8" ?>'
         else:
             preamble = ''
+        parser = etree.XMLParser()
         try:
-            root = etree.fromstring(preamble + input)
-        except ExpatError, err:
+            parser.feed(preamble + input)
+            if stream is not None:
+                for data in iter(lambda: stream.read(self.chunk_size), ''):
+                    parser.feed(data)
+            root = parser.close()
+        except (ExpatError, SyntaxError), err:
             raise HTTPReturn(http.BAD_REQUEST,
                              reason='XML Error: %s' % str(err))
         hints = Hints()
         hints.add_hints(getattr(collection, 'parse_hints', ''))
-        self.hints = hints
-        resource = self._convert(root)
+        resource = self._convert(root, hints, [])
         return resource
 
 
@@ -134,9 +148,31 @@ class XMLFormatter(Formatter):
             root = Element(collection.name)
             for elem in output:
                 child = self._format(elem)
-                if child:
-                    root.append(child)
+                if child is None:
+                    continue
+                root.append(child)
         self._indent(root, 0)
         output = '<?xml version="1.0" encoding="%s" ?>\n' % encoding
         output += etree.tostring(root, encoding=encoding)
         return output
+
+    def format_iter(self, objects, encoding=None):
+        """Format resources as an XML list, one resource at a time. The
+        output is the same as that of format()."""
+        header = '<?xml version="1.0" encoding="%s" ?>\n' % encoding
+        name = collection.name
+        empty = True
+        for elem in objects:
+            child = self._format(elem)
+            if child is None:
+                continue
+            self._indent(child, 2)
+            chunk = '\n  ' + etree.tostring(child, encoding=encoding)
+            if empty:
+                chunk = '%s<%s>%s' % (header, name, chunk)
+                empty = False
+            yield chunk
+        if empty:
+            yield '%s<%s />' % (header, name)
+        else:
+            yield '\n</%s>' % name
@@ -30,6 +30,7 @@ class YAMLParser(Parser):
         # We can ignore the encoding as the YAML spec mandates either UTF-8
         # or UTF-16 with a BOM, which can be autodetected.
         # We use a Loader that turns unrecognized !tags into Resources.
+        # If the input is a file-like object, PyYAML reads it incrementally.
         try:
             parsed = yaml.load(input)
         except YAMLError, e:
@@ -41,12 +42,23 @@ class YAMLParser(Parser):
 class YAMLFormatter(Formatter):
     """Format an entity in native representation to YAML."""
 
-    def format(self, object, encoding=None):
+    def format(self, object, encoding=None, version=(1, 1)):
         """Format a resource as YAML under the specified encoding."""
         try:
             output = yaml.dump(object, default_flow_style=False,
-                               version=(1, 1), encoding=encoding)
+                               version=version, encoding=encoding)
         except YAMLError, e:
             raise HTTPReturn(http.INTERNAL_SERVER_ERROR,
                              reason='YAML dump error: %s' % str(e))
         return output
+
+    def format_iter(self, objects, encoding=None):
+        """Format resources as a YAML sequence, one resource at a time.
+        Dumping single element lists and concatenating the result gives
+        the same output as dumping the entire list."""
+        version = (1, 1)
+        for object in objects:
+            yield self.format([object], encoding, version)
+            version = None
+        if version:
+            yield self.format([], encoding, version)
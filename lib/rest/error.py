@@ -14,9 +14,9 @@ class Error(Exception):
     response will be made by the framework.
     """
 
-    def __init__(self, status, headers=[], body=None, reason=None):
+    def __init__(self, status, headers=None, body=None, reason=None):
         self.status = status
-        self.headers = headers
+        self.headers = headers if headers is not None else []
         self.body = body
         self.reason = reason  # The reason is only shown in the logs
 
@@ -0,0 +1,670 @@
+#
+# This file is part of Python-REST. Python-REST is free software that is
+# made available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-REST is copyright (c) 2010 by the Python-REST authors. See the file
+# "AUTHORS" for a complete overview.
+
+"""Event loop based HTTP/1.1 server.
+
+All connections are handled by a single `asyncore' event loop, so idle
+keep-alive connections only cost a socket and a small buffer. The event
+loop parses the requests itself and hands complete requests to a pool of
+threads that run the WSGI application. The responses are passed back to the
+event loop, which writes them out.
+"""
+
+import os
+import sys
+import time
+import errno
+import socket
+import urllib
+import logging
+import asyncore
+import asynchat
+import threading
+
+from Queue import Queue
+from collections import deque
+from tempfile import SpooledTemporaryFile
+
+from rest import http
+
+
+class Trigger(asyncore.file_dispatcher):
+    """Run callbacks in the event loop on behalf of other threads."""
+
+    def __init__(self, map):
+        self.callbacks = deque()
+        self.lock = threading.Lock()
+        rfd, self.wfd = os.pipe()
+        asyncore.file_dispatcher.__init__(self, rfd, map)
+        # The dispatcher works on a duplicate of the descriptor.
+        os.close(rfd)
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return False
+
+    def pull(self, callback, *args):
+        """Run `callback' with `args' from the event loop."""
+        self.lock.acquire()
+        try:
+            self.callbacks.append((callback, args))
+            os.write(self.wfd, 'x')
+        finally:
+            self.lock.release()
+
+    def handle_read(self):
+        try:
+            self.recv(8192)
+        except socket.error:
+            pass
+        while True:
+            self.lock.acquire()
+            try:
+                if not self.callbacks:
+                    break
+                callback, args = self.callbacks.popleft()
+            finally:
+                self.lock.release()
+            callback(*args)
+
+    def handle_close(self):
+        pass
+
+    def close(self):
+        asyncore.file_dispatcher.close(self)
+        os.close(self.wfd)
+
+
+class WorkerPool(object):
+    """A fixed pool of threads that run submitted jobs."""
+
+    def __init__(self, threads):
+        self.jobs = Queue()
+        self.workers = []
+        for i in range(threads):
+            worker = threading.Thread(target=self._run)
+            worker.setDaemon(True)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, function, *args):
+        """Run `function' with `args' in one of the threads."""
+        self.jobs.put((function, args))
+
+    def stop(self):
+        """Stop the threads after they finished all submitted jobs."""
+        for worker in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            function, args = job
+            function(*args)
+
+
+class HTTPChannel(asynchat.async_chat):
+    """A single HTTP connection.
+
+    Requests are parsed as they arrive. Pipelined requests are queued and
+    handed to the worker pool one at a time, so that the responses are sent
+    in order.
+
+    A worker thread that produces a response blocks while more than
+    `high_water' bytes of output are waiting to be sent, until no more than
+    `low_water' bytes are left. This keeps the memory that a response to a
+    slow client uses bounded.
+    """
+
+    def __init__(self, server, sock, address):
+        asynchat.async_chat.__init__(self, sock, server.map)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server = server
+        self.address = address
+        self.logger = server.logger
+        self.requests = deque()
+        self.busy = False
+        self.closing = False
+        self.closed = False
+        self.pending_error = None
+        self.handled = 0
+        self.last_activity = time.time()
+        self.outgoing = 0
+        self.output = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        """INTERNAL: prepare for reading the next request."""
+        self.state = 'headers'
+        self.buffer = []
+        self.buffered = 0
+        self.environ = None
+        self.body = None
+        self.body_size = 0
+        self.set_terminator('\r\n\r\n')
+
+    def readable(self):
+        return not self.closing and \
+                len(self.requests) < self.server.max_pipeline
+
+    def idle_time(self, now):
+        """Return the number of seconds that the connection has been
+        idle, or 0 if it is not idle."""
+        if self.busy or self.requests or self.producer_fifo or \
+                self.state != 'headers' or self.buffered:
+            return 0
+        return now - self.last_activity
+
+    def collect_incoming_data(self, data):
+        self.last_activity = time.time()
+        if self.state == 'discard':
+            return
+        elif self.state in ('body', 'chunk_data'):
+            self.body_size += len(data)
+            if self.server.max_body_size is not None and \
+                    self.body_size > self.server.max_body_size:
+                self.error(http.REQUEST_ENTITY_TOO_LARGE)
+                return
+            self.body.write(data)
+            return
+        self.buffered += len(data)
+        if self.buffered > self.server.max_header_size:
+            self.error(http.BAD_REQUEST)
+            return
+        self.buffer.append(data)
+
+    def found_terminator(self):
+        if self.closing:
+            return
+        data = ''.join(self.buffer)
+        self.buffer = []
+        self.buffered = 0
+        if self.state == 'headers':
+            if not data.strip():
+                return  # Tolerate empty lines between requests.
+            self._parse_headers(data)
+        elif self.state == 'body':
+            self._request_done()
+        elif self.state == 'chunk_size':
+            try:
+                size = int(data.split(';')[0].strip(), 16)
+            except ValueError:
+                self.error(http.BAD_REQUEST)
+                return
+            if size < 0:
+                self.error(http.BAD_REQUEST)
+            elif size == 0:
+                self.state = 'trailer'
+                self.set_terminator('\r\n')
+            else:
+                self.state = 'chunk_data'
+                self.set_terminator(size)
+        elif self.state == 'chunk_data':
+            self.state = 'chunk_end'
+            self.set_terminator('\r\n')
+        elif self.state == 'chunk_end':
+            if data:
+                self.error(http.BAD_REQUEST)
+                return
+            self.state = 'chunk_size'
+        elif self.state == 'trailer':
+            if not data:
+                self.environ['CONTENT_LENGTH'] = str(self.body_size)
+                self._request_done()
+
+    def _parse_headers(self, data):
+        """INTERNAL: parse the request line and headers into a WSGI
+        environment."""
+        lines = data.lstrip('\r\n').split('\r\n')
+        parts = lines[0].split()
+        if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+            self.error(http.BAD_REQUEST)
+            return
+        method, target, version = parts
+        if version not in ('HTTP/1.0', 'HTTP/1.1'):
+            self.error(http.HTTP_VERSION_NOT_SUPPORTED)
+            return
+        headers = {}
+        name = None
+        for line in lines[1:]:
+            if line[:1] in (' ', '\t') and name:
+                headers[name] += ' ' + line.strip()
+                continue
+            name, sep, value = line.partition(':')
+            if not sep:
+                self.error(http.BAD_REQUEST)
+                return
+            name = name.strip().upper().replace('-', '_')
+            value = value.strip()
+            if name in headers:
+                headers[name] += ', ' + value
+            else:
+                headers[name] = value
+        if '://' in target:
+            target = '/' + target.split('://', 1)[1].partition('/')[2]
+        path, sep, query = target.partition('?')
+        server = self.server
+        env = server.base_environ.copy()
+        env['REQUEST_METHOD'] = method
+        env['PATH_INFO'] = urllib.unquote(path)
+        env['QUERY_STRING'] = query
+        env['SERVER_PROTOCOL'] = version
+        env['REMOTE_ADDR'] = self.address[0]
+        for name in headers:
+            if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                env[name] = headers[name]
+            else:
+                env['HTTP_' + name] = headers[name]
+        self.environ = env
+        connection = headers.get('CONNECTION', '').lower()
+        if version == 'HTTP/1.1':
+            self.keep_alive = connection != 'close'
+        else:
+            self.keep_alive = connection == 'keep-alive'
+        self.handled += 1
+        if server.max_requests and self.handled >= server.max_requests:
+            self.keep_alive = False
+        encoding = headers.get('TRANSFER_ENCODING', 'identity').lower()
+        if encoding not in ('identity', 'chunked'):
+            self.error(http.NOT_IMPLEMENTED)
+            return
+        if encoding == 'chunked':
+            del env['HTTP_TRANSFER_ENCODING']
+            self.state = 'chunk_size'
+            self.set_terminator('\r\n')
+            length = None
+        else:
+            try:
+                length = int(headers.get('CONTENT_LENGTH', '0'))
+            except ValueError:
+                length = -1
+            if length < 0:
+                self.error(http.BAD_REQUEST)
+                return
+            if server.max_body_size is not None and \
+                    length > server.max_body_size:
+                self.error(http.REQUEST_ENTITY_TOO_LARGE)
+                return
+        if headers.get('EXPECT', '').lower() == '100-continue' and \
+                version == 'HTTP/1.1':
+            self.push('HTTP/1.1 100 Continue\r\n\r\n')
+        self.body = SpooledTemporaryFile(server.spool_threshold)
+        if length:
+            self.state = 'body'
+            self.set_terminator(length)
+        elif length == 0:
+            self._request_done()
+
+    def _request_done(self):
+        """INTERNAL: queue a completely read request."""
+        self.body.seek(0)
+        self.environ['wsgi.input'] = self.body
+        self.requests.append((self.environ, self.keep_alive))
+        if not self.keep_alive:
+            self.closing = True
+        self._reset()
+        self._next_request()
+
+    def _next_request(self):
+        """INTERNAL: run the next queued request, if any."""
+        if self.busy or self.closed:
+            return
+        if not self.requests:
+            if self.pending_error:
+                self._push_error(self.pending_error)
+                self.pending_error = None
+            if self.closing:
+                self.close_when_done()
+            return
+        self.busy = True
+        environ, keep_alive = self.requests.popleft()
+        self.server.pool.submit(self._run_request, environ, keep_alive)
+
+    def _run_request(self, environ, keep_alive):
+        """INTERNAL: run the application for one request. This runs in
+        one of the worker threads."""
+        writer = ResponseWriter(self, environ, keep_alive)
+        try:
+            try:
+                writer.run(self.server.application)
+            except socket.error:
+                writer.keep_alive = False
+            except Exception:
+                self.logger.exception('uncaught exception in application')
+                writer.abort()
+        finally:
+            environ['wsgi.input'].close()
+            self.server.trigger.pull(self._request_finished, writer)
+
+    def _request_finished(self, writer):
+        """INTERNAL: called in the event loop after a response has been
+        queued completely."""
+        self.busy = False
+        self.last_activity = time.time()
+        if not writer.keep_alive:
+            self.closing = True
+            self.pending_error = None
+            self.requests.clear()
+        self._next_request()
+
+    def send_from_thread(self, data):
+        """Queue response data from a worker thread. Wait while too much
+        output is waiting to be sent. Raise socket.error if the connection
+        is closed, or if the client did not read anything for `idle_timeout'
+        seconds."""
+        server = self.server
+        self.output.acquire()
+        try:
+            deadline = time.time() + server.idle_timeout
+            while self.outgoing > server.high_water and not self.closed:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    server.trigger.pull(self.close)
+                    raise socket.error(errno.ETIMEDOUT, 'Send timed out')
+                outgoing = self.outgoing
+                self.output.wait(min(remaining, server.poll_interval))
+                if self.outgoing < outgoing:
+                    deadline = time.time() + server.idle_timeout
+            if self.closed:
+                raise socket.error(errno.EPIPE, 'Connection closed')
+            self.outgoing += len(data)
+        finally:
+            self.output.release()
+        server.trigger.pull(self._push, data)
+
+    def _push(self, data):
+        if not self.closed:
+            asynchat.async_chat.push(self, data)
+
+    def _sent(self, size):
+        """INTERNAL: account for `size' bytes of output that have been
+        sent or dropped."""
+        self.output.acquire()
+        try:
+            self.outgoing -= size
+            if self.outgoing <= self.server.low_water:
+                self.output.notifyAll()
+        finally:
+            self.output.release()
+
+    def push(self, data):
+        self.output.acquire()
+        try:
+            self.outgoing += len(data)
+        finally:
+            self.output.release()
+        asynchat.async_chat.push(self, data)
+
+    def send(self, data):
+        sent = asynchat.async_chat.send(self, data)
+        if sent:
+            self._sent(sent)
+        return sent
+
+    def error(self, status):
+        """Send an error response after the responses to the requests
+        that are already queued, and close the connection."""
+        self.closing = True
+        self.pending_error = status
+        self.state = 'discard'
+        self.set_terminator(None)
+        self._next_request()
+
+    def _push_error(self, status):
+        body = '%s\n' % http.reasons[status]
+        self.push('HTTP/1.1 %d %s\r\n' % (status, http.reasons[status]) +
+                  'Content-Type: text/plain\r\n' +
+                  'Content-Length: %d\r\n' % len(body) +
+                  'Connection: close\r\n\r\n' + body)
+
+    def handle_close(self):
+        self.close()
+
+    def handle_error(self):
+        self.logger.debug('error on connection from %s', self.address[0],
+                          exc_info=True)
+        self.close()
+
+    def close(self):
+        self.closed = True
+        self.requests.clear()
+        asynchat.async_chat.close(self)
+        self.output.acquire()
+        try:
+            self.outgoing = 0
+            self.output.notifyAll()
+        finally:
+            self.output.release()
+
+
+class ResponseWriter(object):
+    """Frame the output of the application for a single request. Used
+    from a worker thread. The entity of a response to a HEAD request is
+    not sent."""
+
+    def __init__(self, channel, environ, keep_alive):
+        self.channel = channel
+        self.environ = environ
+        self.keep_alive = keep_alive
+        self.head = environ['REQUEST_METHOD'] == 'HEAD'
+        self.status = None
+        self.headers = None
+        self.headers_sent = False
+        self.chunked = False
+
+    def start_response(self, status, headers, exc_info=None):
+        if exc_info:
+            try:
+                if self.headers_sent:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+            finally:
+                exc_info = None
+        elif self.status is not None:
+            raise AssertionError('start_response() called twice')
+        self.status = status
+        self.headers = headers
+        return self.write
+
+    def run(self, application):
+        """Run `application' and send its output."""
+        result = application(self.environ, self.start_response)
+        try:
+            for data in result:
+                if data:
+                    self.write(data)
+            if not self.headers_sent:
+                self.channel.send_from_thread(self.format_headers(0))
+            if self.chunked:
+                self.channel.send_from_thread('0\r\n\r\n')
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    def write(self, data):
+        headers = ''
+        if not self.headers_sent:
+            headers = self.format_headers(None)
+        if self.head:
+            if headers:
+                self.channel.send_from_thread(headers)
+            return
+        if self.chunked:
+            data = '%x\r\n%s\r\n' % (len(data), data)
+        # Send the headers together with the first data, to avoid a
+        # separate small segment.
+        self.channel.send_from_thread(headers + data)
+
+    def format_headers(self, length):
+        """Format the status line and headers. The `length' is the length
+        of the entity if it is known, or None."""
+        if self.status is None:
+            raise AssertionError('write() before start_response()')
+        headers = [ (name, value) for name,value in self.headers
+                    if name.lower() not in ('connection', 'keep-alive') ]
+        names = [ name.lower() for name,value in headers ]
+        status = int(self.status[:3])
+        protocol = self.environ['SERVER_PROTOCOL']
+        if 'content-length' in names or status < 200 or \
+                status in (204, 304) or self.head:
+            pass
+        elif length is not None:
+            headers.append(('Content-Length', str(length)))
+        elif protocol == 'HTTP/1.1':
+            headers.append(('Transfer-Encoding', 'chunked'))
+            self.chunked = True
+        else:
+            self.keep_alive = False
+        if not self.keep_alive:
+            headers.append(('Connection', 'close'))
+        elif protocol == 'HTTP/1.0':
+            headers.append(('Connection', 'keep-alive'))
+        lines = ['%s %s' % (protocol, self.status)]
+        lines += [ '%s: %s' % header for header in headers ]
+        lines.append('\r\n')
+        self.headers_sent = True
+        return '\r\n'.join(lines)
+
+    def abort(self):
+        """Abort the response after an error in the application."""
+        if self.headers_sent:
+            # Nothing sensible can be sent anymore.
+            self.keep_alive = False
+            return
+        self.status = '500 %s' % http.reasons[http.INTERNAL_SERVER_ERROR]
+        self.headers = [('Content-Type', 'text/plain')]
+        body = '%s\n' % http.reasons[http.INTERNAL_SERVER_ERROR]
+        headers = self.format_headers(len(body))
+        if self.head:
+            body = ''
+        self.channel.send_from_thread(headers + body)
+
+
+class EventServer(asyncore.dispatcher):
+    """HTTP server based on an event loop and a pool of threads.
+
+    Connections are closed after `idle_timeout' seconds without activity
+    and after `max_requests' requests, if set.
+    """
+
+    threads = 10
+    idle_timeout = 60
+    max_requests = None
+    max_pipeline = 16
+    max_header_size = 65536
+    max_body_size = None
+    high_water = 256*1024
+    low_water = 64*1024
+    spool_threshold = 1024*1024
+    poll_interval = 0.5
+    request_queue_size = 128
+
+    def __init__(self, address, threads=None):
+        self.map = {}
+        asyncore.dispatcher.__init__(self, map=self.map)
+        self.logger = logging.getLogger('rest.server')
+        if threads is not None:
+            self.threads = threads
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(address)
+        self.listen(self.request_queue_size)
+        self.address = self.socket.getsockname()
+        host, port = self.address
+        self.base_environ = {
+            'SERVER_NAME': socket.getfqdn(host),
+            'SERVER_PORT': str(port),
+            'SCRIPT_NAME': '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False }
+        self.application = None
+        self.trigger = None
+        self.pool = None
+        self.serving = False
+        self.stopping = False
+        self.stopped = threading.Event()
+
+    def set_app(self, application):
+        self.application = application
+
+    def get_app(self):
+        return self.application
+
+    def handle_accept(self):
+        try:
+            pair = self.accept()
+        except socket.error:
+            return
+        if pair is None:
+            return
+        sock, address = pair
+        HTTPChannel(self, sock, address)
+
+    def serve_forever(self):
+        """Run the event loop until shutdown() is called."""
+        self.stopped.clear()
+        self.serving = True
+        self.trigger = Trigger(self.map)
+        self.pool = WorkerPool(self.threads)
+        last_check = time.time()
+        try:
+            while not self.stopping:
+                asyncore.loop(self.poll_interval, map=self.map, count=1)
+                now = time.time()
+                if now - last_check >= 1:
+                    self._close_idle(now)
+                    last_check = now
+        finally:
+            # Close the connections first. This wakes up workers that wait
+            # for output to drain, as nothing sends it anymore.
+            for dispatcher in self.map.values():
+                if isinstance(dispatcher, HTTPChannel):
+                    dispatcher.close()
+            self.pool.stop()
+            for dispatcher in self.map.values():
+                if dispatcher is not self:
+                    dispatcher.close()
+            self.trigger = None
+            self.serving = False
+            self.stopped.set()
+
+    def _close_idle(self, now):
+        """INTERNAL: close connections that have been idle for too long."""
+        for dispatcher in self.map.values():
+            if isinstance(dispatcher, HTTPChannel) and \
+                    dispatcher.idle_time(now) > self.idle_timeout:
+                dispatcher.close()
+
+    def shutdown(self):
+        """Stop serve_forever() and wait for it to finish."""
+        self.stopping = True
+        if self.serving:
+            self.stopped.wait()
+        self.server_close()
+        self.application.shutdown()
+
+    def server_close(self):
+        self.close()
+
+
+def make_server(host, port, app, threads=None):
+    """Create an event loop based server for `app' that runs the
+    application in a pool of `threads' threads."""
+    server = EventServer((host, port), threads)
+    server.set_app(app)
+    return server
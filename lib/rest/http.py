@@ -6,15 +6,17 @@
 # RHEVM-API is copyright (c) 2010 by the RHEVM-API authors. See the file
 # "AUTHORS" for a complete overview.
 
-import itertools
-from collections import namedtuple
+import re
+import time
 from httplib import responses as reasons
 from httplib import HTTP_PORT as PORT, HTTPS_PORT as SSL_PORT
 from email.utils import formatdate as format_date
+
+from rest.util import LRUCache
 try:
-    from urllib.parse import parse_qs
+    from urllib.parse import parse_qs, parse_qsl
 except ImportError:
-    from cgi import parse_qs
+    from cgi import parse_qs, parse_qsl
 
 
 # Export HTTP status codes
@@ -24,6 +26,29 @@ for key in reasons:
     globals()[name] = key
 
 
+# The formatted date of the current second, see current_date().
+_current_date = (None, None)
+
+
+def current_date():
+    """Return the current time formatted for a "Date" header. The value is
+    formatted at most once per second."""
+    global _current_date
+    now = int(time.time())
+    cached = _current_date
+    if cached[0] != now:
+        cached = _current_date = (now, format_date(now))
+    return cached[1]
+
+
+# A list element: the header value, up to the first "," or ";".
+_re_element = re.compile(' *([^ ][^,;]*)([,;])')
+# A parameter: name=value or name="quoted value", followed by "," or ";".
+_re_parameter = re.compile(r' *([^ ][^=]*)= *(?:"((?:[^"\\]|\\.)*)"([,;])'
+                           r'|([^ "][^,;]*)([,;]))', re.S)
+_re_escape = re.compile(r'\\(.)', re.S)
+
+
 def _parse_parameterized_list(header):
     """Parse a "parameterized list" HTTP header into a list of
     (header, options) tuples, with options a list of (name, value) tuples.
@@ -34,73 +59,28 @@ def _parse_parameterized_list(header):
 
       Header Value 1; param1=value1, Header Value 2; param2=value2
     """
-    (s_sync_header, s_read_header, s_sync_parameter, s_read_parameter,
-     s_sync_value, s_read_value, s_read_quoted_value,
-     s_read_quoted_value_escape, s_sync_header_or_parameter) = range(9)
-    state = namedtuple('state', ('state', 'header', 'parameter', 'value', 'options'))
-    state.state = s_sync_header
+    header += ','
+    pos = 0
+    end = len(header)
     result = []
-    for ch in itertools.chain(' ', header, ','):
-        if state.state == s_sync_header:
-            if ch != ' ':
-                state.state = s_read_header
-                state.header = ch
-                state.options = []
-        elif state.state == s_read_header:
-            if ch == ',':
-                result.append((state.header, state.options))
-                state.state = s_sync_header
-            elif ch == ';':
-                state.state = s_sync_parameter
-            else:
-                state.header += ch
-        elif state.state == s_sync_parameter:
-            if ch != ' ':
-                state.state = s_read_parameter
-                state.parameter = ch
-        elif state.state == s_read_parameter:
-            if ch == '=':
-                state.state = s_sync_value
-            else:
-                state.parameter += ch
-        elif state.state == s_sync_value:
-            if ch == '"':
-                state.state = s_read_quoted_value
-                state.value = ''
-            elif ch != ' ':
-                state.state = s_read_value
-                state.value = ch
-        elif state.state == s_read_value:
-            if ch == ',':
-                state.options.append((state.parameter, state.value))
-                result.append((state.header, state.options))
-                state.state = s_sync_header
-            elif ch == ';':
-                state.options.append((state.parameter, state.value))
-                state.state = s_sync_parameter
-            else:
-                state.value += ch
-        elif state.state == s_read_quoted_value:
-            if ch == '\\':
-                state.state = s_read_quoted_value_escape
-            elif ch == '"':
-                state.options.append((state.parameter, state.value))
-                state.state = s_sync_header_or_parameter
-            else:
-                state.value += ch
-        elif state.state == s_read_quoted_value_escape:
-            state.value += ch
-            state.state = s_read_quoted_value
-        elif state.state == s_sync_header_or_parameter:
-            if ch == ',':
-                result.append((state.header, state.options))
-                state.state = s_sync_header
-            elif ch == ';':
-                state.state = s_sync_parameter
-            else:
+    while pos < end:
+        mobj = _re_element.match(header, pos)
+        if not mobj:
+            raise ValueError, 'Could not parse HTTP header.'
+        value, sep = mobj.groups()
+        pos = mobj.end()
+        options = []
+        while sep == ';':
+            mobj = _re_parameter.match(header, pos)
+            if not mobj:
                 raise ValueError, 'Could not parse HTTP header.'
-    if state.state != s_sync_header:
-        raise ValueError, 'Could not parse HTTP header.'
+            name, quoted, qsep, option, sep = mobj.groups()
+            if quoted is not None:
+                option = _re_escape.sub(r'\1', quoted)
+                sep = qsep
+            options.append((name, option))
+            pos = mobj.end()
+        result.append((value, options))
     return result
 
 
@@ -119,33 +99,48 @@ def parse_content_type(header):
     return (type.lower(), subtype.lower(), options)
 
 
-def select_content_type(ctypes, accept_header):
-    """Select the most suitable content type from a list of supported content
-    types, based on the value of an "Accept" header.
-    """
-    # See RFC2616, section 14.1.
-    parsed = _parse_parameterized_list(accept_header)
-    accept_header = []
-    for header,options in parsed:
+# Clients send only a few distinct Accept headers, so the result of content
+# negotiation is cached. The caches are public so that their hit and miss
+# counters can be inspected.
+content_type_cache = LRUCache(256)
+charset_cache = LRUCache(256)
+encoding_cache = LRUCache(256)
+_missing = object()
+
+
+def _parse_accept(accept_header):
+    """INTERNAL: parse an "Accept" header into (type, subtype, options)
+    tuples."""
+    parsed = []
+    for header,options in _parse_parameterized_list(accept_header):
         try:
             type, subtype = header.split('/')
         except ValueError:
             raise ValueError, 'Could not parse Content-Type header'
         options = dict(((key.lower(), value) for key,value in options))
-        accept_header.append((type.lower(), subtype.lower(), options))
+        parsed.append((type.lower(), subtype.lower(), options))
+    return parsed
+
+
+def _select_content_type(ctypes, parsed_ctypes, accept_header):
+    """INTERNAL: uncached version of select_content_type()."""
+    # See RFC2616, section 14.1.
+    accept_header = _parse_accept(accept_header)
     candidates = []
     for ix,ctype in enumerate(ctypes):
-        supported = parse_content_type(ctype)
+        supported = parsed_ctypes[ix]
         matches = []
         for accepted in accept_header:
             if supported[0] != accepted[0] and accepted[0] != '*':
                 continue
             if supported[1] != accepted[1] and accepted[1] != '*':
                 continue
-            if accepted[2].has_key('q'):
-                supported[2]['q'] = accepted[2]['q']  # Ignore 'q'
-            if supported[2] != accepted[2] and accepted[2]:
-                continue
+            if accepted[2]:
+                options = supported[2].copy()
+                if accepted[2].has_key('q'):
+                    options['q'] = accepted[2]['q']  # Ignore 'q'
+                if options != accepted[2]:
+                    continue
             if accepted[0] == '*':
                 precedence = 0
             elif accepted[1] == '*':
@@ -162,12 +157,28 @@ def select_content_type(ctypes, accept_header):
         return
     candidates.sort()
     return candidates[-1][2]
-            
 
-def select_charset(charsets, accept_header):
-    """Select the most suitable charset to use from a list of supported
-    charset, based on the value of an "Accept-Charset" header.
+
+def select_content_type(ctypes, accept_header, parsed_ctypes=None):
+    """Select the most suitable content type from a list of supported content
+    types, based on the value of an "Accept" header.
+
+    If given, `parsed_ctypes' must contain the result of parse_content_type()
+    for each of `ctypes'. This avoids parsing them again.
     """
+    ctypes = tuple(ctypes)
+    key = (ctypes, accept_header)
+    ctype = content_type_cache.get(key, _missing)
+    if ctype is _missing:
+        if parsed_ctypes is None:
+            parsed_ctypes = map(parse_content_type, ctypes)
+        ctype = _select_content_type(ctypes, parsed_ctypes, accept_header)
+        content_type_cache.put(key, ctype)
+    return ctype
+
+
+def _select_charset(charsets, accept_header):
+    """INTERNAL: uncached version of select_charset()."""
     # See RFC2616, section 14.2.
     parsed = _parse_parameterized_list(accept_header)
     accept_header = []
@@ -193,3 +204,159 @@ def select_charset(charsets, accept_header):
         return
     candidates.sort()
     return candidates[-1][2]
+
+
+def select_charset(charsets, accept_header):
+    """Select the most suitable charset to use from a list of supported
+    charset, based on the value of an "Accept-Charset" header.
+    """
+    charsets = tuple(charsets)
+    key = (charsets, accept_header)
+    charset = charset_cache.get(key, _missing)
+    if charset is _missing:
+        charset = _select_charset(charsets, accept_header)
+        charset_cache.put(key, charset)
+    return charset
+
+
+def _select_encoding(encodings, accept_header):
+    """INTERNAL: uncached version of select_encoding()."""
+    # See RFC2616, section 14.3.
+    qvalues = {}
+    for header,options in _parse_parameterized_list(accept_header):
+        options = dict(((key.lower(), value) for key,value in options))
+        try:
+            qfactor = float(options.get('q', '1'))
+        except ValueError:
+            raise ValueError, 'Could not parse Accept-Encoding header'
+        qvalues[header.strip().lower()] = qfactor
+    candidates = []
+    for ix,encoding in enumerate(encodings):
+        qfactor = qvalues.get(encoding, qvalues.get('*', 0.0))
+        if qfactor > 0.0:
+            candidates.append((qfactor, -ix, encoding))
+    if not candidates:
+        return
+    candidates.sort()
+    qfactor, ix, encoding = candidates[-1]
+    if qfactor < qvalues.get('identity', 0.0):
+        return
+    return encoding
+
+
+def select_encoding(encodings, accept_header):
+    """Select the most suitable content coding from a list of supported
+    codings, based on the value of an "Accept-Encoding" header. Return None
+    if the entity should not be encoded.
+    """
+    encodings = tuple(encodings)
+    key = (encodings, accept_header)
+    encoding = encoding_cache.get(key, _missing)
+    if encoding is _missing:
+        encoding = _select_encoding(encodings, accept_header)
+        encoding_cache.put(key, encoding)
+    return encoding
+
+
+_re_etag = re.compile(r'(?:W/)?("[^"]*")')
+
+
+def match_etag(etag, header):
+    """Return True if the entity tag `etag' matches the value of an
+    "If-None-Match" header. Tags are compared with the weak comparison
+    function."""
+    # See RFC2616, section 13.3.3 and 14.26.
+    if header.strip() == '*':
+        return True
+    opaque = _re_etag.match(etag)
+    if not opaque:
+        return False
+    return opaque.group(1) in _re_etag.findall(header)
+
+
+class Headers(object):
+    """An ordered multimap of HTTP headers with case-insensitive names.
+
+    The headers are kept in `list' as (name, value) tuples, which is the
+    form that a WSGI start_response() expects, so they can be passed on
+    without a copy. `index' maps every lower case header name to the
+    positions of its entries in `list'.
+    """
+
+    def __init__(self, headers=None):
+        self.list = []
+        self.index = {}
+        if headers:
+            for name,value in headers:
+                self.add(name, value)
+
+    def copy(self):
+        """Return a copy of these headers."""
+        headers = Headers()
+        headers.list = self.list[:]
+        headers.index = dict(((name, positions[:]) for name,positions
+                              in self.index.iteritems()))
+        return headers
+
+    def _remove_positions(self, positions):
+        """INTERNAL: remove the entries at `positions' from the list and
+        rebuild the index."""
+        positions = set(positions)
+        self.list[:] = [ self.list[i] for i in range(len(self.list))
+                         if i not in positions ]
+        self.index = {}
+        for i in range(len(self.list)):
+            key = self.list[i][0].lower()
+            self.index.setdefault(key, []).append(i)
+
+    def get(self, name, default=None):
+        """Return the first value of header `name', or `default'."""
+        positions = self.index.get(name.lower())
+        if not positions:
+            return default
+        return self.list[positions[0]][1]
+
+    def get_all(self, name):
+        """Return all values of header `name' as a list."""
+        return [ self.list[i][1] for i in self.index.get(name.lower(), ()) ]
+
+    def add(self, name, value):
+        """Add a header, keeping any existing headers with the same
+        name."""
+        self.index.setdefault(name.lower(), []).append(len(self.list))
+        self.list.append((name, value))
+
+    def set(self, name, value):
+        """Set a header, replacing any existing headers with the same
+        name. The header keeps the position of the first one."""
+        positions = self.index.get(name.lower())
+        if not positions:
+            self.add(name, value)
+            return
+        self.list[positions[0]] = (name, value)
+        if len(positions) > 1:
+            self._remove_positions(positions[1:])
+
+    def remove(self, name):
+        """Remove all headers called `name'."""
+        positions = self.index.get(name.lower())
+        if positions:
+            self._remove_positions(positions)
+
+    def __contains__(self, item):
+        """Test for a header name, or for a (name, value) tuple."""
+        if isinstance(item, tuple):
+            return item in self.list
+        return item.lower() in self.index
+
+    def __len__(self):
+        return len(self.list)
+
+    def __iter__(self):
+        return iter(self.list)
+
+    def __getitem__(self, i):
+        return self.list[i]
+
+    def __repr__(self):
+        return 'Headers(%r)' % self.list
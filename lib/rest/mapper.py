@@ -10,15 +10,19 @@
 This module contains trivial re-implementation of Python Routes. It is
 not near as feature complete but it small and it removes an external
 dependency.
+
+Routes are stored in a tree that is indexed on path segments, so that
+matching a URL only looks at the routes that share its prefix. When more
+than one route matches a URL, the route that was connected first wins.
 """
 
 import re
-from string import Template
 
 
 class Route(object):
 
     _re_var = re.compile(':([a-z][a-z0-9_]*)|{([a-z][a-z0-9_]*)}', re.I)
+    _re_special = re.compile(r'[.^$*+?\[\]\\|()]')
 
     def __init__(self, path, method=None, **kwargs):
         self.path = path
@@ -28,18 +32,56 @@ class Route(object):
         self.pattern = '^%s$' % self._re_var.sub(self._replace_var_names,
                                                  self.path)
         self.regex = re.compile(self.pattern)
-        self.template = Template(self._re_var.sub(self._template_var_names,
-                                                  self.path))
+        self.formatnames = []
+        self.format = self._re_var.sub(self._format_var_names,
+                                       self.path.replace('%', '%%'))
+        self.segments = self._parse_segments(path)
 
     def _replace_var_names(self, mobj):
         name = mobj.group(1) or mobj.group(2)
         self.varnames.append(name)
         return '(?P<%s>[^/]+)' % name
 
-    def _template_var_names(self, mobj):
+    def _segment_var_names(self, mobj):
+        name = mobj.group(1) or mobj.group(2)
+        return '(?P<%s>[^/]+)' % name
+
+    def _format_var_names(self, mobj):
         name = mobj.group(1) or mobj.group(2)
-        return '$%s' % name
-        
+        self.formatnames.append(name)
+        return '%s'
+
+    def _parse_segments(self, path):
+        """Split a path into a list of (kind, value) segments. The kind is
+        'static' for a literal segment, 'variable' for a segment that
+        consists of a single variable, and 'pattern' for anything else."""
+        segments = []
+        for segment in path.split('/'):
+            mobj = self._re_var.match(segment)
+            if mobj and mobj.end() == len(segment):
+                name = mobj.group(1) or mobj.group(2)
+                segments.append(('variable', name))
+            elif self._re_var.search(segment) or \
+                    self._re_special.search(segment):
+                pattern = '^%s$' % self._re_var.sub(self._segment_var_names,
+                                                    segment)
+                segments.append(('pattern', re.compile(pattern)))
+            else:
+                segments.append(('static', segment))
+        return segments
+
+    def _match_segments(self, segments):
+        """Create a match for a list of URL segments. The segments must
+        already be known to match this route."""
+        match = {}
+        for (kind, value), segment in zip(self.segments, segments):
+            if kind == 'variable':
+                match[value] = segment
+            elif kind == 'pattern':
+                match.update(value.match(segment).groupdict())
+        match.update(self.kwargs)
+        return match
+
     def _match(self, url, method=None):
         mobj = self.regex.match(url)
         if not mobj:
@@ -62,35 +104,207 @@ class Route(object):
             args.remove(arg)
         if args:
             return
-        url = self.template.substitute(kwargs)
+        return self._build(kwargs)
+
+    def _build(self, kwargs):
+        """Build a URL for this route. The arguments must already be known
+        to match this route."""
+        url = self.format % tuple([ kwargs[name]
+                                    for name in self.formatnames ])
         return url
 
 
+class _Node(object):
+    """INTERNAL: a node in the route tree."""
+
+    def __init__(self):
+        self.static = {}
+        self.variable = None
+        self.patterns = []
+        self.routes = []
+        self.methods = ()
+        self.first = None
+
+
 class Mapper(object):
 
     def __init__(self):
         self.routes = []
+        self.root = _Node()
+        self.reverse = {}
+        self.unindexed = []
+
+    def _insert(self, index, route):
+        """INTERNAL: insert a route into the route tree."""
+        node = self.root
+        for kind, value in route.segments:
+            if node.first is None:
+                node.first = index
+            if kind == 'static':
+                if value not in node.static:
+                    node.static[value] = _Node()
+                node = node.static[value]
+            elif kind == 'variable':
+                if node.variable is None:
+                    node.variable = _Node()
+                node = node.variable
+            else:
+                for regex, child in node.patterns:
+                    if regex.pattern == value.pattern:
+                        node = child
+                        break
+                else:
+                    child = _Node()
+                    node.patterns.append((value, child))
+                    node = child
+        if node.first is None:
+            node.first = index
+        node.routes.append((index, route))
+        if route.method and route.method not in node.methods:
+            node.methods += (route.method,)
+
+    def _index(self, index, route):
+        """INTERNAL: add a route to the reverse routing index.
+
+        The index maps the set of argument names that a route accepts to
+        a list of (fixed names, table) pairs. The table maps the values of
+        the fixed arguments (e.g. collection and action) to the route.
+        """
+        names = frozenset(route.varnames) | frozenset(route.kwargs)
+        fixed = tuple(sorted(route.kwargs))
+        groups = self.reverse.setdefault(names, [])
+        for fixednames, table in groups:
+            if fixednames == fixed:
+                break
+        else:
+            table = {}
+            groups.append((fixed, table))
+        values = tuple([ route.kwargs[name] for name in fixed ])
+        try:
+            table.setdefault(values, (index, route))
+        except TypeError:
+            self.unindexed.append((index, route))
+
+    def _search(self, node, segments, depth, method, best):
+        """INTERNAL: find the first registered route under `node' that
+        matches the URL segments from `depth' on. The result is stored in
+        `best' as an (index, route) pair."""
+        if node.first is None or node.first >= best[0]:
+            return
+        if depth == len(segments):
+            for index, route in node.routes:
+                if index >= best[0]:
+                    break
+                if method and route.method and method != route.method:
+                    continue
+                best[:] = [index, route]
+                break
+            return
+        segment = segments[depth]
+        child = node.static.get(segment)
+        if child is not None:
+            self._search(child, segments, depth+1, method, best)
+        if segment and node.variable is not None:
+            self._search(node.variable, segments, depth+1, method, best)
+        for regex, child in node.patterns:
+            if regex.match(segment):
+                self._search(child, segments, depth+1, method, best)
+
+    def _collect(self, node, segments, depth, result):
+        """INTERNAL: find all nodes under `node' at which a route ends that
+        matches the URL segments from `depth' on. The nodes are appended to
+        `result'."""
+        if depth == len(segments):
+            if node.routes:
+                result.append(node)
+            return
+        segment = segments[depth]
+        child = node.static.get(segment)
+        if child is not None:
+            self._collect(child, segments, depth+1, result)
+        if segment and node.variable is not None:
+            self._collect(node.variable, segments, depth+1, result)
+        for regex, child in node.patterns:
+            if regex.match(segment):
+                self._collect(child, segments, depth+1, result)
 
     def connect(self, path, method=None, **kwargs):
         route = Route(path, method, **kwargs)
+        self._insert(len(self.routes), route)
+        self._index(len(self.routes), route)
         self.routes.append(route)
 
     def match(self, url, method=None):
-        for route in self.routes:
-            match = route._match(url, method)
-            if match:
-                return match
+        segments = url.split('/')
+        best = [len(self.routes), None]
+        self._search(self.root, segments, 0, method, best)
+        route = best[1]
+        if route is None:
+            return
+        return route._match_segments(segments)
 
     def url_for(self, **kwargs):
-        for route in self.routes:
-            url = route._url_for(**kwargs)
-            if url:
-                return url
+        best = (len(self.routes), None)
+        try:
+            for fixednames, table in self.reverse.get(frozenset(kwargs), ()):
+                values = tuple([ kwargs[name] for name in fixednames ])
+                match = table.get(values)
+                if match and match < best:
+                    best = match
+        except TypeError:
+            best = (len(self.routes), None)
+            candidates = enumerate(self.routes)
+        else:
+            candidates = self.unindexed
+        for index, route in candidates:
+            if index >= best[0]:
+                break
+            if route._url_for(**kwargs):
+                best = (index, route)
+                break
+        route = best[1]
+        if route is None:
+            return
+        return route._build(kwargs)
+
+    def lookup(self, url, method=None):
+        """Look up a URL in one pass. Return a (match, methods) tuple, with
+        `match' the match for the first route that matches the URL and the
+        method (or None), and `methods' a tuple with the methods that the
+        routes matching the URL accept."""
+        segments = url.split('/')
+        nodes = []
+        self._collect(self.root, segments, 0, nodes)
+        best = (len(self.routes), None)
+        for node in nodes:
+            for index, route in node.routes:
+                if index >= best[0]:
+                    break
+                if method and route.method and method != route.method:
+                    continue
+                best = (index, route)
+                break
+        if len(nodes) == 1:
+            methods = nodes[0].methods
+        else:
+            methods = []
+            nodes.sort(key=lambda node: node.routes[0][0])
+            for node in nodes:
+                for name in node.methods:
+                    if name not in methods:
+                        methods.append(name)
+            methods = tuple(methods)
+        route = best[1]
+        if route is None:
+            return None, methods
+        return route._match_segments(segments), methods
 
     def methods_for(self, url):
-        methods = []
-        for route in self.routes:
-            match = route._match(url, method=None)
-            if match and route.method:
-                methods.append(route.method)
+        nodes = []
+        self._collect(self.root, url.split('/'), 0, nodes)
+        matches = []
+        for node in nodes:
+            matches += node.routes
+        matches.sort()
+        methods = [ route.method for index, route in matches if route.method ]
         return methods
@@ -62,7 +62,7 @@ def create_isapi_handler(fname, opts):
     if opts.debug:
         fout.write('  import win32traceutil\n')
     fout.write('  setup_logging(%s)\n' % opts.debug)
-    fout.write('  return Extension(%s)\n' % opts.classname)
+    fout.write('  return Extension(%s())\n' % opts.classname)
     fout.close()
     py_compile.compile(fname)
     print 'ISAPI handler created.'
@@ -6,36 +6,47 @@
 # Python-REST is copyright (c) 2010 by the Python-REST authors. See the file
 # "AUTHORS" for a complete overview.
 
+import zlib
+import urllib
+import hashlib
+import itertools
 import traceback
 
 from argproc import Error as ArgProcError
 from rest import http, api
-from rest.api import request, response, mapper
+from rest.api import request, response
 from rest.error import Error as HTTPReturn
 from rest.filter import InputFilter, OutputFilter, ExceptionHandler
-from rest.proxy import ObjectProxy
+from rest.proxy import ContextProxy
 from rest.resource import Resource
-from rest.collection import Collection
-from rest.util import make_absolute
+from rest.collection import Collection, Page
+from rest.cache import MemoryCache
+from rest.util import make_absolute, is_iterator
 from rest.entity.parse import ParserManager
 from rest.entity.format import FormatterManager
-from rest.entity.transform import Transformer
+from rest.entity.transform import Transformer, parse_fields, format_fields
 from rest.entity.xml import XMLParser, XMLFormatter
 from rest.entity.yaml import YAMLParser, YAMLFormatter
 from rest.entity.json import JSONParser, JSONFormatter
 
 
-api.parsermanager = ObjectProxy()
-api.formattermanager = ObjectProxy()
-api.transformer = ObjectProxy()
+api.parsermanager = ContextProxy('parsermanager')
+api.formattermanager = ContextProxy('formattermanager')
+api.transformer = ContextProxy('transformer')
 
 
 class HandleMethodNotAllowed(InputFilter):
-    """Check that the method is allowed for the requested resource."""
+    """Check that the method is allowed for the requested resource.
+
+    The dispatcher already returns a 405 response when a URL is mapped but
+    not for the request method. This filter handles routes that are
+    explicitly connected to the "_method_not_allowed" action.
+    """
 
     def filter(self, input):
         if request.match.get('action') == '_method_not_allowed':
-            headers = [('Allowed', ', '.join(mapper.methods_for(request.path)))]
+            allow = ', '.join(request.allowed)
+            headers = [('Allow', allow), ('Allowed', allow)]
             raise HTTPReturn(http.METHOD_NOT_ALLOWED, headers)
         return input
 
@@ -75,6 +86,323 @@ class FormatEntity(OutputFilter):
         return formatted
 
 
+class CheckETag(InputFilter):
+    """Set the "ETag" header from the version of the requested resource, as
+    returned by the _get_etag() method of the collection. If the tag
+    matches the "If-None-Match" header, respond with 304 (NOT MODIFIED)
+    without running the action.
+    """
+
+    def filter(self, input):
+        version = api.collection._get_etag(request.match.get('id'))
+        if version is None:
+            return input
+        # The tag must differ between the content types that the resource
+        # is available in, and between the pages and selections of fields
+        # that the query arguments select.
+        accept = request.header('Accept', '*/*')
+        manager = api.formattermanager
+        try:
+            ctype = http.select_content_type(manager.content_types, accept,
+                                             manager.parsed_content_types)
+        except ValueError:
+            return input
+        digest = hashlib.sha1('%s\0%s\0%s' % (version, ctype, request.uri))
+        digest = digest.hexdigest()
+        etag = 'W/"%s"' % digest
+        response.set_header('ETag', etag)
+        if_none_match = request.header('If-None-Match')
+        if if_none_match and http.match_etag(etag, if_none_match):
+            raise HTTPReturn(http.NOT_MODIFIED, headers=response.headers)
+        return input
+
+
+class AddETag(OutputFilter):
+    """Set the "ETag" header to a hash of a formatted entity, if it was not
+    set already. If the tag matches the "If-None-Match" header, change the
+    response into a 304 (NOT MODIFIED)."""
+
+    def filter(self, output):
+        if not isinstance(output, str) or response.status != http.OK:
+            return output
+        etag = response.header('ETag')
+        if etag is None:
+            etag = 'W/"%s"' % hashlib.sha1(output).hexdigest()
+            response.set_header('ETag', etag)
+        if_none_match = request.header('If-None-Match')
+        if if_none_match and http.match_etag(etag, if_none_match):
+            response.status = http.NOT_MODIFIED
+            response.headers.remove('Content-Length')
+            return ''
+        return output
+
+
+class CompressEntity(OutputFilter):
+    """Compress a formatted entity with "gzip" or "deflate", based on the
+    "Accept-Encoding" header.
+
+    Entities smaller than `threshold' bytes are sent as is. A streamed
+    entity is compressed incrementally, and each chunk is flushed so that
+    the client receives it without delay.
+    """
+
+    encodings = ('gzip', 'deflate')
+    threshold = 1024
+    level = 6
+
+    def __init__(self, threshold=None, level=None):
+        if threshold is not None:
+            self.threshold = threshold
+        if level is not None:
+            self.level = level
+
+    def _compressor(self, encoding):
+        """Return a compressor object for `encoding'."""
+        if encoding == 'gzip':
+            wbits = 16 + zlib.MAX_WBITS
+        else:
+            wbits = zlib.MAX_WBITS
+        return zlib.compressobj(self.level, zlib.DEFLATED, wbits)
+
+    def _compress_iter(self, chunks, compressor):
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+    def _add_vary(self):
+        vary = response.header('Vary')
+        if not vary:
+            response.set_header('Vary', 'Accept-Encoding')
+            return
+        fields = [ field.strip().lower() for field in vary.split(',') ]
+        if 'accept-encoding' not in fields and '*' not in fields:
+            response.set_header('Vary', '%s, Accept-Encoding' % vary)
+
+    def filter(self, output):
+        streaming = is_iterator(output)
+        if not streaming and (not isinstance(output, str) or
+                              len(output) < self.threshold):
+            return output
+        if response.status in (http.NO_CONTENT, http.NOT_MODIFIED) or \
+                response.header('Content-Encoding'):
+            return output
+        self._add_vary()
+        accept = request.header('Accept-Encoding')
+        if not accept:
+            return output
+        try:
+            encoding = http.select_encoding(self.encodings, accept)
+        except ValueError:
+            return output
+        if not encoding:
+            return output
+        compressor = self._compressor(encoding)
+        response.set_header('Content-Encoding', encoding)
+        if streaming:
+            response.headers.remove('Content-Length')
+            return self._compress_iter(output, compressor)
+        output = compressor.compress(output) + compressor.flush()
+        response.set_header('Content-Length', str(len(output)))
+        return output
+
+
+class CheckResponseCache(InputFilter):
+    """Respond from a response cache, without running the action, if it
+    has a response for the request.
+
+    Responses are cached per URI and negotiated content type, charset and
+    content coding. The user and the request headers in `vary' are part of
+    the key as well. By default these are the headers that identify a user
+    or a session; an application that varies its responses on other
+    headers must add them.
+    """
+
+    vary = ('Authorization', 'Cookie')
+
+    def __init__(self, cache, vary=()):
+        self.cache = cache
+        self.vary = self.vary + tuple(vary)
+
+    def cache_key(self):
+        """Return the key of the current request in the cache, or None if
+        the response must not be cached."""
+        manager = api.formattermanager
+        try:
+            accept = request.header('Accept', '*/*')
+            ctype = http.select_content_type(manager.content_types, accept,
+                                             manager.parsed_content_types)
+            accept = request.header('Accept-Charset', '*')
+            charset = http.select_charset(('utf-8',), accept)
+            accept = request.header('Accept-Encoding', 'identity')
+            encoding = http.select_encoding(CompressEntity.encodings, accept)
+        except ValueError:
+            return
+        if not ctype or not charset:
+            return
+        key = (request.match['collection'], request.uri, ctype, charset,
+               encoding, request.user)
+        return key + tuple([ request.header(name) for name in self.vary ])
+
+    def filter(self, input):
+        key = self.cache_key()
+        if key is None:
+            return input
+        request.cache_key = key
+        cached = self.cache.get(key)
+        if cached is None:
+            request.cache_generation = self.cache.generation(key[0])
+            return input
+        headers, body = cached
+        if_none_match = request.header('If-None-Match')
+        etag = http.Headers(headers).get('ETag')
+        if if_none_match and etag and http.match_etag(etag, if_none_match):
+            raise HTTPReturn(http.NOT_MODIFIED, headers=headers)
+        raise HTTPReturn(http.OK, headers=headers, body=body)
+
+
+class StoreResponseCache(OutputFilter):
+    """Store a formatted response in a response cache.
+
+    A response is not stored if it sets a cookie, or if its "Vary" header
+    names a request header that is not part of the cache key.
+    """
+
+    negotiated = ('Accept', 'Accept-Charset', 'Accept-Encoding')
+
+    def __init__(self, cache, vary=()):
+        self.cache = cache
+        names = self.negotiated + CheckResponseCache.vary + tuple(vary)
+        self.covered = set([ name.lower() for name in names ])
+
+    def cacheable(self):
+        """Return whether the current response can be stored."""
+        if 'Set-Cookie' in response.headers:
+            return False
+        for value in response.headers.get_all('Vary'):
+            for name in value.split(','):
+                if name.strip().lower() not in self.covered:
+                    return False
+        return True
+
+    def filter(self, output):
+        key = getattr(request, 'cache_key', None)
+        if key is None or not isinstance(output, str) or \
+                response.status != http.OK or not self.cacheable():
+            return output
+        headers = [ (name, value) for name,value in response.headers
+                    if name.lower() != 'date' ]
+        self.cache.put(key, headers, output, request.cache_generation)
+        return output
+
+
+class InvalidateResponseCache(OutputFilter):
+    """Remove the responses of a collection from a response cache after
+    it has been modified."""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def filter(self, output):
+        self.cache.invalidate(request.match['collection'])
+        return output
+
+
+class HandlePagination(InputFilter):
+    """Parse and check the "limit", "offset" and "cursor" arguments of the
+    "list" action, and store the requested page in `request.page'.
+
+    The arguments are passed on to the action only for a collection that
+    paginates itself.
+    """
+
+    def _get_int(self, name, minimum, maximum=None):
+        arg = request.args.pop(name)
+        try:
+            value = int(arg)
+        except ValueError:
+            value = None
+        if value is None or value < minimum or \
+                maximum is not None and value > maximum:
+            reason = 'Illegal value for "%s": %s' % (name, arg)
+            raise HTTPReturn(http.BAD_REQUEST, reason=reason)
+        return value
+
+    def filter(self, input):
+        collection = api.collection
+        limit = min(collection.page_size, collection.max_page_size)
+        if 'limit' in request.args:
+            limit = self._get_int('limit', 1, collection.max_page_size)
+        offset = 0
+        if 'offset' in request.args:
+            offset = self._get_int('offset', 0)
+        cursor = request.args.pop('cursor', None)
+        if cursor is not None:
+            if not collection.paginate:
+                reason = 'Collection does not support cursors'
+                raise HTTPReturn(http.BAD_REQUEST, reason=reason)
+            if offset:
+                reason = 'Cannot combine "cursor" and "offset"'
+                raise HTTPReturn(http.BAD_REQUEST, reason=reason)
+        request.page = (limit, offset, cursor)
+        if collection.paginate:
+            request.args['limit'] = limit
+            request.args['offset'] = offset
+            request.args['cursor'] = cursor
+        return input
+
+
+class PaginateOutput(OutputFilter):
+    """Take the requested page from the output of the "list" action, and
+    add a "Link" header with the URLs of the next and previous pages."""
+
+    def _url(self, **page):
+        args = [ (key, value) for key,value in
+                 http.parse_qsl(request.environ['QUERY_STRING'])
+                 if key not in ('limit', 'offset', 'cursor') ]
+        args += sorted(((key, value) for key,value in page.items()
+                        if value is not None))
+        path = urllib.quote(request.path)
+        return make_absolute('%s?%s' % (path, urllib.urlencode(args)))
+
+    def filter(self, output):
+        limit, offset, cursor = request.page
+        links = []
+        if isinstance(output, Page):
+            if output.next is not None:
+                links.append((self._url(limit=limit, cursor=output.next),
+                              'next'))
+            if output.previous is not None:
+                links.append((self._url(limit=limit,
+                                        cursor=output.previous), 'prev'))
+            output = output.resources
+        else:
+            streaming = is_iterator(output)
+            if not api.collection.paginate:
+                # Take one resource more to find out if there is a next
+                # page. An iterator is still streamed.
+                page = list(itertools.islice(output, offset,
+                                             offset + limit + 1))
+                more = len(page) > limit
+                output = page[:limit]
+                if streaming:
+                    output = iter(output)
+            else:
+                more = not streaming and len(output) >= limit
+            if more and cursor is None:
+                links.append((self._url(limit=limit, offset=offset+limit),
+                              'next'))
+            if offset:
+                links.append((self._url(limit=limit,
+                                        offset=max(0, offset-limit)), 'prev'))
+        if links:
+            response.set_header('Link', ', '.join(('<%s>; rel="%s"' % link
+                                                   for link in links)))
+        return output
+
+
 class TransformResource(InputFilter):
     """Transform a Resource from external to internal form."""
 
@@ -83,11 +411,35 @@ class TransformResource(InputFilter):
         return transformed
 
 
+class HandleFields(InputFilter):
+    """Parse the "fields" argument, that selects the fields of the
+    resources to return, and store it in `request.fields'.
+
+    The selected fields are passed on to the action as a list of paths
+    only for a collection with `fields_hint' set.
+    """
+
+    def filter(self, input):
+        value = request.args.pop('fields', None)
+        if value is None:
+            return input
+        try:
+            request.fields = parse_fields(value)
+        except ValueError, e:
+            raise HTTPReturn(http.BAD_REQUEST, reason=str(e))
+        if api.collection.fields_hint:
+            request.args['fields'] = format_fields(request.fields)
+        return input
+
+
 class ReverseTransformResource(OutputFilter):
-    """Transform a Resource from internal to external form."""
+    """Transform a Resource from internal to external form. If the client
+    selected fields, the other fields are removed."""
 
     def filter(self, output):
-        transformed = api.transformer.transform(output, reverse=True)
+        fields = getattr(request, 'fields', None)
+        transformed = api.transformer.transform(output, reverse=True,
+                                                fields=fields)
         return transformed
 
 
@@ -146,25 +498,59 @@ class HandleArgProcError(ExceptionHandler):
         raise HTTPReturn(http.BAD_REQUEST, headers=headers, body=body)
 
 
+def enable_response_cache(app, cache=None, vary=()):
+    """Cache the formatted responses of the "show" and "list" actions of
+    `app' in `cache', by default a new MemoryCache. The responses of a
+    collection are invalidated when a "create", "update" or "delete"
+    action on it succeeds. The cache is available as the global
+    `responsecache'. Return the cache.
+
+    Responses are cached separately for each value of the "Authorization"
+    and "Cookie" request headers, and of the headers in `vary'.
+
+    With multiple worker processes, use an SQLiteCache so that the workers
+    share their responses and invalidations."""
+    if cache is None:
+        cache = MemoryCache()
+    for action in ('show', 'list'):
+        app.add_input_filter(CheckResponseCache(cache, vary),
+                             action=action, priority=70)
+        app.add_output_filter(StoreResponseCache(cache, vary),
+                              action=action, priority=95)
+    for action in ('create', 'update', 'delete'):
+        app.add_output_filter(InvalidateResponseCache(cache), action=action,
+                              priority=95)
+    app.add_global('responsecache', cache)
+    return cache
+
+
 def setup_module(app):
     app.add_route('/api/:collection', method='GET', action='list')
     app.add_route('/api/:collection', method='POST', action='create')
     app.add_route('/api/:collection/:id', method='DELETE', action='delete')
     app.add_route('/api/:collection/:id', method='GET', action='show')
     app.add_route('/api/:collection/:id', method='PUT', action='update')
-    app.add_route('/api/:collection', action='_method_not_allowed')
-    app.add_route('/api/:collection/:id', action='_method_not_allowed')
 
     app.add_input_filter(HandleMethodNotAllowed(), priority=10)
     app.add_exception_handler(HandleArgProcError())
+    # Compression runs after all output filters with the default priority.
+    app.add_output_filter(CompressEntity(), priority=90)
 
     app.add_input_filter(EnsureNoEntity(), action='list')
+    app.add_input_filter(HandlePagination(), action='list', priority=20)
+    app.add_input_filter(HandleFields(), action='list', priority=20)
+    app.add_input_filter(CheckETag(), action='list', priority=60)
+    app.add_output_filter(PaginateOutput(), action='list', priority=20)
     app.add_output_filter(ReverseTransformResource(), action='list')
     app.add_output_filter(FormatEntity(), action='list')
+    app.add_output_filter(AddETag(), action='list', priority=80)
 
     app.add_input_filter(EnsureNoEntity(), action='show')
+    app.add_input_filter(HandleFields(), action='show', priority=20)
+    app.add_input_filter(CheckETag(), action='show', priority=60)
     app.add_output_filter(ReverseTransformResource(), action='show')
     app.add_output_filter(FormatEntity(), action='show')
+    app.add_output_filter(AddETag(), action='show', priority=80)
     app.add_exception_handler(HandleKeyError(), action='show')
 
     app.add_input_filter(ParseEntity(), action='create')
@@ -188,22 +574,18 @@ def setup_module(app):
     parsermanager.add_parser('text/xml', XMLParser())
     parsermanager.add_parser('text/x-yaml', YAMLParser())
     parsermanager.add_parser('application/json', JSONParser())
-    api.parsermanager._register(parsermanager)
+    app.add_global('parsermanager', parsermanager)
 
     formattermanager = FormatterManager()
     formattermanager.add_formatter('text/xml', XMLFormatter())
     formattermanager.add_formatter('text/x-yaml', YAMLFormatter())
     formattermanager.add_formatter('application/json', JSONFormatter())
-    api.formattermanager._register(formattermanager)
+    app.add_global('formattermanager', formattermanager)
 
     transformer = Transformer()
-    api.transformer._register(transformer)
+    app.add_global('transformer', transformer)
 
     def dummy_method(self):
         pass
 
     Collection._method_not_allowed = dummy_method
-
-def unload_module(app):
-    api.parsermanager._release()
-    api.formattermanager._release()
@@ -8,6 +8,8 @@
 
 import threading
 
+from rest.context import _local
+
 
 class ObjectProxy(object):
     """A simple object proxy that mediates access to a global object in a
@@ -65,3 +67,55 @@ class ObjectProxy(object):
 
     def __repr__(self):
         return repr(self.____local__.object)
+
+
+class ContextProxy(object):
+    """A proxy for an object of the active request context.
+
+    Every access is resolved with a single lookup of the context of the
+    current thread. See `rest.context'.
+    """
+
+    __slots__ = ('_name',)
+
+    def __init__(self, name):
+        object.__setattr__(self, '_name', name)
+
+    def _current_object(self):
+        return getattr(_local.context, self._name, None)
+
+    def __getattr__(self, attr):
+        return getattr(getattr(_local.context, self._name), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(getattr(_local.context, self._name), attr, value)
+
+    def __delattr__(self, attr):
+        delattr(getattr(_local.context, self._name), attr)
+
+    def __setitem__(self, key, value):
+        getattr(_local.context, self._name)[key] = value
+
+    def __getitem__(self, key):
+        return getattr(_local.context, self._name)[key]
+
+    def __delitem__(self, key):
+        del getattr(_local.context, self._name)[key]
+
+    def __call__(self, *args, **kwargs):
+        return getattr(_local.context, self._name)(*args, **kwargs)
+
+    def __iter__(self):
+        return iter(getattr(_local.context, self._name))
+
+    def __len__(self):
+        return len(getattr(_local.context, self._name))
+
+    def __contains__(self, elem):
+        return elem in getattr(_local.context, self._name)
+
+    def __nonzero__(self):
+        return bool(getattr(_local.context, self._name, None))
+
+    def __repr__(self):
+        return repr(getattr(_local.context, self._name, None))
@@ -7,75 +7,224 @@
 # "AUTHORS" for a complete overview.
 
 import binascii
+from tempfile import SpooledTemporaryFile
 
 from rest import http
 from rest.http import parse_qs
 from rest.error import Error as HTTPReturn
+from rest.util import lazy_property
+
+
+class RequestBody(object):
+    """A file-like object that reads the request entity incrementally.
+
+    This is passed to the input filters instead of the entity itself for
+    collections that set `stream_input'. The parsers in `rest.entity'
+    accept either a string or an object like this one.
+    """
+
+    chunk_size = 16384
+
+    def __init__(self, request):
+        self.request = request
+        self.buffer = ''
+
+    def read(self, size=None):
+        """Read up to `size' bytes. Read everything if size is None."""
+        buffer = self.buffer
+        if size is not None and len(buffer) >= size:
+            self.buffer = buffer[size:]
+            return buffer[:size]
+        self.buffer = ''
+        if size is not None:
+            size -= len(buffer)
+        return buffer + self.request.read(size)
+
+    def __iter__(self):
+        while True:
+            data = self.read(self.chunk_size)
+            if not data:
+                break
+            yield data
+
+    def __nonzero__(self):
+        """Return True if the request has a non-empty entity."""
+        if not self.buffer:
+            self.buffer = self.request.read(1)
+        return bool(self.buffer)
 
 
 class Request(object):
     """HTTP Request"""
 
+    max_chunk_line = 1024
+    spool_chunk_size = 65536
+
     def __init__(self, env):
         self.environ = env
-        self.uri = '%s%s' % (env['SCRIPT_NAME'], env['PATH_INFO'])
-        if env['QUERY_STRING']:
-            self.uri += '?%s' % env['QUERY_STRING']
         self.method = env['REQUEST_METHOD']
         self.script = env['SCRIPT_NAME']
         self.path = '%s%s' % (env['SCRIPT_NAME'], env['PATH_INFO'])
-        args = parse_qs(env['QUERY_STRING'])
-        for key in args.keys():
-            args[key] = args[key][0]
-        self.args = args
         self.server = env['SERVER_NAME']
         self.port = env['SERVER_PORT']
         self.protocol = env['SERVER_PROTOCOL']
         self.user = env.get('REMOTE_USER')
         self.secure = env.get('HTTPS') == 'on'
-        self.headers = []
+        self.content_length = None
+        self.bytes_read = 0
+        self.chunked = False
+        self.chunks_done = False
+        self.max_size = None
+        self.body = RequestBody(self)
+
+    # The attributes below are computed on first access only, as many
+    # requests do not need them.
+
+    @lazy_property
+    def uri(self):
+        """The request URI, including the query string."""
+        uri = self.path
+        if self.environ['QUERY_STRING']:
+            uri += '?%s' % self.environ['QUERY_STRING']
+        return uri
+
+    @lazy_property
+    def args(self):
+        """The query arguments. Only the first value of a repeated argument
+        is kept."""
+        args = parse_qs(self.environ['QUERY_STRING'])
+        for key in args.keys():
+            args[key] = args[key][0]
+        return args
+
+    @lazy_property
+    def headers(self):
+        """The request headers, as an `http.Headers' instance."""
+        env = self.environ
+        headers = http.Headers()
         if env.get('CONTENT_TYPE'):
-            self.set_header('Content-Type', env['CONTENT_TYPE'])
+            headers.add('Content-Type', env['CONTENT_TYPE'])
         if env.get('CONTENT_LENGTH'):
-            self.set_header('Content-Length', env['CONTENT_LENGTH'])
+            headers.add('Content-Length', env['CONTENT_LENGTH'])
         for key in env:
             if key.startswith('HTTP_'):
                 hkey = '-'.join([ x.title() for x in key[5:].split('_')])
-                self.set_header(hkey, env[key])
-        username = password = None
+                headers.add(hkey, env[key])
+        return headers
+
+    @lazy_property
+    def _credentials(self):
+        """INTERNAL: the user name and password from a Basic
+        "Authorization" header."""
         try:
             method, auth = self.header('Authorization').split(' ')
             if method == 'Basic':
                 username, password = auth.decode('base64').split(':')
+                return username, password
         except (AttributeError, ValueError, binascii.Error):
             pass
-        self.username = username
-        self.password = password
-        self.content_length = None
-        self.bytes_read = 0
+        return None, None
+
+    @lazy_property
+    def username(self):
+        return self._credentials[0]
+
+    @lazy_property
+    def password(self):
+        return self._credentials[1]
 
     def header(self, name, default=None):
-        for hname,value in self.headers:
-            if hname.lower() == name.lower():
-                return value
-        return default
+        return self.headers.get(name, default)
 
     def set_header(self, name, value):
-        for i in range(len(self.headers)):
-            if self.headers[i][0].lower() == name.lower():
-                self.headers[i] = (name, value)
-                break
+        self.headers.set(name, value)
+
+    def limit(self, max_size):
+        """Limit the size of the request entity to `max_size' bytes. If
+        the request announces a larger entity in its Content-Length header,
+        raise a 413 error before anything is read. For chunked entities,
+        the limit is enforced while reading."""
+        self.max_size = max_size
+        if max_size is None:
+            return
+        try:
+            length = int(self.header('Content-Length', '0'))
+        except ValueError:
+            raise HTTPReturn(http.BAD_REQUEST,
+                             reason='Illegal Content-Length header')
+        if length > max_size:
+            raise HTTPReturn(http.REQUEST_ENTITY_TOO_LARGE,
+                    reason='Entity of %d bytes exceeds limit of %d bytes'
+                           % (length, max_size))
+
+    def _start_read(self):
+        """INTERNAL: determine how the request entity is framed."""
+        encoding = self.header('Transfer-Encoding', 'identity').lower()
+        if encoding == 'chunked':
+            self.chunked = True
+            self.chunk_left = 0
+            self.content_length = -1
+        elif encoding == 'identity':
+            self.content_length = int(self.header('Content-Length', '0'))
         else:
-            self.headers.append((name, value))
+            raise HTTPReturn(http.NOT_IMPLEMENTED,
+                    reason='Unsupported transfer encoding [%s]' % encoding)
+
+    def _read_chunk_size(self, input):
+        """INTERNAL: read the size line that starts a chunk."""
+        line = input.readline(self.max_chunk_line)
+        if not line.endswith('\n'):
+            raise HTTPReturn(http.BAD_REQUEST, reason='Illegal chunk header')
+        try:
+            size = int(line.split(';', 1)[0].strip(), 16)
+        except ValueError:
+            raise HTTPReturn(http.BAD_REQUEST, reason='Illegal chunk size')
+        if size < 0:
+            raise HTTPReturn(http.BAD_REQUEST, reason='Illegal chunk size')
+        return size
+
+    def _read_chunked(self, size):
+        """INTERNAL: read from a request with a chunked entity."""
+        input = self.environ['wsgi.input']
+        result = []
+        while not self.chunks_done and (size is None or size > 0):
+            if self.chunk_left == 0:
+                self.chunk_left = self._read_chunk_size(input)
+                if self.max_size is not None and \
+                        self.bytes_read + self.chunk_left > self.max_size:
+                    raise HTTPReturn(http.REQUEST_ENTITY_TOO_LARGE,
+                            reason='Entity exceeds limit of %d bytes'
+                                   % self.max_size)
+                if self.chunk_left == 0:
+                    # Last chunk: skip the trailer.
+                    while input.readline(self.max_chunk_line) \
+                                not in ('\r\n', '\n', ''):
+                        pass
+                    self.chunks_done = True
+                    break
+            toread = self.chunk_left
+            if size is not None and size < toread:
+                toread = size
+            data = input.read(toread)
+            if not data:
+                raise HTTPReturn(http.BAD_REQUEST,
+                                 reason='Premature end of chunked entity')
+            result.append(data)
+            self.chunk_left -= len(data)
+            self.bytes_read += len(data)
+            if size is not None:
+                size -= len(data)
+            if self.chunk_left == 0:
+                input.readline(self.max_chunk_line)
+        return ''.join(result)
 
     def read(self, size=None):
-        """Read from the request."""
+        """Read from the request. Both identity and chunked transfer
+        encoding are supported."""
         if self.content_length is None:
-            encoding = self.header('Transfer-Encoding', 'identity')
-            if encoding != 'identity':
-                raise HTTPReturn(http.NOT_IMPLEMENTED,
-                        reason='Unsupported transfer encoding [%s]' % encoding)
-            self.content_length = int(self.header('Content-Length', '0'))
+            self._start_read()
+        if self.chunked:
+            return self._read_chunked(size)
         # Make sure we never attempt to read beyond Content-Length, as some
         # WSGI servers will block instead of returning EOF (which is allowed
         # by PEP-333).
@@ -87,6 +236,23 @@ class Request(object):
         self.bytes_read += len(data)
         return data
 
+    def spool(self, threshold):
+        """Read the request entity into a temporary file. The file is kept
+        in memory until it grows beyond `threshold' bytes, after which it
+        is moved to disk. Return the file positioned at its start, or an
+        empty string if the request has no entity."""
+        spool = SpooledTemporaryFile(max_size=threshold)
+        while True:
+            data = self.read(self.spool_chunk_size)
+            if not data:
+                break
+            spool.write(data)
+        if not spool.tell():
+            spool.close()
+            return ''
+        spool.seek(0)
+        return spool
+
     def preferred_content_type(self, content_types):
         """From a list of content types, select the one that is preferred by
         the client based on the value of the "Accept" header."""
@@ -97,4 +263,4 @@ class Request(object):
         """From a list of character sets, select the one that is preferred by
         the client based on the value of the "Accept-Charset" header."""
         accept_header = self.header('Accept-Charset', '*')
-        return http.select_content_type(charsets, accept_header)
+        return http.select_charset(charsets, accept_header)
@@ -11,25 +11,28 @@ from rest import http
 from rest.api import mapper
 
 
+server_version = 'python-rest/%s' % '.'.join(map(str, rest.version))
+
+
 class Response(object):
     """HTTP Response"""
 
+    # Headers that are added to every response, in addition to "Date".
+    default_headers = http.Headers([('Server', server_version)])
+
     def __init__(self, environ):
         self.environ = environ
         self.status = http.OK
-        version = '.'.join(map(str, rest.version))
-        self.headers = [('Server', 'python-rest/%s' % version),
-                        ('Date', http.format_date())]
+        self.headers = self.default_headers.copy()
+        self.headers.add('Date', http.current_date())
 
     def header(self, name):
-        for hname,value in self.headers:
-            if hname.lower() == name.lower():
-                return value
+        return self.headers.get(name)
 
     def set_header(self, name, value):
-        for i in range(len(self.headers)):
-            if self.headers[i][0].lower() == name.lower():
-                self.headers[i] = (name, value)
-                break
-        else:
-            self.headers.append((name, value))
+        self.headers.set(name, value)
+
+    def add_header(self, name, value):
+        """Add a header without replacing existing headers of the same
+        name, e.g. for "Set-Cookie"."""
+        self.headers.add(name, value)
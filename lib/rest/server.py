@@ -6,12 +6,21 @@
 # Python-REST is copyright (c) 2010 by the Python-REST authors. See the file
 # "AUTHORS" for a complete overview.
 
+import os
 import re
 import sys
+import time
+import errno
+import select
+import signal
+import socket
 import os.path
+import logging
+import threading
+from Queue import Queue, Full, Empty
 from optparse import OptionParser
 from wsgiref.simple_server import (WSGIServer, WSGIRequestHandler,
-                                   make_server as _make_server)
+                                   ServerHandler)
 
 from rest.util import setup_logging, import_module
 
@@ -20,20 +29,538 @@ re_module = re.compile('([a-z_][a-z0-9_]*(?:\.[a-z_][a-z0-9_]+)*)'
                        ':([a-z_][a-z0-9_]+)', re.I)
 
 
+class ThreadPoolMixIn(object):
+    """Mix-in that handles requests in a fixed pool of worker threads.
+
+    Accepted connections are put on a bounded queue from which the workers
+    take them. When the queue is full, the connection is rejected with a
+    "503 Service Unavailable" response instead of being queued. The workers
+    are started when the first connection is accepted, so that the server
+    can be created before forking.
+
+    Rejecting a connection does not block the accepting thread. What the
+    client sends after the response is read and discarded by a separate
+    thread for at most `reject_timeout' seconds, so that closing the socket
+    does not reset the connection before the client read the response.
+    """
+
+    workers = ()
+    threads = 10
+    queue_size = 50
+    reject_timeout = 0.5
+    linger_interval = 0.1
+    reject_response = 'HTTP/1.0 503 Service Unavailable\r\n' \
+                      'Content-Type: text/plain\r\n' \
+                      'Content-Length: 20\r\n' \
+                      'Retry-After: 1\r\n' \
+                      'Connection: close\r\n\r\n' \
+                      'Service Unavailable\n'
+
+    def start_workers(self):
+        """Start the worker threads."""
+        self.requests = Queue(self.queue_size)
+        self.workers = []
+        for i in range(self.threads):
+            worker = threading.Thread(target=self.process_requests)
+            worker.setDaemon(True)
+            worker.start()
+            self.workers.append(worker)
+        self.lingering = Queue(self.queue_size)
+        self.linger_thread = threading.Thread(target=self.linger_requests)
+        self.linger_thread.setDaemon(True)
+        self.linger_thread.start()
+
+    def stop_workers(self):
+        """Stop the worker threads after they finished the requests that
+        are currently queued. Persistent connections are closed after
+        their current request."""
+        self.stopping = True
+        for worker in self.workers:
+            self.requests.put(None)
+        for worker in self.workers:
+            worker.join()
+        if self.workers:
+            self.lingering.put(None)
+            self.linger_thread.join()
+        self.workers = []
+
+    def connections_waiting(self):
+        return self.workers and not self.requests.empty()
+
+    def process_request(self, request, client_address):
+        if not self.workers:
+            self.start_workers()
+        try:
+            self.requests.put_nowait((request, client_address))
+        except Full:
+            self.reject_request(request, client_address)
+
+    def process_requests(self):
+        """Worker thread main loop."""
+        while True:
+            item = self.requests.get()
+            if item is None:
+                break
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            self.shutdown_request(request)
+
+    def reject_request(self, request, client_address):
+        """Reject a request because the server is overloaded."""
+        logger = logging.getLogger('rest.server')
+        logger.warning('request queue full, rejecting request from %s',
+                       client_address[0])
+        try:
+            request.setblocking(0)
+            request.send(self.reject_response)
+            request.shutdown(socket.SHUT_WR)
+            self.lingering.put_nowait((time.time() + self.reject_timeout,
+                                       request))
+        except (socket.error, Full):
+            self.close_request(request)
+
+    def linger_requests(self):
+        """Lingering thread main loop. Discard the input of rejected
+        connections until the client closes them or they time out."""
+        deadlines = {}
+        while True:
+            if deadlines:
+                try:
+                    item = self.lingering.get_nowait()
+                except Empty:
+                    item = ()
+            else:
+                item = self.lingering.get()
+            if item is None:
+                break
+            elif item:
+                deadline, request = item
+                deadlines[request] = deadline
+                continue
+            try:
+                ready = select.select(deadlines.keys(), [], [],
+                                      self.linger_interval)[0]
+            except select.error:
+                ready = []
+            now = time.time()
+            for request in deadlines.keys():
+                done = deadlines[request] < now
+                if request in ready:
+                    try:
+                        done = done or not request.recv(4096)
+                    except socket.error:
+                        done = True
+                if done:
+                    del deadlines[request]
+                    self.close_request(request)
+        for request in deadlines:
+            self.close_request(request)
+
+
 class RESTServer(WSGIServer):
-    """REST HTTP server."""
+    """REST HTTP server.
+
+    Persistent connections are disabled by default, as an idle connection
+    would block all other clients of this single threaded server.
+    """
+
+    keep_alive = False
+    keep_alive_timeout = 15
+    max_keep_alive_requests = 100
+    stopping = False
 
     def __init__(self, address, handler_class):
         WSGIServer.__init__(self, address, handler_class)
         # Update address if we are listening on a ephemeral port.
         self.address = self.socket.getsockname()
 
+    def connections_waiting(self):
+        """Return whether accepted connections are waiting to be
+        handled."""
+        return False
+
     def shutdown(self):
         self.application.shutdown()
         WSGIServer.shutdown(self)
 
 
+class ThreadedRESTServer(ThreadPoolMixIn, RESTServer):
+    """REST HTTP server that handles requests in a pool of threads. A
+    persistent connection occupies a thread until it is closed."""
+
+    keep_alive = True
+
+    def __init__(self, address, handler_class, threads=None,
+                 queue_size=None):
+        if threads is not None:
+            self.threads = threads
+        if queue_size is not None:
+            self.queue_size = queue_size
+        self.request_queue_size = max(self.queue_size, 5)
+        RESTServer.__init__(self, address, handler_class)
+
+    def shutdown(self):
+        WSGIServer.shutdown(self)
+        self.stop_workers()
+        self.application.shutdown()
+
+
+class PreforkServer(object):
+    """Pre-forking server.
+
+    The master process forks `workers' worker processes that all accept
+    connections on the listening socket of `server'. Workers that exit are
+    respawned. A worker exits by itself after it accepted `max_requests'
+    connections, if set.
+
+    The master handles the following signals:
+
+     * SIGHUP: gracefully replace all workers. New workers are started and
+       the old workers are told to exit after finishing the requests they
+       are working on.
+     * SIGTERM, SIGINT: gracefully stop all workers and exit.
+
+    Each worker calls Application.shutdown() before it exits. As the
+    application is created in the master, a reload does not import any
+    changed code.
+    """
+
+    poll_interval = 0.5
+
+    def __init__(self, server, workers=4, max_requests=None):
+        self.server = server
+        self.workers = workers
+        self.max_requests = max_requests
+        self.children = {}
+        self.generation = 0
+        self.reloading = False
+        self.stopping = False
+        self.logger = logging.getLogger('rest.server')
+
+    def serve_forever(self):
+        """Run the master process until it is told to stop."""
+        self._set_signal(signal.SIGHUP, self._reload)
+        self._set_signal(signal.SIGTERM, self._stop)
+        self._set_signal(signal.SIGINT, self._stop)
+        while not self.stopping:
+            if self.reloading:
+                self.reloading = False
+                self._replace_workers()
+            self._reap_workers()
+            self._spawn_workers()
+            time.sleep(self.poll_interval)
+        for pid in self.children:
+            self._kill_worker(pid)
+        while self.children:
+            self._reap_workers(block=True)
+        self.server.server_close()
+        self.server.application.shutdown()
+
+    def shutdown(self):
+        """Tell the master to stop."""
+        self.stopping = True
+
+    def _set_signal(self, signum, handler):
+        signal.signal(signum, handler)
+        # Restart system calls, we don't want to abort a request.
+        signal.siginterrupt(signum, False)
+
+    def _reload(self, signum, frame):
+        self.reloading = True
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+
+    def _spawn_workers(self):
+        current = [ pid for pid,generation in self.children.items()
+                    if generation == self.generation ]
+        for i in range(self.workers - len(current)):
+            pid = os.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    self._run_worker()
+                    status = 0
+                except Exception:
+                    self.logger.exception('uncaught exception in worker')
+                os._exit(status)
+            self.children[pid] = self.generation
+
+    def _replace_workers(self):
+        old = self.children.keys()
+        self.generation += 1
+        self._spawn_workers()
+        for pid in old:
+            self._kill_worker(pid)
+        self.logger.info('replacing %d workers', len(old))
+
+    def _kill_worker(self, pid):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+    def _reap_workers(self, block=False):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, 0 if block else os.WNOHANG)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                elif e.errno == errno.ECHILD:
+                    self.children.clear()
+                    break
+                raise
+            if pid == 0:
+                break
+            generation = self.children.pop(pid, None)
+            if status and generation == self.generation \
+                    and not self.stopping:
+                self.logger.warning('worker %d exited with status %d',
+                                    pid, status)
+            if block:
+                break
+
+    def _run_worker(self):
+        """Main loop of a worker process."""
+        self.stopping = False
+        self._set_signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        server = self.server
+        # All workers wait for the listening socket to become readable but
+        # only one of them gets the connection.
+        server.socket.setblocking(0)
+        accepted = 0
+        while not self.stopping:
+            if self.max_requests and accepted >= self.max_requests:
+                break
+            try:
+                ready = select.select([server], [], [], self.poll_interval)
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if not ready[0]:
+                continue
+            try:
+                request, client_address = server.get_request()
+            except socket.error:
+                continue
+            accepted += 1
+            try:
+                server.process_request(request, client_address)
+            except Exception:
+                server.handle_error(request, client_address)
+                server.shutdown_request(request)
+        server.socket.close()
+        if isinstance(server, ThreadPoolMixIn):
+            server.stop_workers()
+        server.application.shutdown()
+
+
+class SocketReader(object):
+    """A buffered file-like reader for a socket, used as `rfile' of the
+    request handler. Unlike the file object returned by makefile(), it can
+    tell how much data has been received but not read yet, which is where
+    a pipelined request ends up."""
+
+    bufsize = 8192
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = ''
+        self.closed = False
+
+    def buffered(self):
+        """Return the number of bytes that can be read without
+        blocking."""
+        return len(self.buffer)
+
+    def _fill(self, size):
+        """INTERNAL: receive up to `size' more bytes into the buffer.
+        Return False at end of file."""
+        while True:
+            try:
+                data = self.sock.recv(max(size, self.bufsize))
+            except socket.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            self.buffer += data
+            return bool(data)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            while self._fill(self.bufsize):
+                pass
+            size = len(self.buffer)
+        while len(self.buffer) < size:
+            if not self._fill(size - len(self.buffer)):
+                break
+        data = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        start = 0
+        while True:
+            end = self.buffer.find('\n', start) + 1
+            if end or 0 <= size <= len(self.buffer):
+                break
+            start = len(self.buffer)
+            if not self._fill(self.bufsize):
+                end = len(self.buffer)
+                break
+        if not end or 0 <= size < end:
+            end = size if size >= 0 else len(self.buffer)
+        data = self.buffer[:end]
+        self.buffer = self.buffer[end:]
+        return data
+
+    def close(self):
+        self.closed = True
+        self.buffer = ''
+
+
+class RequestInput(object):
+    """The request entity as passed to the application in `wsgi.input'.
+
+    Reads are limited to the Content-Length of the request, so that the
+    application cannot consume the next request on a persistent connection.
+    A `length' of None means that the length is not known in advance.
+    """
+
+    def __init__(self, rfile, length):
+        self.rfile = rfile
+        self.remaining = length
+
+    def _limit(self, size):
+        if self.remaining is None:
+            return size
+        if size is None or size < 0 or size > self.remaining:
+            return self.remaining
+        return size
+
+    def read(self, size=-1):
+        size = self._limit(size)
+        if size is None or size < 0:
+            return self.rfile.read()
+        data = self.rfile.read(size)
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        size = self._limit(size)
+        if size is None or size < 0:
+            return self.rfile.readline()
+        data = self.rfile.readline(size)
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        return data
+
+    def readlines(self, hint=None):
+        return list(self)
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
+
+    def drain(self, limit):
+        """Read and discard the rest of the entity, but not more than
+        `limit' bytes. Return True if the entity was read completely."""
+        if self.remaining is None or self.remaining > limit:
+            return False
+        while self.remaining > 0:
+            if not self.read(min(self.remaining, 65536)):
+                return False
+        return True
+
+
+class RESTServerHandler(ServerHandler):
+    """WSGI handler that sends responses of unknown length to HTTP/1.1
+    clients with chunked transfer encoding, and that decides whether the
+    connection can be kept open after the response. The entity of a
+    response to a HEAD request is not sent."""
+
+    chunked = False
+
+    def cleanup_headers(self):
+        ServerHandler.cleanup_headers(self)
+        protocol = self.environ['SERVER_PROTOCOL']
+        if protocol == 'HTTP/1.1':
+            self.http_version = '1.1'
+        handler = self.request_handler
+        status = int(self.status[:3])
+        if 'Content-Length' in self.headers or status < 200 or \
+                status in (204, 304) or \
+                self.environ['REQUEST_METHOD'] == 'HEAD':
+            pass
+        elif protocol == 'HTTP/1.1':
+            self.headers['Transfer-Encoding'] = 'chunked'
+            self.chunked = True
+        else:
+            handler.close_connection = True
+        if not handler.close_connection and not handler.can_keep_alive():
+            handler.close_connection = True
+        if handler.close_connection:
+            self.headers['Connection'] = 'close'
+        elif protocol == 'HTTP/1.0':
+            self.headers['Connection'] = 'keep-alive'
+
+    def write(self, data):
+        if not self.status:
+            raise AssertionError('write() before start_response()')
+        elif not self.headers_sent:
+            self.bytes_sent = len(data)
+            self.send_headers()
+        else:
+            self.bytes_sent += len(data)
+        if self.environ['REQUEST_METHOD'] == 'HEAD':
+            pass
+        elif self.chunked and data:
+            self._write('%x\r\n%s\r\n' % (len(data), data))
+        elif not self.chunked:
+            self._write(data)
+        self._flush()
+
+    def finish_content(self):
+        ServerHandler.finish_content(self)
+        if self.chunked:
+            self._write('0\r\n\r\n')
+            self._flush()
+
+    def handle_error(self):
+        if self.headers_sent:
+            # The response is incomplete, the client has to notice.
+            self.request_handler.close_connection = True
+        ServerHandler.handle_error(self)
+
+    def close(self):
+        ServerHandler.close(self)
+        self.chunked = False
+
+
 class RESTRequestHandler(WSGIRequestHandler):
+    """HTTP request handler.
+
+    If the server has `keep_alive' set, HTTP/1.1 persistent connections are
+    supported, including pipelined requests. A connection is closed when it
+    has been idle for `keep_alive_timeout' seconds or after
+    `max_keep_alive_requests' requests.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    max_drain = 65536
+    poll_interval = 0.5
 
     def address_string(self):
         # Do not resolve DNS name of the peer during a request.
@@ -44,9 +571,107 @@ class RESTRequestHandler(WSGIRequestHandler):
         # No logging to standard output
         pass
 
+    def setup(self):
+        WSGIRequestHandler.setup(self)
+        self.rfile = SocketReader(self.connection)
+
+    def handle(self):
+        """Handle HTTP requests until the connection is closed."""
+        server = self.server
+        self.handled = 0
+        self.input = None
+        self.handle_one_request()
+        while not self.close_connection:
+            if not self.wait_for_request(server.keep_alive_timeout):
+                break
+            self.connection.settimeout(server.keep_alive_timeout)
+            self.handle_one_request()
+
+    def wait_for_request(self, timeout):
+        """Wait until the next request on a persistent connection starts
+        to arrive. Return False if the connection has been idle for
+        `timeout' seconds, if the server is stopping, or if other
+        connections are waiting for this thread."""
+        if self.rfile.buffered():
+            return True  # Pipelined request already received
+        server = self.server
+        deadline = time.time() + timeout
+        wait = 0
+        while not server.stopping:
+            remaining = deadline - time.time()
+            if remaining <= 0 or wait and server.connections_waiting():
+                return False
+            wait = min(remaining, self.poll_interval)
+            try:
+                ready = select.select([self.connection], [], [], wait)
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if ready[0]:
+                return True
+        return False
+
+    def handle_one_request(self):
+        """Handle a single HTTP request."""
+        self.close_connection = True
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except socket.error:
+            return
+        if not self.raw_requestline:
+            return
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            return
+        if not self.parse_request():
+            self.close_connection = True
+            return
+        server = self.server
+        self.handled += 1
+        if not server.keep_alive or server.max_keep_alive_requests and \
+                self.handled >= server.max_keep_alive_requests:
+            self.close_connection = True
+        if self.headers.get('Transfer-Encoding', 'identity') != 'identity':
+            length = None
+        else:
+            try:
+                length = max(0, int(self.headers.get('Content-Length', 0)))
+            except ValueError:
+                length = None
+        self.input = RequestInput(self.rfile, length)
+        environ = self.get_environ()
+        environ['wsgi.input'] = self.input
+        handler = RESTServerHandler(self.input, self.wfile,
+                                    self.get_stderr(), environ)
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+        if not self.close_connection and not self.input.drain(self.max_drain):
+            self.close_connection = True
+
+    def can_keep_alive(self):
+        """Return whether the connection can be kept open after the current
+        request. This requires that the server can find the start of the
+        next request, which is not the case for chunked request entities
+        or for large unread entities."""
+        input = self.input
+        return input.remaining is not None and \
+                input.remaining <= self.max_drain
+
 
-def make_server(host, port, app):
-    return _make_server(host, port, app, RESTServer, RESTRequestHandler)
+def make_server(host, port, app, threads=None, queue_size=None):
+    """Create a server for `app'. If `threads' is given, requests are
+    handled in a pool of that many threads."""
+    if threads:
+        server = ThreadedRESTServer((host, port), RESTRequestHandler,
+                                    threads, queue_size)
+    else:
+        server = RESTServer((host, port), RESTRequestHandler)
+    server.set_app(app)
+    return server
 
 
 def program_name():
@@ -64,10 +689,26 @@ def main():
                       help='listen on interface:port')
     parser.add_option('-m', '--module', dest='module',
                       help='use application module:classname')
+    parser.add_option('-t', '--threads', dest='threads', type='int',
+                      help='handle requests in a pool of N threads')
+    parser.add_option('-q', '--queue-size', dest='queue_size', type='int',
+                      help='reject requests when N requests are waiting')
+    parser.add_option('-w', '--workers', dest='workers', type='int',
+                      help='pre-fork N worker processes')
+    parser.add_option('--max-requests', dest='max_requests', type='int',
+                      help='replace a worker after N requests')
+    parser.add_option('-e', '--event-loop', dest='event_loop',
+                      action='store_true',
+                      help='handle connections in an event loop')
     parser.add_option('-d', '--debug', action='store_true')
     parser.set_default('listen', 'localhost:8080')
     parser.set_default('debug', False)
+    parser.set_default('event_loop', False)
     parser.set_default('module', None)
+    parser.set_default('threads', None)
+    parser.set_default('queue_size', None)
+    parser.set_default('workers', None)
+    parser.set_default('max_requests', None)
     opts, args = parser.parse_args()
     if not opts.module:
         parser.error('you need to specify --module')
@@ -81,14 +722,32 @@ def main():
         parser.error('could not load module %s' % modname)
     if not hasattr(module, classname):
         parser.error('could not load class %s from module' % classname)
-    app = getattr(module, classname)
+    app = getattr(module, classname)()
     mobj = re_listen.match(opts.listen)
     if not mobj:
         parser.error('specify --listen as host:port')
+    if opts.threads is not None and opts.threads < 1:
+        parser.error('specify --threads as a positive number')
+    if opts.queue_size is not None and opts.queue_size < 1:
+        parser.error('specify --queue-size as a positive number')
+    if opts.workers is not None and opts.workers < 1:
+        parser.error('specify --workers as a positive number')
+    if opts.workers and not hasattr(os, 'fork'):
+        parser.error('--workers is not supported on this platform')
+    if opts.event_loop and (opts.workers or opts.queue_size):
+        parser.error('--event-loop cannot be combined with --workers '
+                     'or --queue-size')
     address = mobj.group(1)
     port = int(mobj.group(2))
     setup_logging(opts.debug)
-    server = make_server(address, port, app)
+    if opts.event_loop:
+        from rest.eventserver import make_server as make_event_server
+        server = make_event_server(address, port, app, opts.threads)
+    else:
+        server = make_server(address, port, app, opts.threads,
+                             opts.queue_size)
+    if opts.workers:
+        server = PreforkServer(server, opts.workers, opts.max_requests)
     print 'Listening on %s:%s' % (address, port)
     print 'Press CTRL-C to quit'
     try:
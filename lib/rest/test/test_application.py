@@ -8,17 +8,22 @@
 
 import sys
 import time
+import zlib
 import logging
+import json
 import httplib as http
 
 from threading import Thread
+from StringIO import StringIO
 from httplib import HTTPConnection
 from xml.etree import ElementTree as etree
 from xml.etree.ElementTree import XML, Element
 
-from rest import Application, Collection, Resource
+from rest import Application, Collection, Resource, InputFilter, Page
 from rest.api import request, response, mapper
+from rest.response import Response
 from rest.server import make_server
+from rest.protocol import CompressEntity, enable_response_cache
 
 
 class BookCollection(Collection):
@@ -63,6 +68,8 @@ class BookCollection(Collection):
                 book['reviews'] = [Resource('review',
                                           { 'comment': 'Very good' })]
             match.append(book)
+        if kwargs.get('stream'):
+            return iter(match)
         return match
 
     def create(self, input):
@@ -90,6 +97,49 @@ class BookApplication(Application):
         self.add_collection(BookCollection())
 
 
+class AppendFilter(InputFilter):
+
+    def __init__(self, value):
+        self.value = value
+
+    def filter(self, input):
+        return input + [self.value]
+
+
+class BareApplication(Application):
+
+    def load_modules(self):
+        pass
+
+
+class TestFilterPipeline(object):
+
+    def test_order(self):
+        app = BareApplication()
+        app.add_input_filter(AppendFilter(1), priority=20)
+        app.add_input_filter(AppendFilter(2), action='show', priority=10)
+        app.add_input_filter(AppendFilter(3), collection='books')
+        app.add_input_filter(AppendFilter(4), 'books', 'show', priority=20)
+        assert app.filter_input('books', 'show', []) == [2, 1, 4, 3]
+        assert app.filter_input('books', 'list', []) == [1, 3]
+        assert app.filter_input('authors', 'show', []) == [2, 1]
+
+    def test_registered_filters_unchanged(self):
+        app = BareApplication()
+        app.add_input_filter(AppendFilter(1), 'books', 'show')
+        app.add_input_filter(AppendFilter(2))
+        for i in range(3):
+            assert app.filter_input('books', 'show', []) == [1, 2]
+        assert len(app.input_filters[('books', 'show')]) == 1
+
+    def test_invalidation(self):
+        app = BareApplication()
+        app.add_input_filter(AppendFilter(1), 'books', 'show')
+        assert app.filter_input('books', 'show', []) == [1]
+        app.add_input_filter(AppendFilter(2), action='show', priority=10)
+        assert app.filter_input('books', 'show', []) == [2, 1]
+
+
 class TestApplication(object):
 
     @classmethod
@@ -105,7 +155,7 @@ class TestApplication(object):
         logger.setLevel(level)
         
     def setUp(self):
-        self.server = make_server('localhost', 0, BookApplication)
+        self.server = make_server('localhost', 0, BookApplication())
         # don't want any logging
         self.server.RequestHandlerClass.log_request = lambda *args: None
         self.thread = Thread(target=self.server.serve_forever)
@@ -128,6 +178,101 @@ class TestApplication(object):
         assert etree.tostring(xml) == \
                 '<book>\n  <id>1</id>\n  <title>Book Number 1</title>\n</book>'
 
+    def test_show_etag(self):
+        client = self.client
+        client.request('GET', '/api/books/1')
+        response = client.getresponse()
+        etag = response.getheader('ETag')
+        assert etag.startswith('W/"')
+        response.read()
+        client.request('GET', '/api/books/1',
+                       headers={ 'If-None-Match': etag })
+        response = client.getresponse()
+        assert response.status == http.NOT_MODIFIED
+        assert response.getheader('ETag') == etag
+        assert response.getheader('Content-Length') is None
+        assert response.read() == ''
+        client.request('GET', '/api/books/2',
+                       headers={ 'If-None-Match': etag })
+        response = client.getresponse()
+        assert response.status == http.OK
+        assert response.getheader('ETag') != etag
+        response.read()
+
+    def test_show_etag_version(self):
+        collection = self.server.get_app().collections['books']
+        collection._get_etag = lambda id=None: 'v%s' % id
+        client = self.client
+        client.request('GET', '/api/books/1')
+        response = client.getresponse()
+        etag = response.getheader('ETag')
+        response.read()
+        def show(id):
+            raise AssertionError('action should not run')
+        collection.show = show
+        headers = { 'If-None-Match': '"other", %s' % etag }
+        client.request('GET', '/api/books/1', headers=headers)
+        response = client.getresponse()
+        assert response.status == http.NOT_MODIFIED
+        assert response.getheader('ETag') == etag
+        assert response.read() == ''
+        headers = { 'If-None-Match': etag, 'Accept': 'application/json' }
+        client.request('GET', '/api/books/1', headers=headers)
+        response = client.getresponse()
+        assert response.status == http.INTERNAL_SERVER_ERROR
+        response.read()
+
+    def test_etag_uri(self):
+        collection = self.server.get_app().collections['books']
+        collection._get_etag = lambda id=None: 'v1'
+        client = self.client
+        etags = []
+        for url in ('/api/books', '/api/books?detail=2',
+                    '/api/books?fields=title', '/api/books/1',
+                    '/api/books/1?fields=title'):
+            client.request('GET', url)
+            response = client.getresponse()
+            response.read()
+            etags.append(response.getheader('ETag'))
+        assert len(set(etags)) == len(etags)
+        headers = { 'If-None-Match': etags[0] }
+        client.request('GET', '/api/books?fields=title', headers=headers)
+        response = client.getresponse()
+        assert response.status == http.OK
+        response.read()
+
+    def test_show_fields(self):
+        client = self.client
+        client.request('GET', '/api/books/1?fields=title')
+        response = client.getresponse()
+        assert response.status == http.OK
+        book = XML(response.read())
+        assert [ child.tag for child in book ] == ['title']
+        client.request('GET', '/api/books/1?fields=title,')
+        response = client.getresponse()
+        assert response.status == http.BAD_REQUEST
+        response.read()
+
+    def test_list_fields_hint(self):
+        collection = self.server.get_app().collections['books']
+        requested = []
+        def list(**kwargs):
+            requested.append(kwargs.get('fields'))
+            return BookCollection.list(collection, detail='2')
+        collection.list = list
+        client = self.client
+        client.request('GET', '/api/books?fields=id,reviews.comment')
+        response = client.getresponse()
+        books = XML(response.read())
+        assert len(books) == 3
+        assert sorted([ child.tag for child in books[0] ]) == ['id', 'reviews']
+        assert requested == [None]
+        collection.fields_hint = True
+        client.request('GET', '/api/books?fields=id,reviews.comment')
+        response = client.getresponse()
+        response.read()
+        assert requested[-1] == ['id', 'reviews.comment']
+
     def test_show_not_found(self):
         client = self.client
         client.request('GET', '/api/books/4')
@@ -149,6 +294,71 @@ class TestApplication(object):
         xml = etree.fromstring(response.read())
         assert len(xml.findall('.//id')) == 3
 
+    def test_list_streamed(self):
+        client = self.client
+        client.request('GET', '/api/books?stream=1')
+        response = client.getresponse()
+        assert response.status == http.OK
+        assert response.getheader('Content-Type') == 'text/xml; charset=utf-8'
+        assert response.getheader('Content-Length') is None
+        assert response.getheader('Transfer-Encoding') == 'chunked'
+        xml = etree.fromstring(response.read())
+        assert len(xml.findall('.//id')) == 3
+
+    def test_list_streamed_json(self):
+        client = self.client
+        headers = { 'Accept': 'application/json' }
+        client.request('GET', '/api/books?stream=1&detail=2', headers=headers)
+        response = client.getresponse()
+        assert response.status == http.OK
+        books = json.loads(response.read())
+        assert len(books) == 3
+        assert books[0]['reviews'][0]['comment'] == 'Very good'
+
+    def test_list_compressed(self):
+        client = self.client
+        headers = { 'Accept-Encoding': 'deflate, gzip' }
+        client.request('GET', '/api/books', headers=headers)
+        response = client.getresponse()
+        assert response.getheader('Content-Encoding') is None
+        assert response.getheader('Vary') is None
+        response.read()
+        threshold = CompressEntity.threshold
+        CompressEntity.threshold = 0
+        try:
+            for encoding,wbits in (('gzip', 16+zlib.MAX_WBITS),
+                                   ('deflate', zlib.MAX_WBITS)):
+                headers = { 'Accept-Encoding': '%s, *;q=0.5' % encoding }
+                client.request('GET', '/api/books', headers=headers)
+                response = client.getresponse()
+                assert response.status == http.OK
+                assert response.getheader('Content-Encoding') == encoding
+                assert response.getheader('Vary') == 'Accept-Encoding'
+                body = response.read()
+                assert int(response.getheader('Content-Length')) == len(body)
+                xml = etree.fromstring(zlib.decompress(body, wbits))
+                assert len(xml.findall('.//id')) == 3
+            client.request('GET', '/api/books')
+            response = client.getresponse()
+            assert response.getheader('Content-Encoding') is None
+            assert response.getheader('Vary') == 'Accept-Encoding'
+            response.read()
+        finally:
+            CompressEntity.threshold = threshold
+
+    def test_list_streamed_compressed(self):
+        client = self.client
+        headers = { 'Accept-Encoding': 'gzip' }
+        client.request('GET', '/api/books?stream=1', headers=headers)
+        response = client.getresponse()
+        assert response.status == http.OK
+        assert response.getheader('Content-Encoding') == 'gzip'
+        assert response.getheader('Content-Length') is None
+        assert response.getheader('Transfer-Encoding') == 'chunked'
+        body = zlib.decompress(response.read(), 16+zlib.MAX_WBITS)
+        xml = etree.fromstring(body)
+        assert len(xml.findall('.//id')) == 3
+
     def test_list_with_input(self):
         client = self.client
         client.request('GET', '/api/books', 'body input')
@@ -173,6 +383,84 @@ class TestApplication(object):
         assert response.status == http.CREATED
         assert response.getheader('Location').endswith('/api/books/4')
 
+    def test_create_then_show(self):
+        # The application and its collections are created only once, so
+        # state is kept between requests.
+        client = self.client
+        book = XML('<book><id>4</id><title>Book Number 4</title></book>')
+        headers = { 'Content-Type': 'text/xml' }
+        client.request('POST', '/api/books', etree.tostring(book), headers)
+        response = client.getresponse()
+        assert response.status == http.CREATED
+        response.read()
+        client.request('GET', '/api/books/4')
+        response = client.getresponse()
+        assert response.status == http.OK
+        xml = etree.fromstring(response.read())
+        assert xml.findtext('title') == 'Book Number 4'
+
+    def _send_chunked(self, method, url, body, headers):
+        client = self.client
+        client.putrequest(method, url)
+        for name in headers:
+            client.putheader(name, headers[name])
+        client.putheader('Transfer-Encoding', 'chunked')
+        client.endheaders()
+        chunks = []
+        for i in range(0, len(body), 10):
+            chunk = body[i:i+10]
+            chunks.append('%x\r\n%s\r\n' % (len(chunk), chunk))
+        chunks.append('0\r\n\r\n')
+        client.send(''.join(chunks))
+        return client.getresponse()
+
+    def test_create_chunked(self):
+        book = XML('<book><id>4</id><title>Book Number 4</title></book>')
+        headers = { 'Content-Type': 'text/xml' }
+        response = self._send_chunked('POST', '/api/books',
+                                      etree.tostring(book), headers)
+        assert response.status == http.CREATED
+        assert response.getheader('Location').endswith('/api/books/4')
+
+    def test_create_streamed_input(self):
+        collection = self.server.application.collections['books']
+        collection.stream_input = True
+        book = XML('<book><id>4</id><title>Book Number 4</title></book>')
+        headers = { 'Content-Type': 'text/xml' }
+        response = self._send_chunked('POST', '/api/books',
+                                      etree.tostring(book), headers)
+        assert response.status == http.CREATED
+        assert response.getheader('Location').endswith('/api/books/4')
+        response.read()
+        response = self._send_chunked('POST', '/api/books', '', headers)
+        assert response.status == http.BAD_REQUEST
+
+    def test_create_spooled_input(self):
+        collection = self.server.application.collections['books']
+        collection.spool_input = True
+        collection.spool_threshold = 10
+        client = self.client
+        book = XML('<book><id>4</id><title>Book Number 4</title></book>')
+        headers = { 'Content-Type': 'text/xml' }
+        client.request('POST', '/api/books', etree.tostring(book), headers)
+        response = client.getresponse()
+        assert response.status == http.CREATED
+        assert response.getheader('Location').endswith('/api/books/4')
+
+    def test_create_too_large(self):
+        collection = self.server.application.collections['books']
+        collection.max_input_size = 10
+        client = self.client
+        book = XML('<book><id>4</id><title>Book Number 4</title></book>')
+        headers = { 'Content-Type': 'text/xml' }
+        client.request('POST', '/api/books', etree.tostring(book), headers)
+        response = client.getresponse()
+        assert response.status == http.REQUEST_ENTITY_TOO_LARGE
+        response.read()
+        response = self._send_chunked('POST', '/api/books',
+                                      etree.tostring(book), headers)
+        assert response.status == http.REQUEST_ENTITY_TOO_LARGE
+
     def test_create_no_input(self):
         client = self.client
         client.request('POST', '/api/books')
@@ -253,3 +541,350 @@ class TestApplication(object):
         assert response.status == http.METHOD_NOT_ALLOWED
         allowed = set(response.getheader('Allowed').split(', '))
         assert allowed == set(['GET', 'DELETE', 'PUT'])
+
+    def test_response_class(self):
+        class CustomResponse(Response):
+            default_headers = Response.default_headers.copy()
+            default_headers.set('Server', 'custom')
+        self.server.get_app().Response = CustomResponse
+        client = self.client
+        client.request('GET', '/api/books/1')
+        response = client.getresponse()
+        response.read()
+        assert response.getheader('Server') == 'custom'
+        client.request('PUT', '/api/books')
+        response = client.getresponse()
+        response.read()
+        assert response.status == http.METHOD_NOT_ALLOWED
+        assert response.getheader('Server') == 'custom'
+
+    def test_allow_header(self):
+        client = self.client
+        client.request('PUT', '/api/books')
+        response = client.getresponse()
+        assert response.status == http.METHOD_NOT_ALLOWED
+        allowed = set(response.getheader('Allow').split(', '))
+        assert allowed == set(['GET', 'POST'])
+        response.read()
+        client.request('GET', '/api/books/1/reviews')
+        response = client.getresponse()
+        assert response.status == http.NOT_FOUND
+        assert response.getheader('Allow') is None
+
+
+class CachedBookApplication(BookApplication):
+
+    def setup_filters(self):
+        self.cache = enable_response_cache(self)
+
+
+class TestResponseCache(object):
+
+    def setUp(self):
+        self.app = CachedBookApplication()
+        self.server = make_server('localhost', 0, self.app)
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.start()
+        address = self.server.socket.getsockname()
+        self.client = HTTPConnection(*address)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+
+    def _get(self, url, headers={}):
+        self.client.request('GET', url, headers=headers)
+        response = self.client.getresponse()
+        return response, response.read()
+
+    def test_hit(self):
+        response, body = self._get('/api/books')
+        assert response.status == http.OK
+        collection = self.app.collections['books']
+        def list(**kwargs):
+            raise AssertionError('action should not run')
+        collection.list = list
+        cached, cached_body = self._get('/api/books')
+        assert cached.status == http.OK
+        assert cached_body == body
+        assert cached.getheader('Content-Type') == \
+                response.getheader('Content-Type')
+        assert cached.getheader('ETag') == response.getheader('ETag')
+        assert cached.getheader('Date') is not None
+        headers = { 'If-None-Match': response.getheader('ETag') }
+        response, body = self._get('/api/books', headers)
+        assert response.status == http.NOT_MODIFIED
+        stats = self.app.cache.stats()
+        assert stats['hits'] == 2
+        assert stats['misses'] == 1
+        assert stats['entries'] == 1
+        assert stats['size'] > len(cached_body)
+
+    def test_negotiated(self):
+        response, body = self._get('/api/books/1')
+        headers = { 'Accept': 'application/json' }
+        response, body = self._get('/api/books/1', headers)
+        assert json.loads(body)['title'] == 'Book Number 1'
+        response, body = self._get('/api/books/2', headers)
+        stats = self.app.cache.stats()
+        assert stats['misses'] == 3
+        assert stats['entries'] == 3
+
+    def test_invalidate(self):
+        response, body = self._get('/api/books')
+        assert len(XML(body).findall('book')) == 3
+        book = '<book><id>4</id><title>Book Number 4</title></book>'
+        headers = { 'Content-Type': 'text/xml' }
+        self.client.request('POST', '/api/books', book, headers)
+        response = self.client.getresponse()
+        assert response.status == http.CREATED
+        response.read()
+        response, body = self._get('/api/books')
+        assert len(XML(body).findall('book')) == 4
+        assert self.app.cache.stats()['invalidations'] == 1
+
+    def test_cookie(self):
+        collection = self.app.collections['books']
+        def show(id):
+            return Resource('book', { 'id': id,
+                                      'title': request.header('Cookie') })
+        collection.show = show
+        for cookie in ('session=a', 'session=b', 'session=a'):
+            response, body = self._get('/api/books/1', { 'Cookie': cookie })
+            assert XML(body).findtext('title') == cookie
+        stats = self.app.cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 2
+
+    def test_not_cacheable(self):
+        collection = self.app.collections['books']
+        show = collection.show
+        def set_cookie(id):
+            response.add_header('Set-Cookie', 'session=a')
+            return show(id)
+        def vary(id):
+            response.set_header('Vary', 'X-Tenant')
+            return show(id)
+        for action in (set_cookie, vary):
+            collection.show = action
+            self._get('/api/books/1')
+            self._get('/api/books/1')
+            assert self.app.cache.stats()['entries'] == 0
+
+
+class SlowBookCollection(BookCollection):
+
+    def __init__(self):
+        super(SlowBookCollection, self).__init__()
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+
+    def list(self, **kwargs):
+        self.calls += 1
+        self.active += 1
+        self.max_active = max(self.active, self.max_active)
+        time.sleep(0.5)
+        self.active -= 1
+        return super(SlowBookCollection, self).list(**kwargs)
+
+
+class SlowBookApplication(Application):
+
+    coalesce_requests = True
+
+    def setup_collections(self):
+        self.add_collection(SlowBookCollection())
+
+
+class TestCoalescing(object):
+
+    def setUp(self):
+        self.app = SlowBookApplication()
+        self.server = make_server('localhost', 0, self.app, threads=5)
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.address = self.server.socket.getsockname()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+
+    def _get_concurrently(self, requests):
+        results = [None] * len(requests)
+        def get(i, url, headers):
+            client = HTTPConnection(*self.address)
+            client.request('GET', url, headers=headers)
+            response = client.getresponse()
+            results[i] = (response.status, response.read())
+            client.close()
+        threads = [ Thread(target=get, args=(i, url, headers))
+                    for i,(url,headers) in enumerate(requests) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_coalesced(self):
+        results = self._get_concurrently([('/api/books', {})] * 5)
+        assert self.app.collections['books'].calls == 1
+        for status,body in results:
+            assert status == http.OK
+            assert body == results[0][1]
+        stats = self.app.coalescer.stats()
+        assert stats['leaders'] == 1
+        assert stats['coalesced'] == 4
+        assert self.app.coalescer.flights == {}
+
+    def test_different(self):
+        json = { 'Accept': 'application/json' }
+        key = { 'X-Api-Key': 'secret' }
+        results = self._get_concurrently([('/api/books', {}),
+                                          ('/api/books', json),
+                                          ('/api/books', key),
+                                          ('/api/books?id=1', {})])
+        assert self.app.collections['books'].calls == 4
+        assert results[0][1] != results[1][1]
+        assert self.app.coalescer.stats()['coalesced'] == 0
+
+    def test_streamed(self):
+        results = self._get_concurrently([('/api/books?stream=1', {})] * 3)
+        collection = self.app.collections['books']
+        assert collection.calls == 3
+        assert collection.max_active == 1
+        for status,body in results:
+            assert status == http.OK
+            assert body == results[0][1]
+        stats = self.app.coalescer.stats()
+        assert stats['leaders'] == 3
+        assert stats['fallbacks'] == 3
+
+    def test_disabled(self):
+        assert not Application.coalesce_requests
+        self.app.coalesce_requests = False
+        self._get_concurrently([('/api/books', {})] * 3)
+        assert self.app.collections['books'].calls == 3
+        assert self.app.coalescer.stats()['leaders'] == 0
+
+
+class PagedBookCollection(BookCollection):
+
+    name = 'pagedbooks'
+    paginate = True
+    max_page_size = 2
+
+    def list(self, limit, offset, cursor):
+        self.requested = (limit, offset, cursor)
+        if cursor is None:
+            return self.books[offset:offset+limit]
+        position = int(cursor)
+        previous = str(position - limit) if position else None
+        next = str(position + limit) \
+                if position + limit < len(self.books) else None
+        return Page(self.books[position:position+limit], next, previous)
+
+
+class PagedBookApplication(Application):
+
+    def setup_collections(self):
+        self.add_collection(BookCollection())
+        self.add_collection(PagedBookCollection())
+
+
+class TestPagination(object):
+
+    def setUp(self):
+        self.app = PagedBookApplication()
+        self.server = make_server('localhost', 0, self.app)
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.start()
+        address = self.server.socket.getsockname()
+        self.client = HTTPConnection(*address)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+
+    def _get(self, url):
+        self.client.request('GET', url)
+        response = self.client.getresponse()
+        return response, response.read()
+
+    def _links(self, response):
+        links = {}
+        for link in (response.getheader('Link') or '').split(', '):
+            if link:
+                url, rel = link.split('; ')
+                links[rel[5:-1]] = url[1:-1]
+        return links
+
+    def test_offset(self):
+        response, body = self._get('/api/books?limit=2&detail=1')
+        assert response.status == http.OK
+        assert [ book.findtext('id') for book in XML(body) ] == ['1', '2']
+        links = self._links(response)
+        assert links.keys() == ['next']
+        assert links['next'].endswith(
+                '/api/books?detail=1&limit=2&offset=2')
+        response, body = self._get(links['next'][links['next'].index('/api'):])
+        assert [ book.findtext('id') for book in XML(body) ] == ['3']
+        links = self._links(response)
+        assert links.keys() == ['prev']
+        assert links['prev'].endswith('/api/books?detail=1&limit=2&offset=0')
+
+    def test_default_page_size(self):
+        collection = self.app.collections['books']
+        collection.page_size = 2
+        response, body = self._get('/api/books')
+        assert len(XML(body)) == 2
+        assert 'next' in self._links(response)
+        response, body = self._get('/api/books?limit=3')
+        assert len(XML(body)) == 3
+        assert response.getheader('Link') is None
+
+    def test_streamed(self):
+        response, body = self._get('/api/books?stream=1&limit=1&offset=1')
+        assert response.getheader('Transfer-Encoding') == 'chunked'
+        assert [ book.findtext('id') for book in XML(body) ] == ['2']
+        assert sorted(self._links(response).keys()) == ['next', 'prev']
+
+    def test_errors(self):
+        for url in ('/api/books?limit=0', '/api/books?limit=x',
+                    '/api/books?limit=1001', '/api/books?offset=-1',
+                    '/api/books?cursor=1', '/api/pagedbooks?limit=3',
+                    '/api/pagedbooks?cursor=1&offset=1'):
+            response, body = self._get(url)
+            assert response.status == http.BAD_REQUEST
+
+    def test_collection_offset(self):
+        collection = self.app.collections['pagedbooks']
+        response, body = self._get('/api/pagedbooks?offset=1')
+        assert collection.requested == (2, 1, None)
+        assert [ book.findtext('id') for book in XML(body) ] == ['2', '3']
+        assert sorted(self._links(response).keys()) == ['next', 'prev']
+
+    def test_collection_cursor(self):
+        collection = self.app.collections['pagedbooks']
+        response, body = self._get('/api/pagedbooks?limit=1&cursor=1')
+        assert collection.requested == (1, 0, '1')
+        assert [ book.findtext('id') for book in XML(body) ] == ['2']
+        links = self._links(response)
+        assert links['next'].endswith('/api/pagedbooks?cursor=2&limit=1')
+        assert links['prev'].endswith('/api/pagedbooks?cursor=0&limit=1')
+
+    def test_quoted_link(self):
+        collection = BookCollection()
+        collection.name = 'old books'
+        self.app.add_collection(collection)
+        environ = { 'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '',
+                    'PATH_INFO': '/api/old books', 'QUERY_STRING': 'limit=1',
+                    'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+                    'SERVER_PROTOCOL': 'HTTP/1.1', 'wsgi.url_scheme': 'http',
+                    'wsgi.input': StringIO() }
+        result = []
+        def start_response(status, headers):
+            result.append(dict(headers))
+        ''.join(self.app(environ, start_response))
+        link = result[0]['Link']
+        assert link.endswith('/api/old%20books?limit=1&offset=1>; rel="next"')
@@ -0,0 +1,127 @@
+#
+# This file is part of Python-REST. Python-REST is free software that is
+# made available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-REST is copyright (c) 2010 by the Python-REST authors. See the file
+# "AUTHORS" for a complete overview.
+
+import os
+import shutil
+import tempfile
+
+from rest.cache import MemoryCache, SQLiteCache
+
+
+class CacheTests(object):
+
+    def test_generation(self):
+        cache = self.cache
+        generation = cache.generation('books')
+        cache.invalidate('books')
+        assert cache.generation('books') == generation + 1
+        assert cache.generation('authors') == 0
+        cache.put(('books', 1), [], 'stale', generation)
+        assert cache.get(('books', 1)) is None
+        cache.put(('books', 1), [], 'fresh', generation + 1)
+        assert cache.get(('books', 1)) == ([], 'fresh')
+
+
+class TestMemoryCache(CacheTests):
+
+    def setup(self):
+        self.cache = MemoryCache()
+
+    def test_get_put(self):
+        cache = MemoryCache()
+        key = ('books', '/api/books', 'text/xml')
+        assert cache.get(key) is None
+        cache.put(key, [('Content-Type', 'text/xml')], '<books/>')
+        assert cache.get(key) == ([('Content-Type', 'text/xml')], '<books/>')
+        stats = cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+        assert stats['hit_ratio'] == 0.5
+        assert stats['entries'] == 1
+        assert stats['size'] == len('Content-Type' 'text/xml' '<books/>')
+
+    def test_ttl(self):
+        cache = MemoryCache(ttl=-1)
+        key = ('books', '/api/books')
+        cache.put(key, [], 'body')
+        assert cache.get(key) is None
+        stats = cache.stats()
+        assert stats['expired'] == 1
+        assert stats['entries'] == 0
+
+    def test_size(self):
+        cache = MemoryCache(size=2)
+        for i in range(3):
+            cache.put(('books', i), [], 'body')
+        assert cache.get(('books', 0)) is None
+        assert cache.get(('books', 2)) is not None
+        assert cache.stats()['entries'] == 2
+
+    def test_invalidate(self):
+        cache = MemoryCache()
+        cache.put(('books', 1), [], 'body')
+        cache.put(('books', 2), [], 'body')
+        cache.put(('authors', 1), [], 'body')
+        cache.invalidate('books')
+        assert cache.get(('books', 1)) is None
+        assert cache.get(('authors', 1)) is not None
+        assert cache.stats()['entries'] == 1
+
+
+class TestSQLiteCache(CacheTests):
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'cache.db')
+        self.cache = SQLiteCache(self.filename)
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_get_put(self):
+        cache = self.cache
+        key = ('books', '/api/books', 'text/xml', None)
+        headers = [('Content-Type', 'text/xml'), ('ETag', 'W/"1"')]
+        assert cache.get(key) is None
+        cache.put(key, headers, '<books/>\0')
+        assert cache.get(key) == (headers, '<books/>\0')
+        stats = cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+        assert stats['entries'] == 1
+        assert stats['size'] > len('<books/>\0')
+
+    def test_ttl(self):
+        cache = SQLiteCache(self.filename, ttl=-1)
+        cache.put(('books', 1), [], 'body')
+        assert cache.get(('books', 1)) is None
+        assert cache.stats()['expired'] == 1
+
+    def test_size(self):
+        cache = SQLiteCache(self.filename, size=2)
+        for i in range(3):
+            cache.put(('books', i), [], 'body')
+        assert cache.get(('books', 0)) is None
+        assert cache.get(('books', 2)) is not None
+        assert cache.stats()['entries'] == 2
+
+    def test_shared(self):
+        other = SQLiteCache(self.filename)
+        self.cache.put(('books', 1), [], 'books')
+        self.cache.put(('authors', 1), [], 'authors')
+        assert other.get(('books', 1)) == ([], 'books')
+        pid = os.fork()
+        if pid == 0:
+            try:
+                other.invalidate('books')
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        assert self.cache.get(('books', 1)) is None
+        assert self.cache.get(('authors', 1)) == ([], 'authors')
+        assert self.cache.generation('books') == 1
@@ -7,16 +7,20 @@
 # "AUTHORS" for a complete overview.
 
 from copy import deepcopy
+from StringIO import StringIO
+from xml.etree.ElementTree import XML
 
 from rest import api
 from rest.entity import *
 from rest.request import Request
+from rest.resource import Resource
 from rest.response import Response
 from rest.collection import Collection
 from rest.application import Application
+from rest.context import RequestContext, activate_context
 from rest.entity.parse import ParserManager
 from rest.entity.format import FormatterManager
-from rest.entity.transform import Transformer
+from rest.entity.transform import Transformer, parse_fields, format_fields
 from rest.entity.xml import XMLParser, XMLFormatter
 from rest.entity.yaml import YAMLFormatter, YAMLParser
 from rest.entity.json import JSONFormatter, JSONParser
@@ -188,13 +192,11 @@ class TestEntity(object):
     def setup(self):
         request = Request(self.environ)
         request.match = { 'action': 'list' }
-        api.request._register(request)
         response = Response(self.environ)
-        api.response._register(response)
         collection = BookCollection()
-        api.collection._register(collection)
-        application = BookApplication(self.environ, None)
-        api.application._register(application)
+        application = BookApplication()
+        context = RequestContext(application, collection, request, response)
+        self.previous_context = activate_context(context)
         parser = ParserManager()
         parser.add_parser('text/xml', XMLParser())
         parser.add_parser('text/x-yaml', YAMLParser())
@@ -207,6 +209,9 @@ class TestEntity(object):
         self.formatter = formatter
         self.transformer = Transformer()
 
+    def teardown(self):
+        activate_context(self.previous_context)
+
     def test_round_trip_xml(self):
         for xml,yaml,json,resource in self.testdata:
             resource = deepcopy(resource)
@@ -284,3 +289,104 @@ class TestEntity(object):
             parsed = self.parser.parse(formatted)
             transformed = self.transformer.transform(parsed)
             assert transformed == [resource, resource]
+
+    def test_parse_stream(self):
+        for ix,ctype in enumerate(('text/xml', 'text/x-yaml',
+                                   'application/json')):
+            api.request.set_header('Content-Type', ctype)
+            for data in self.testdata:
+                resource = deepcopy(data[3])
+                input = StringIO(data[ix])
+                parsed = self.parser.parse(input)
+                transformed = self.transformer.transform(parsed)
+                assert transformed == resource
+
+    def test_streamed_list(self):
+        for ctype in ('text/xml', 'text/x-yaml', 'application/json'):
+            api.request.set_header('Accept', ctype)
+            api.request.set_header('Content-Type', ctype)
+            for count in (0, 2, 4):
+                resources = []
+                for xml,yaml,json,resource in self.testdata[:count]:
+                    resources.append(deepcopy(resource))
+                reversed = self.transformer.transform(iter(resources),
+                                                      reverse=True)
+                formatted = self.formatter.format(reversed)
+                assert not isinstance(formatted, str)
+                formatted = ''.join(formatted)
+                expected = self.formatter.format(
+                        self.transformer.transform(resources, reverse=True))
+                assert formatted == expected
+                if count == 0:
+                    continue
+                parsed = self.parser.parse(formatted)
+                transformed = self.transformer.transform(parsed)
+                assert transformed == resources
+
+    def test_streamed_list_xml(self):
+        api.request.set_header('Accept', 'text/xml')
+        empty = Resource('book', {})
+        book = Resource('book', { 'id': '1' })
+        for resources in ([], [empty], [empty, book]):
+            reversed = self.transformer.transform(resources, reverse=True)
+            expected = self.formatter.format(reversed)
+            formatted = ''.join(self.formatter.format(iter(reversed)))
+            assert formatted == expected
+            assert len(XML(formatted)) == len(resources)
+
+    def test_content_type_preference(self):
+        expected = (('application/json, text/x-yaml', 'application/json'),
+                    ('text/x-yaml, application/json', 'application/json'),
+                    ('text/*, application/json', 'text/xml'),
+                    ('*/*', 'text/xml'))
+        resource = self.transformer.transform(deepcopy(self.testdata[0][3]),
+                                              reverse=True)
+        for accept,ctype in expected:
+            api.request.set_header('Accept', accept)
+            self.formatter.format(resource)
+            content_type = api.response.header('Content-Type')
+            assert content_type == '%s; charset=utf-8' % ctype
+
+    def test_fields(self):
+        resource = { '!type': 'Book', 'Title': 'Book Title', 'Year': '2010',
+                     'Review': { '!type': 'Review', 'Comment': 'Great' },
+                     'Reviews': [ { '!type': 'Review', 'Comment': 'Good' },
+                                  { '!type': 'Review', 'Comment': 'Bad' } ] }
+        fields = parse_fields('title,review.comment,reviews')
+        pruned = self.transformer._prune(resource, fields, True)
+        assert sorted(pruned) == ['!type', 'Review', 'Reviews', 'Title']
+        reversed = self.transformer.transform(resource, reverse=True,
+                                              fields=fields)
+        assert reversed == { '!type': 'book', 'title': 'Book Title',
+                             'review': { '!type': 'review',
+                                         'comment': 'Great' },
+                             'reviews': [ { '!type': 'review',
+                                            'comment': 'Good' },
+                                          { '!type': 'review',
+                                            'comment': 'Bad' } ] }
+        fields = parse_fields('year,reviews.comment,title.x')
+        reversed = self.transformer.transform(iter([resource]),
+                                              reverse=True, fields=fields)
+        assert list(reversed) == [ { '!type': 'book', 'year': '2010',
+                                     'title': 'Book Title',
+                                     'reviews': [ { '!type': 'review',
+                                                    'comment': 'Good' },
+                                                  { '!type': 'review',
+                                                    'comment': 'Bad' } ] } ]
+
+
+class TestFields(object):
+
+    def test_parse(self):
+        assert parse_fields('id') == { 'id': None }
+        assert parse_fields('id, author.name,author.id') == \
+                { 'id': None, 'author': { 'name': None, 'id': None } }
+        assert parse_fields('author.name,author') == { 'author': None }
+        assert parse_fields('author,author.name') == { 'author': None }
+        assert_raises(ValueError, parse_fields, '')
+        assert_raises(ValueError, parse_fields, 'id,,title')
+        assert_raises(ValueError, parse_fields, 'author.')
+
+    def test_format(self):
+        fields = parse_fields('title,author.name,author.id')
+        assert format_fields(fields) == ['author.id', 'author.name', 'title']
@@ -0,0 +1,233 @@
+#
+# This file is part of Python-REST. Python-REST is free software that is
+# made available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-REST is copyright (c) 2010 by the Python-REST authors. See the file
+# "AUTHORS" for a complete overview.
+
+import os
+import time
+import socket
+import httplib as http
+
+from threading import Thread
+from httplib import HTTPConnection, HTTPResponse
+from xml.etree.ElementTree import XML
+
+from nose.plugins.skip import SkipTest
+
+from rest.eventserver import make_server, Trigger
+from rest.test.test_application import BookApplication
+
+
+class TestEventServer(object):
+
+    def setUp(self):
+        self.server = make_server('localhost', 0, BookApplication(),
+                                  threads=2)
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.address = self.server.socket.getsockname()
+        self.client = HTTPConnection(*self.address)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+
+    def _read_response(self, sock, method='GET'):
+        response = HTTPResponse(sock, method=method)
+        response.begin()
+        body = response.read()
+        return response, body
+
+    def test_keep_alive(self):
+        client = self.client
+        for i in range(3):
+            client.request('GET', '/api/books/1')
+            response = client.getresponse()
+            assert response.status == http.OK
+            assert response.getheader('Connection') is None
+            book = XML(response.read())
+            assert book.findtext('id') == '1'
+        assert len(self.server.map) == 3  # server, trigger, connection
+
+    def test_pipelining(self):
+        sock = socket.create_connection(self.address)
+        requests = ''.join([ 'GET /api/books/%d HTTP/1.1\r\n'
+                             'Host: localhost\r\n\r\n' % i
+                             for i in (1, 2, 3) ])
+        sock.sendall(requests)
+        for i in (1, 2, 3):
+            response, body = self._read_response(sock)
+            assert response.status == http.OK
+            assert XML(body).findtext('id') == str(i)
+        sock.close()
+
+    def test_http10_close(self):
+        sock = socket.create_connection(self.address)
+        sock.sendall('GET /api/books/1 HTTP/1.0\r\n\r\n')
+        response, body = self._read_response(sock)
+        assert response.status == http.OK
+        assert response.getheader('Connection') == 'close'
+        assert sock.recv(1) == ''
+        sock.close()
+
+    def test_streamed(self):
+        client = self.client
+        client.request('GET', '/api/books?stream=1')
+        response = client.getresponse()
+        assert response.status == http.OK
+        assert response.getheader('Transfer-Encoding') == 'chunked'
+        assert len(XML(response.read()).findall('book')) == 3
+        client.request('GET', '/api/books/2')
+        response = client.getresponse()
+        assert response.status == http.OK
+        response.read()
+
+    def test_create_chunked(self):
+        client = self.client
+        client.putrequest('POST', '/api/books')
+        client.putheader('Content-Type', 'text/xml')
+        client.putheader('Transfer-Encoding', 'chunked')
+        client.endheaders()
+        body = '<book><id>4</id><title>Book Number 4</title></book>'
+        chunks = [ '%x\r\n%s\r\n' % (len(body[i:i+10]), body[i:i+10])
+                   for i in range(0, len(body), 10) ]
+        client.send(''.join(chunks) + '0\r\n\r\n')
+        response = client.getresponse()
+        assert response.status == http.CREATED
+        response.read()
+        client.request('GET', '/api/books/4')
+        response = client.getresponse()
+        assert response.status == http.OK
+        assert XML(response.read()).findtext('title') == 'Book Number 4'
+
+    def test_max_requests(self):
+        self.server.max_requests = 2
+        sock = socket.create_connection(self.address)
+        sock.sendall('GET /api/books/1 HTTP/1.1\r\n\r\n' * 3)
+        response, body = self._read_response(sock)
+        assert response.getheader('Connection') is None
+        response, body = self._read_response(sock)
+        assert response.getheader('Connection') == 'close'
+        assert sock.recv(1) == ''
+        sock.close()
+
+    def test_idle_timeout(self):
+        self.server.idle_timeout = 0.5
+        sock = socket.create_connection(self.address)
+        sock.settimeout(5)
+        start = time.time()
+        assert sock.recv(1) == ''
+        assert time.time() - start < 4
+        sock.close()
+
+    def test_bad_request(self):
+        sock = socket.create_connection(self.address)
+        sock.sendall('GET /api/books/1 HTTP/1.1\r\n\r\nGARBAGE\r\n\r\n')
+        response, body = self._read_response(sock)
+        assert response.status == http.OK
+        response, body = self._read_response(sock)
+        assert response.status == http.BAD_REQUEST
+        assert sock.recv(1) == ''
+        sock.close()
+
+    def test_head(self):
+        sock = socket.create_connection(self.address)
+        sock.sendall('HEAD /api/books/1 HTTP/1.1\r\n\r\n'
+                     'GET /api/books/1 HTTP/1.1\r\n\r\n')
+        response, body = self._read_response(sock, 'HEAD')
+        assert body == ''
+        response, body = self._read_response(sock)
+        assert response.status == http.OK
+        assert XML(body).findtext('id') == '1'
+        sock.close()
+
+    def test_trigger_close(self):
+        if not os.path.isdir('/proc/self/fd'):
+            raise SkipTest
+        before = len(os.listdir('/proc/self/fd'))
+        trigger = Trigger({})
+        trigger.close()
+        assert len(os.listdir('/proc/self/fd')) == before
+
+
+class StreamApplication(object):
+    """A WSGI application that returns a large streamed response."""
+
+    chunks = 1000
+    chunk_size = 65536
+
+    def __init__(self):
+        self.produced = 0
+
+    def __call__(self, environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return self.generate()
+
+    def generate(self):
+        for i in range(self.chunks):
+            self.produced += 1
+            yield 'x' * self.chunk_size
+
+    def shutdown(self):
+        pass
+
+
+class TestBackpressure(object):
+
+    def setUp(self):
+        self.app = StreamApplication()
+        self.server = make_server('localhost', 0, self.app, threads=1)
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.address = self.server.socket.getsockname()
+
+    def tearDown(self):
+        if self.thread.isAlive():
+            self.server.shutdown()
+            self.thread.join()
+
+    def test_slow_client(self):
+        sock = socket.create_connection(self.address)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 65536)
+        sock.sendall('GET / HTTP/1.1\r\n\r\n')
+        time.sleep(1)
+        # Only the data that fits in the socket buffers and the high
+        # water mark has been produced.
+        assert self.app.produced < self.app.chunks / 4
+        response = HTTPResponse(sock)
+        response.begin()
+        size = 0
+        while True:
+            data = response.read(1024*1024)
+            if not data:
+                break
+            size += len(data)
+        assert size == self.app.chunks * self.app.chunk_size
+        assert self.app.produced == self.app.chunks
+        sock.close()
+
+    def test_disconnect(self):
+        sock = socket.create_connection(self.address)
+        sock.sendall('GET / HTTP/1.1\r\n\r\n')
+        assert sock.recv(4096)
+        sock.close()
+        time.sleep(1)
+        produced = self.app.produced
+        assert produced < self.app.chunks / 4
+        time.sleep(0.5)
+        assert self.app.produced == produced
+
+    def test_shutdown(self):
+        self.server.idle_timeout = 30
+        sock = socket.create_connection(self.address)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 65536)
+        sock.sendall('GET / HTTP/1.1\r\n\r\n')
+        time.sleep(0.5)
+        start = time.time()
+        self.server.shutdown()
+        self.thread.join()
+        assert time.time() - start < 5
+        sock.close()
@@ -8,6 +8,7 @@
 
 from rest.http import *
 from rest.http import _parse_parameterized_list
+from rest import http
 from nose.tools import assert_raises
 
 
@@ -62,6 +63,24 @@ class TestParseParameterizedList(object):
         header = 'text/html; charset='
         assert_raises(ValueError, _parse_parameterized_list, header)
 
+    def test_whitespace(self):
+        header = 'text/html ;q=0.5 ,text/plain'
+        parsed = [('text/html ', [('q', '0.5 ')]), ('text/plain', [])]
+        assert _parse_parameterized_list(header) == parsed
+
+    def test_separators_in_quoted_parameter(self):
+        header = 'text/html; a="x,y;z=1", text/plain'
+        parsed = [('text/html', [('a', 'x,y;z=1')]), ('text/plain', [])]
+        assert _parse_parameterized_list(header) == parsed
+
+    def test_error_empty(self):
+        assert_raises(ValueError, _parse_parameterized_list, '')
+        assert_raises(ValueError, _parse_parameterized_list, 'text/html, ')
+
+    def test_error_after_quoted_parameter(self):
+        header = 'text/html; charset="utf8" x'
+        assert_raises(ValueError, _parse_parameterized_list, header)
+
 
 class TestParseContentType(object):
 
@@ -117,6 +136,33 @@ class TestSelectContentType(object):
         assert select_content_type(ctypes, accept) is None
 
 
+    def test_parsed_content_types(self):
+        accept = 'text/plain; q=0.5, text/xml'
+        ctypes = ('text/plain', 'text/xml; level=1')
+        parsed = map(parse_content_type, ctypes)
+        assert select_content_type(ctypes, accept, parsed) == ctypes[1]
+        assert parsed[1] == ('text', 'xml', {'level': '1'})
+
+    def test_cache(self):
+        cache = http.content_type_cache
+        cache.clear()
+        accept = 'text/html; q=0.5, text/plain'
+        ctypes = ['text/html', 'text/plain']
+        assert select_content_type(ctypes, accept) == 'text/plain'
+        assert (cache.hits, cache.misses) == (0, 1)
+        assert select_content_type(tuple(ctypes), accept) == 'text/plain'
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert select_content_type(ctypes, 'text/xml') is None
+        assert select_content_type(ctypes, 'text/xml') is None
+        assert (cache.hits, cache.misses) == (2, 2)
+
+    def test_cache_error(self):
+        http.content_type_cache.clear()
+        ctypes = ('text/html',)
+        assert_raises(ValueError, select_content_type, ctypes, 'text')
+        assert len(http.content_type_cache) == 0
+
+
 class TestSelectCharset(object):
 
     def test_simple(self):
@@ -143,3 +189,124 @@ class TestSelectCharset(object):
         accept = 'utf-8; q=0.8'
         charsets = ('utf-8', 'iso-8859-1')
         assert select_charset(charsets, accept) == charsets[1]
+
+    def test_cache(self):
+        cache = http.charset_cache
+        cache.clear()
+        charsets = ('utf-8', 'utf-16')
+        assert select_charset(charsets, 'utf-16') == 'utf-16'
+        assert select_charset(charsets, 'utf-16') == 'utf-16'
+        assert select_charset(charsets, 'utf-8') == 'utf-8'
+        assert (cache.hits, cache.misses) == (1, 2)
+
+
+class TestSelectEncoding(object):
+
+    def test_simple(self):
+        encodings = ('gzip', 'deflate')
+        assert select_encoding(encodings, 'gzip, deflate') == 'gzip'
+        assert select_encoding(encodings, 'deflate') == 'deflate'
+        assert select_encoding(encodings, 'br') is None
+
+    def test_quality_factor(self):
+        encodings = ('gzip', 'deflate')
+        accept = 'gzip;q=0.5, deflate'
+        assert select_encoding(encodings, accept) == 'deflate'
+        assert select_encoding(encodings, 'gzip;q=0, *') == 'deflate'
+        assert select_encoding(encodings, 'gzip;q=0') is None
+
+    def test_identity(self):
+        encodings = ('gzip', 'deflate')
+        accept = 'gzip;q=0.5, identity'
+        assert select_encoding(encodings, accept) is None
+        assert select_encoding(encodings, '*;q=0.5') == 'gzip'
+
+
+class TestMatchETag(object):
+
+    def test_match(self):
+        assert match_etag('"a"', '"a"')
+        assert match_etag('"a"', '"b", "a"')
+        assert match_etag('W/"a"', '"a"')
+        assert match_etag('"a"', 'W/"a"')
+        assert match_etag('"a"', '*')
+        assert not match_etag('"a"', '"b"')
+        assert not match_etag('"a"', '"a,b"')
+
+
+class TestCurrentDate(object):
+
+    def setup(self):
+        self.time = http.time
+
+    def teardown(self):
+        http.time = self.time
+
+    def test_current_date(self):
+        class FakeTime(object):
+            def time(self):
+                return self.now
+        http.time = FakeTime()
+        http.time.now = 1000000000.25
+        date = current_date()
+        assert date == 'Sun, 09 Sep 2001 01:46:40 -0000'
+        http.time.now = 1000000000.75
+        assert current_date() is date
+        http.time.now = 1000000001.0
+        assert current_date() == 'Sun, 09 Sep 2001 01:46:41 -0000'
+
+
+class TestHeaders(object):
+
+    def test_get_set(self):
+        headers = Headers([('Content-Type', 'text/plain')])
+        assert headers.get('content-type') == 'text/plain'
+        assert headers.get('CONTENT-TYPE') == 'text/plain'
+        assert headers.get('Accept') is None
+        assert headers.get('Accept', '*/*') == '*/*'
+        headers.set('content-type', 'text/xml')
+        assert headers.list == [('content-type', 'text/xml')]
+        assert 'Content-Type' in headers
+        assert ('content-type', 'text/xml') in headers
+        assert 'Accept' not in headers
+
+    def test_repeated(self):
+        headers = Headers()
+        headers.add('Set-Cookie', 'a=1')
+        headers.add('Server', 'test')
+        headers.add('Set-Cookie', 'b=2')
+        assert headers.get('set-cookie') == 'a=1'
+        assert headers.get_all('set-cookie') == ['a=1', 'b=2']
+        assert len(headers) == 3
+        headers.set('Set-Cookie', 'c=3')
+        assert headers.list == [('Set-Cookie', 'c=3'), ('Server', 'test')]
+        assert headers.get('Server') == 'test'
+
+    def test_remove(self):
+        headers = Headers([('A', '1'), ('B', '2'), ('a', '3'), ('C', '4')])
+        headers.remove('a')
+        assert list(headers) == [('B', '2'), ('C', '4')]
+        assert headers.get('C') == '4'
+        assert headers.get_all('A') == []
+        headers.remove('D')
+        assert len(headers) == 2
+
+    def test_copy(self):
+        headers = Headers([('A', '1')])
+        copy = headers.copy()
+        copy.add('A', '2')
+        copy.add('B', '3')
+        assert headers.list == [('A', '1')]
+        assert headers.get_all('A') == ['1']
+        assert copy.get_all('A') == ['1', '2']
+        assert 'B' not in headers
+
+    def test_wsgi_list(self):
+        headers = Headers()
+        wsgi = headers.list
+        headers.add('A', '1')
+        headers.add('A', '2')
+        headers.set('A', '3')
+        assert type(wsgi) is list
+        assert headers.list is wsgi
+        assert wsgi == [('A', '3')]
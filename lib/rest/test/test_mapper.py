@@ -37,6 +37,58 @@ class TestMapper(object):
         mapper.connect('/{a}/{b}')
         assert mapper.match('/foo/bar') == { 'a': 'foo', 'b': 'bar' }
 
+    def test_mixed_segment(self):
+        mapper = Mapper()
+        mapper.connect('/:a/{b}.xml')
+        mapper.connect('/:a/{b}-{c}')
+        assert mapper.match('/foo/bar.xml') == { 'a': 'foo', 'b': 'bar' }
+        assert mapper.match('/foo/bar-baz') == \
+                { 'a': 'foo', 'b': 'bar', 'c': 'baz' }
+        assert mapper.match('/foo/bar') == None
+
+    def test_first_route_wins(self):
+        mapper = Mapper()
+        mapper.connect('/:a/:b', action='first')
+        mapper.connect('/foo/bar', action='second')
+        assert mapper.match('/foo/bar')['action'] == 'first'
+        mapper = Mapper()
+        mapper.connect('/foo/bar', action='first')
+        mapper.connect('/:a/:b', action='second')
+        assert mapper.match('/foo/bar')['action'] == 'first'
+        assert mapper.match('/foo/baz')['action'] == 'second'
+
+    def test_method_fallthrough(self):
+        mapper = Mapper()
+        mapper.connect('/:a', method='GET', action='get')
+        mapper.connect('/:a/:b', method='GET', action='get')
+        mapper.connect('/foo/:b', method='POST', action='post')
+        mapper.connect('/:a/:b', action='any')
+        assert mapper.match('/foo/bar', 'GET')['action'] == 'get'
+        assert mapper.match('/foo/bar', 'POST')['action'] == 'post'
+        assert mapper.match('/baz/bar', 'POST')['action'] == 'any'
+
+    def test_empty_segment(self):
+        mapper = Mapper()
+        mapper.connect('/:a/:b')
+        assert mapper.match('/foo/') == None
+        assert mapper.match('//bar') == None
+
+    def test_same_as_linear(self):
+        mapper = Mapper()
+        mapper.connect('/api/:collection', method='GET', action='list')
+        mapper.connect('/api/:collection/:id', method='GET', action='show')
+        mapper.connect('/api/books/:id', method='GET', action='special')
+        mapper.connect('/api/:collection', action='other')
+        mapper.connect('/api/{collection}/:id.{format}', action='format')
+        for url in ('/api/books', '/api/books/1', '/api/authors/1',
+                    '/api/books/1.xml', '/api', '/api/books/1/2/3'):
+            for method in (None, 'GET', 'POST'):
+                for route in mapper.routes:
+                    linear = route._match(url, method)
+                    if linear:
+                        break
+                assert mapper.match(url, method) == linear
+
     def test_url_for(self):
         mapper = Mapper()
         mapper.connect('/:a/:b', action='test')
@@ -44,9 +96,69 @@ class TestMapper(object):
         assert mapper.url_for(action='tst', a='foo', b='bar') == None
         assert mapper.url_for(action='test', a='foo', b='bar', c='baz') == None
 
+    def test_url_for_index(self):
+        mapper = Mapper()
+        mapper.connect('/api/:collection', action='list')
+        mapper.connect('/api/:collection/:id', action='show')
+        mapper.connect('/api/books/:id', action='show', collection='books')
+        mapper.connect('/api/:collection/:id', action='update')
+        assert mapper.url_for(collection='books', action='list') == \
+                '/api/books'
+        assert mapper.url_for(collection='books', action='show', id=1) == \
+                '/api/books/1'
+        assert mapper.url_for(action='show', id=1) == None
+        assert mapper.url_for(collection='a', action='update', id=1) == \
+                '/api/a/1'
+        assert mapper.url_for(collection='a', action='delete', id=1) == None
+        assert mapper.url_for(collection='a') == None
+
+    def test_url_for_first_route_wins(self):
+        mapper = Mapper()
+        mapper.connect('/first/:id', action='show')
+        mapper.connect('/:collection/:id', action='show', collection='x')
+        mapper.connect('/second/:id', action='show')
+        assert mapper.url_for(action='show', id='1') == '/first/1'
+        assert mapper.url_for(action='show', collection='x', id='1') == \
+                '/x/1'
+
+    def test_url_for_literal(self):
+        mapper = Mapper()
+        mapper.connect('/100%/$a/{b}.xml', action='test')
+        assert mapper.url_for(action='test', b='c') == '/100%/$a/c.xml'
+
+    def test_url_for_unhashable(self):
+        mapper = Mapper()
+        mapper.connect('/:a', action=['test'])
+        mapper.connect('/x/:a', action='test')
+        assert mapper.url_for(action=['test'], a='foo') == '/foo'
+        assert mapper.url_for(action='test', a='foo') == '/x/foo'
+
     def test_methods_for(self):
         mapper = Mapper()
         mapper.connect('/:a/:b', action='test', method='GET')
         assert mapper.methods_for('/foo/bar') == ['GET']
         mapper.connect('/:a/:b', action='test', method='POST')
         assert mapper.methods_for('/foo/bar') == ['GET', 'POST']
+
+    def test_lookup(self):
+        mapper = Mapper()
+        mapper.connect('/api/:collection', method='GET', action='list')
+        mapper.connect('/api/:collection', method='POST', action='create')
+        mapper.connect('/api/:collection/:id', method='GET', action='show')
+        mapper.connect('/api/books/:id', method='PUT', action='update')
+        mapper.connect('/api/:collection/:id', method='GET', action='dup')
+        match, methods = mapper.lookup('/api/books', 'GET')
+        assert match == { 'collection': 'books', 'action': 'list' }
+        assert methods == ('GET', 'POST')
+        match, methods = mapper.lookup('/api/books', 'PUT')
+        assert match is None
+        assert methods == ('GET', 'POST')
+        match, methods = mapper.lookup('/api/books/1', 'PUT')
+        assert match == { 'id': '1', 'action': 'update' }
+        assert methods == ('GET', 'PUT')
+        match, methods = mapper.lookup('/api/authors/1', 'PUT')
+        assert match is None
+        assert methods == ('GET',)
+        match, methods = mapper.lookup('/foo', 'GET')
+        assert match is None
+        assert methods == ()
@@ -8,7 +8,9 @@
 
 import time
 import threading
-from rest.proxy import ObjectProxy
+from rest.proxy import ObjectProxy, ContextProxy
+from rest.context import RequestContext, activate_context, current_context
+from nose.tools import assert_raises
 
 
 class Dict(dict):
@@ -49,3 +51,66 @@ class TestProxy(object):
         t1.join(); t2.join()
         assert 'test' not in proxy
         assert result == [0, 0]
+
+
+class Application(object):
+
+    def __init__(self):
+        self.mapper = Dict()
+        self.globals = { 'formatter': Dict() }
+
+
+class TestContextProxy(object):
+
+    def test_access(self):
+        app = Application()
+        request = Dict()
+        context = RequestContext(app, None, request, Dict())
+        proxy = ContextProxy('request')
+        assert proxy._current_object() is None
+        previous = activate_context(context)
+        try:
+            assert proxy._current_object() is request
+            proxy.test = 'foo'
+            assert request.test == 'foo'
+            proxy['test2'] = 'bar'
+            assert request['test2'] == 'bar'
+            assert 'test2' in proxy
+            assert ContextProxy('mapper')._current_object() is app.mapper
+            formatter = ContextProxy('formatter')
+            assert formatter._current_object() is app.globals['formatter']
+            assert_raises(AttributeError, getattr,
+                          ContextProxy('unknown'), 'foo')
+        finally:
+            activate_context(previous)
+        assert current_context() is previous
+
+    def test_nesting(self):
+        outer = RequestContext(Application(), None, Dict(), Dict())
+        inner = RequestContext(Application(), None, Dict(), Dict())
+        previous = activate_context(outer)
+        saved = activate_context(inner)
+        assert saved is outer
+        assert current_context() is inner
+        activate_context(saved)
+        assert current_context() is outer
+        activate_context(previous)
+
+    def _do_test_separation(self, proxy, id, result):
+        context = RequestContext(Application(), None, Dict(), Dict())
+        activate_context(context)
+        proxy['test'] = id
+        time.sleep(0.5)  # poor man's synchronization
+        result.append(proxy['test'] - id)
+        activate_context(None)
+
+    def test_separation(self):
+        proxy = ContextProxy('request')
+        result = []
+        t1 = threading.Thread(target=self._do_test_separation,
+                              args=(proxy, 1, result))
+        t2 = threading.Thread(target=self._do_test_separation,
+                              args=(proxy, 2, result))
+        t1.start(); t2.start()
+        t1.join(); t2.join()
+        assert result == [0, 0]
@@ -6,7 +6,10 @@
 # Python-REST is copyright (c) 2010 by the Python-REST authors. See the file
 # "AUTHORS" for a complete overview.
 
-from rest import Request
+from StringIO import StringIO
+
+from rest import Request, HTTPReturn
+from nose.tools import assert_raises
 
 
 environ = {
@@ -55,3 +58,124 @@ class TestRequest(object):
         assert request.header('header-3') == 'value3'
         assert request.header('HEADER-3') == 'value3'
         assert len(request.headers) == 5
+
+    def test_lazy(self):
+        request = Request(environ)
+        for name in ('uri', 'args', 'headers', 'username', 'password'):
+            assert name not in request.__dict__
+        assert request.header('Header-1') == 'value1'
+        assert 'headers' in request.__dict__
+        assert 'args' not in request.__dict__
+        assert request.args is request.args
+
+    def test_basic_auth(self):
+        env = environ.copy()
+        env['HTTP_AUTHORIZATION'] = 'Basic %s' % \
+                'jbloggs:secret'.encode('base64').strip()
+        request = Request(env)
+        assert request.username == 'jbloggs'
+        assert request.password == 'secret'
+        env['HTTP_AUTHORIZATION'] = 'Basic !!!'
+        request = Request(env)
+        assert request.username is None
+        assert request.password is None
+        request = Request(environ)
+        assert request.username is None
+
+    def test_preferred(self):
+        env = environ.copy()
+        env['HTTP_ACCEPT'] = 'text/plain; q=0.5, application/json'
+        env['HTTP_ACCEPT_CHARSET'] = 'utf-8; q=0.5, utf-16'
+        request = Request(env)
+        ctype = request.preferred_content_type(('text/plain',
+                                                'application/json'))
+        assert ctype == 'application/json'
+        charset = request.preferred_charset(('utf-8', 'utf-16'))
+        assert charset == 'utf-16'
+
+    def _chunked_request(self, body):
+        env = environ.copy()
+        del env['CONTENT_LENGTH']
+        env['HTTP_TRANSFER_ENCODING'] = 'chunked'
+        env['wsgi.input'] = StringIO(body)
+        return Request(env)
+
+    def test_read_chunked(self):
+        body = '5\r\nHello\r\n7;ext=1\r\n, World\r\n0\r\n\r\nNEXT'
+        request = self._chunked_request(body)
+        assert request.read() == 'Hello, World'
+        assert request.read() == ''
+        assert request.environ['wsgi.input'].read() == 'NEXT'
+
+    def test_read_chunked_size(self):
+        body = '5\r\nHello\r\n7\r\n, World\r\n0\r\nTrailer: x\r\n\r\n'
+        request = self._chunked_request(body)
+        assert request.read(3) == 'Hel'
+        assert request.read(4) == 'lo, '
+        assert request.read(100) == 'World'
+        assert request.read(100) == ''
+        assert request.bytes_read == 12
+
+    def test_read_chunked_errors(self):
+        request = self._chunked_request('x\r\nHello\r\n0\r\n\r\n')
+        assert_raises(HTTPReturn, request.read)
+        request = self._chunked_request('10\r\nHello')
+        assert_raises(HTTPReturn, request.read)
+
+    def test_unsupported_transfer_encoding(self):
+        env = environ.copy()
+        env['HTTP_TRANSFER_ENCODING'] = 'gzip'
+        request = Request(env)
+        try:
+            request.read()
+        except HTTPReturn, e:
+            assert e.status == 501
+        else:
+            assert False
+
+    def test_body(self):
+        request = self._chunked_request('5\r\nHello\r\n0\r\n\r\n')
+        assert request.body
+        assert list(request.body) == ['Hello']
+        request = self._chunked_request('0\r\n\r\n')
+        assert not request.body
+        env = environ.copy()
+        env['wsgi.input'] = StringIO('01234567890123456789')
+        request = Request(env)
+        assert request.body
+        assert request.body.read(5) == '01234'
+        assert request.body.read() == '567890123456789'
+
+    def test_limit(self):
+        request = Request(environ)
+        request.limit(None)
+        request.limit(20)
+        try:
+            request.limit(19)
+        except HTTPReturn, e:
+            assert e.status == 413
+        else:
+            assert False
+
+    def test_limit_chunked(self):
+        request = self._chunked_request('5\r\nHello\r\n7\r\n, World\r\n'
+                                        '0\r\n\r\n')
+        request.limit(10)
+        assert request.read(5) == 'Hello'
+        try:
+            request.read()
+        except HTTPReturn, e:
+            assert e.status == 413
+        else:
+            assert False
+
+    def test_spool(self):
+        env = environ.copy()
+        env['wsgi.input'] = StringIO('01234567890123456789')
+        request = Request(env)
+        spool = request.spool(5)
+        assert spool.read() == '01234567890123456789'
+        spool.close()
+        env['CONTENT_LENGTH'] = '0'
+        request = Request(env)
+        assert request.spool(5) == ''
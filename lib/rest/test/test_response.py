@@ -29,3 +29,25 @@ class TestResponse(object):
         assert response.header('header-1') == 'value1'
         assert response.header('HEADER-1') == 'value1'
         assert len(response.headers) == nheaders+1
+
+    def test_repeated_headers(self):
+        response = Response(environ)
+        response.add_header('Set-Cookie', 'a=1')
+        response.add_header('Set-Cookie', 'b=2')
+        assert response.header('set-cookie') == 'a=1'
+        assert response.headers.get_all('Set-Cookie') == ['a=1', 'b=2']
+        assert ('Set-Cookie', 'b=2') in response.headers.list
+
+    def test_default_headers(self):
+        response = Response(environ)
+        assert response.header('Server').startswith('python-rest/')
+        assert response.header('Date') is not None
+        response.set_header('Server', 'test')
+        response = Response(environ)
+        assert response.header('Server').startswith('python-rest/')
+        Response.default_headers.add('X-Test', 'value')
+        try:
+            response = Response(environ)
+            assert response.header('X-Test') == 'value'
+        finally:
+            Response.default_headers.remove('X-Test')
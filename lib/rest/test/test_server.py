@@ -0,0 +1,304 @@
+#
+# This file is part of Python-REST. Python-REST is free software that is
+# made available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-REST is copyright (c) 2010 by the Python-REST authors. See the file
+# "AUTHORS" for a complete overview.
+
+import os
+import time
+import yaml
+import signal
+import socket
+import httplib as http
+
+from threading import Thread, Event
+from httplib import HTTPConnection, HTTPResponse
+from xml.etree.ElementTree import XML
+
+from rest import Application, Collection, Resource
+from rest.server import make_server, ThreadedRESTServer, PreforkServer
+from rest.test.test_application import BookApplication
+
+
+class SlowCollection(Collection):
+
+    name = 'items'
+    contains = 'item'
+
+    entity_transform = """
+        $!type <=> $!type
+        $id <=> $id
+        """
+
+    def __init__(self):
+        self.started = Event()
+        self.release = Event()
+
+    def show(self, id):
+        if id == 'slow':
+            self.started.set()
+            self.release.wait(10)
+        return Resource('item', { 'id': id })
+
+
+class SlowApplication(Application):
+
+    def setup_collections(self):
+        self.collection = SlowCollection()
+        self.add_collection(self.collection)
+
+
+class TestThreadedServer(object):
+
+    def setUp(self):
+        self.app = SlowApplication()
+        self.server = make_server('localhost', 0, self.app, threads=1,
+                                  queue_size=1)
+        self.server.RequestHandlerClass.log_request = lambda *args: None
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.start()
+        time.sleep(0.5)
+        self.address = self.server.socket.getsockname()
+
+    def tearDown(self):
+        self.app.collection.release.set()
+        self.server.shutdown()
+        self.thread.join()
+
+    def _start(self, url):
+        client = HTTPConnection(*self.address)
+        client.request('GET', url)
+        return client
+
+    def test_threaded(self):
+        assert isinstance(self.server, ThreadedRESTServer)
+        client = self._start('/api/items/1')
+        response = client.getresponse()
+        assert response.status == http.OK
+
+    def test_reject(self):
+        busy = self._start('/api/items/slow')
+        assert self.app.collection.started.wait(5)
+        queued = self._start('/api/items/1')
+        time.sleep(0.5)  # make sure the request is queued
+        rejected = self._start('/api/items/2')
+        response = rejected.getresponse()
+        assert response.status == http.SERVICE_UNAVAILABLE
+        assert response.getheader('Retry-After') == '1'
+        self.app.collection.release.set()
+        response = busy.getresponse()
+        assert response.status == http.OK
+        response = queued.getresponse()
+        assert response.status == http.OK
+
+    def test_reject_does_not_block(self):
+        busy = self._start('/api/items/slow')
+        assert self.app.collection.started.wait(5)
+        queued = self._start('/api/items/1')
+        time.sleep(0.5)
+        start = time.time()
+        for i in range(3):
+            rejected = self._start('/api/items/2')
+            response = rejected.getresponse()
+            assert response.status == http.SERVICE_UNAVAILABLE
+        # The rejected clients keep their connection open. This must not
+        # hold up accepting the next connection.
+        assert time.time() - start < self.server.reject_timeout
+        self.app.collection.release.set()
+        assert busy.getresponse().status == http.OK
+        assert queued.getresponse().status == http.OK
+
+
+class PidCollection(Collection):
+
+    name = 'pids'
+    contains = 'pid'
+
+    entity_transform = """
+        $!type <=> $!type
+        $pid <=> $pid
+        """
+
+    def show(self, id):
+        return Resource('pid', { 'pid': str(os.getpid()) })
+
+
+class PidApplication(Application):
+
+    def setup_collections(self):
+        self.add_collection(PidCollection())
+
+
+class TestPreforkServer(object):
+
+    def setUp(self):
+        server = make_server('localhost', 0, PidApplication())
+        server.RequestHandlerClass.log_request = lambda *args: None
+        self.address = server.socket.getsockname()
+        self.master = os.fork()
+        if self.master == 0:
+            try:
+                prefork = PreforkServer(server, workers=1, max_requests=2)
+                prefork.poll_interval = 0.1
+                prefork.serve_forever()
+            finally:
+                os._exit(0)
+        server.server_close()
+
+    def tearDown(self):
+        os.kill(self.master, signal.SIGTERM)
+        pid, status = os.waitpid(self.master, 0)
+        assert status == 0
+
+    def _worker(self):
+        client = HTTPConnection(*self.address)
+        client.request('GET', '/api/pids/1',
+                       headers={ 'Accept': 'text/x-yaml' })
+        response = client.getresponse()
+        assert response.status == http.OK
+        return int(yaml.load(response.read())['pid'])
+
+    def test_max_requests(self):
+        pid = self._worker()
+        assert pid not in (os.getpid(), self.master)
+        assert self._worker() == pid
+        assert self._worker() != pid
+
+    def test_respawn(self):
+        pid = self._worker()
+        os.kill(pid, signal.SIGKILL)
+        assert self._worker() not in (pid, self.master)
+
+    def test_reload(self):
+        pid = self._worker()
+        os.kill(self.master, signal.SIGHUP)
+        time.sleep(0.5)
+        assert self._worker() != pid
+
+
+class TestKeepAlive(object):
+
+    def setUp(self):
+        self.server = make_server('localhost', 0, BookApplication(),
+                                  threads=2)
+        self.server.RequestHandlerClass.log_request = lambda *args: None
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.address = self.server.socket.getsockname()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+
+    def _read_response(self, sock):
+        response = HTTPResponse(sock)
+        response.begin()
+        return response, response.read()
+
+    def test_reuse(self):
+        client = HTTPConnection(*self.address)
+        client.request('GET', '/api/books/1')
+        response = client.getresponse()
+        assert response.getheader('Connection') is None
+        response.read()
+        sock = client.sock
+        client.request('GET', '/api/books/2')
+        response = client.getresponse()
+        assert response.status == http.OK
+        assert XML(response.read()).findtext('id') == '2'
+        assert client.sock is sock
+
+    def test_pipelining(self):
+        sock = socket.create_connection(self.address)
+        sock.sendall(''.join([ 'GET /api/books/%d HTTP/1.1\r\n\r\n' % i
+                               for i in (1, 2, 3) ]))
+        for i in (1, 2, 3):
+            response, body = self._read_response(sock)
+            assert response.status == http.OK
+            assert XML(body).findtext('id') == str(i)
+        sock.close()
+
+    def test_head(self):
+        client = HTTPConnection(*self.address)
+        for url in ('/api/books/1', '/api/books'):
+            client.request('HEAD', url)
+            response = client.getresponse()
+            assert response.read() == ''
+            client.request('GET', '/api/books/2')
+            response = client.getresponse()
+            assert response.status == http.OK
+            assert XML(response.read()).findtext('id') == '2'
+        sock = socket.create_connection(self.address)
+        sock.sendall('HEAD /api/books/1 HTTP/1.1\r\n\r\n'
+                     'GET /api/books/1 HTTP/1.1\r\n\r\n')
+        response = HTTPResponse(sock, method='HEAD')
+        response.begin()
+        assert response.getheader('Content-Length') is not None
+        response, body = self._read_response(sock)
+        assert response.status == http.OK
+        sock.close()
+
+    def test_unread_entity(self):
+        sock = socket.create_connection(self.address)
+        body = '<book><id>4</id></book>'
+        sock.sendall('PUT /api/authors/1 HTTP/1.1\r\n'
+                     'Content-Type: text/xml\r\n'
+                     'Content-Length: %d\r\n\r\n%s'
+                     'GET /api/books/1 HTTP/1.1\r\n\r\n' % (len(body), body))
+        response, body = self._read_response(sock)
+        assert response.status == http.NOT_FOUND
+        response, body = self._read_response(sock)
+        assert response.status == http.OK
+        sock.close()
+
+    def test_http10(self):
+        sock = socket.create_connection(self.address)
+        sock.sendall('GET /api/books/1 HTTP/1.0\r\n\r\n')
+        response, body = self._read_response(sock)
+        assert response.getheader('Connection') == 'close'
+        assert sock.recv(1) == ''
+        sock.close()
+        sock = socket.create_connection(self.address)
+        sock.sendall('GET /api/books/1 HTTP/1.0\r\n'
+                     'Connection: keep-alive\r\n\r\n' * 2)
+        response, body = self._read_response(sock)
+        assert response.getheader('Connection') == 'keep-alive'
+        response, body = self._read_response(sock)
+        assert response.status == http.OK
+        sock.close()
+
+    def test_max_requests(self):
+        self.server.max_keep_alive_requests = 2
+        sock = socket.create_connection(self.address)
+        sock.sendall('GET /api/books/1 HTTP/1.1\r\n\r\n' * 3)
+        response, body = self._read_response(sock)
+        assert response.getheader('Connection') is None
+        response, body = self._read_response(sock)
+        assert response.getheader('Connection') == 'close'
+        assert sock.recv(1) == ''
+        sock.close()
+
+    def test_idle_timeout(self):
+        self.server.keep_alive_timeout = 0.5
+        client = HTTPConnection(*self.address)
+        client.request('GET', '/api/books/1')
+        response = client.getresponse()
+        response.read()
+        client.sock.settimeout(5)
+        assert client.sock.recv(1) == ''
+
+    def test_single_threaded(self):
+        server = make_server('localhost', 0, BookApplication())
+        thread = Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            client = HTTPConnection(*server.socket.getsockname())
+            client.request('GET', '/api/books/1')
+            response = client.getresponse()
+            assert response.status == http.OK
+            assert response.getheader('Connection') == 'close'
+        finally:
+            server.shutdown()
+            thread.join()
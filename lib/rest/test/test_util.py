@@ -0,0 +1,55 @@
+#
+# This file is part of Python-REST. Python-REST is free software that is
+# made available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-REST is copyright (c) 2010 by the Python-REST authors. See the file
+# "AUTHORS" for a complete overview.
+
+from rest.util import LRUCache
+
+
+class TestLRUCache(object):
+
+    def test_get_put(self):
+        cache = LRUCache(2)
+        assert cache.get('a') is None
+        assert cache.get('a', 0) == 0
+        cache.put('a', 1)
+        assert cache.get('a') == 1
+        cache.put('a', 2)
+        assert cache.get('a') == 2
+        assert len(cache) == 1
+        assert (cache.hits, cache.misses) == (2, 2)
+
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        assert 'a' in cache
+        assert 'b' not in cache
+        assert 'c' in cache
+        assert len(cache) == 2
+
+    def test_clear(self):
+        cache = LRUCache()
+        cache.put('a', 1)
+        cache.get('a')
+        cache.clear()
+        assert len(cache) == 0
+        assert (cache.hits, cache.misses) == (0, 0)
+
+    def test_remove_keys(self):
+        cache = LRUCache()
+        for key in 'abc':
+            cache.put(key, key)
+        cache.get('a')
+        assert cache.keys() == ['b', 'c', 'a']
+        cache.remove('c')
+        cache.remove('d')
+        assert cache.keys() == ['b', 'a']
+        assert 'c' not in cache
+        cache.put('d', 'd')
+        assert cache.keys() == ['b', 'a', 'd']
@@ -8,6 +8,7 @@
 
 import sys
 import logging
+import threading
 import yaml
 
 from rest.api import request
@@ -24,6 +25,125 @@ def make_absolute(relurl):
     return url
 
 
+def is_iterator(object):
+    """Return True if `object' is an iterator (e.g. a generator) rather
+    than a materialized value."""
+    return hasattr(object, 'next') and hasattr(object, '__iter__')
+
+
+class lazy_property(object):
+    """A read-only property that is computed on first access. The value is
+    then stored in the instance, so that later accesses are plain attribute
+    lookups."""
+
+    def __init__(self, function):
+        self.function = function
+        self.__name__ = function.__name__
+        self.__doc__ = function.__doc__
+
+    def __get__(self, object, type=None):
+        if object is None:
+            return self
+        value = object.__dict__[self.__name__] = self.function(object)
+        return value
+
+
+class LRUCache(object):
+    """A thread-safe mapping that holds at most `size' entries. When it is
+    full, the least recently used entry is discarded.
+
+    The number of cache hits and misses of get() are kept in the `hits'
+    and `misses' attributes.
+    """
+
+    # Entries are kept in a circular doubly linked list in order of use,
+    # with links of the form [previous, next, key, value]. The most recently
+    # used entry is the one before the root link.
+
+    def __init__(self, size=128):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._root = root = []
+        root[:] = [root, root, None, None]
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the value for `key', or `default' if it is not cached."""
+        with self._lock:
+            link = self._entries.get(key)
+            if link is None:
+                self.misses += 1
+                return default
+            previous, next, key, value = link
+            previous[1] = next
+            next[0] = previous
+            root = self._root
+            last = root[0]
+            last[1] = root[0] = link
+            link[0] = last
+            link[1] = root
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Store `value' under `key'."""
+        with self._lock:
+            link = self._entries.pop(key, None)
+            if link is not None:
+                link[0][1] = link[1]
+                link[1][0] = link[0]
+            root = self._root
+            last = root[0]
+            link = last[1] = root[0] = [last, root, key, value]
+            self._entries[key] = link
+            while len(self._entries) > self.size:
+                oldest = root[1]
+                root[1] = oldest[1]
+                oldest[1][0] = root
+                del self._entries[oldest[2]]
+
+    def remove(self, key):
+        """Remove the entry for `key', if any."""
+        with self._lock:
+            link = self._entries.pop(key, None)
+            if link is not None:
+                link[0][1] = link[1]
+                link[1][0] = link[0]
+
+    def items(self):
+        """Return a list of (key, value) tuples, from least to most recently
+        used."""
+        with self._lock:
+            items = []
+            root = self._root
+            link = root[1]
+            while link is not root:
+                items.append((link[2], link[3]))
+                link = link[1]
+            return items
+
+    def keys(self):
+        """Return a list of the keys, from least to most recently used."""
+        return [ key for key,value in self.items() ]
+
+    def clear(self):
+        """Remove all entries and reset the hit and miss counters."""
+        with self._lock:
+            self._entries.clear()
+            root = self._root
+            root[:] = [root, root, None, None]
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+
 def setup_logging(debug):
     """Set up logging."""
     if debug: